@@ -1,4 +1,4 @@
-import sqlite3
+from storage import get_backend
 
 products = [
     ("TTT-SOL-BLASOL-PLUS", "Black Solid", "914521239173"),
@@ -89,9 +89,10 @@ products = [
     ("TTT-STR-BWWHT-SHORT", "Black and White Stripes (SHORT)", "143511060530")
 ]
 
-conn = sqlite3.connect("barcodes.db")
-cursor = conn.cursor()
-cursor.executemany("INSERT OR IGNORE INTO products (sku, name, barcode) VALUES (?, ?, ?)", products)
+db = get_backend()
+db.create_tables()
+conn = db.connect()
+db.bulk_insert(conn, "products", ["sku", "name", "barcode"], products, ignore_conflicts=True)
 conn.commit()
 conn.close()
 
@@ -1,15 +1,16 @@
 import sqlite3
+from auth import hash_password
 
 conn = sqlite3.connect("barcodes.db")
 cursor = conn.cursor()
 
 # Add admin user (if doesn't already exist)
 cursor.execute("INSERT OR IGNORE INTO users (username, password, role, hub_id) VALUES (?, ?, ?, ?)",
-               ("admin", "admin123", "admin", 1))
+               ("admin", hash_password("admin123"), "admin", 1))
 
 # Add hub manager (user role)
 cursor.execute("INSERT OR IGNORE INTO users (username, password, role, hub_id) VALUES (?, ?, ?, ?)",
-               ("hub2mgr", "hub2pass", "user", 2))
+               ("hub2mgr", hash_password("hub2pass"), "user", 2))
 
 conn.commit()
 conn.close()
@@ -1,39 +1,55 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
+import time
 from datetime import datetime
 import altair as alt
+from sku_index import get_sku_index, refresh_sku_index
+from snapshot import get_snapshot_connection, snapshot_time, snapshot_age, SNAPSHOT_FILE, MAX_AGE_SECONDS
+from storage import get_backend, prepare_database
+from sharding import (sharding_enabled, get_shard_connection, begin_shard_write,
+                      fetch_shard_balances, fetch_all_shard_balances, fetch_shard_audit_log, verify_shard_audits)
+from hub_kpis import get_hub_settings, save_hub_settings, rebuild_kpis, fetch_kpis
+from change_feed import LiveBalances, latest_log_id, POLL_SECONDS
+from cycle_count import (ADJUST, parse_scanned_counts, parse_count_csv, compute_variances,
+                         record_cycle_count, adjustment_rows)
+from log_cache import get_log_cache
+from auth import authenticate, hash_password_async, migrate_plaintext_passwords, sessions, client_binding
+from supplier_portal import (assign_supplier, fetch_open_requests, confirm_quantities, register_shipments,
+                             fetch_lead_times)
+from reports import COMPANY, recent_periods, high_water, find_artifacts, generate_report
+from stock_control import (FULFILLED, RELEASED, DEFAULT_HOLD_MINUTES, InsufficientStock,
+                           enforcement_enabled, reserve_stock, release_reservation, fetch_reservations,
+                           fetch_stock_levels, lock_hub_stock)
+from bundles import fetch_components, set_components
+from chart_data import downsample_lines, downsample_bars, payload_bytes, TOP_SERIES, BUCKET_LABELS
+from retention import search_archive
+from audit import append_audit, verify_audit_chain, latest_checkpoint
+from postings import post_movement, post_lines, post_bundle
+from permissions import (ALL_HUBS, VIEW_INVENTORY, LOG_INVENTORY, CYCLE_COUNT, SUPPLY_NOTES, VIEW_SHRINKAGE,
+                         REPLY_REQUESTS, SEND_MESSAGES, MANAGE_SKUS, MANAGE_USERS, HUB_SETTINGS, SUPPLIER_PORTAL, VIEW_AUDIT, VIEW_REPORTS,
+                         READ_NOTIFICATIONS, PermissionDenied, resolve_permissions, set_managed_hubs)
 
 DB_FILE = "barcodes.db"
 st.set_page_config(page_title="TTT Inventory System", page_icon="🧦", layout="wide")
 
-# --- AUTO CREATE TABLES ---
+# --- STORAGE BACKEND (SQLite by default, PostgreSQL via TTT_DATABASE_URL) ---
+db = get_backend(DB_FILE)
+# Optional per-hub log/balance files (SQLite only); the catalog stays in DB_FILE
+SHARDED = db.name == "sqlite" and sharding_enabled()
+
+# --- AUTO CREATE TABLES (once per process, not on every rerun) ---
 def create_tables():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, password TEXT, email TEXT, role TEXT, hub_id INTEGER, active INTEGER DEFAULT 1
-    )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS hubs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT
-    )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS products (
-        sku TEXT PRIMARY KEY, name TEXT, barcode TEXT UNIQUE
-    )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS inventory_log (
-        id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME, sku TEXT, action TEXT, quantity INTEGER, hub INTEGER, user_id INTEGER, comment TEXT
-    )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS hub_skus (
-        id INTEGER PRIMARY KEY AUTOINCREMENT, sku TEXT, hub_id INTEGER, UNIQUE (sku, hub_id)
-    )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS supply_requests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT, hub_id INTEGER, username TEXT, notes TEXT, timestamp DATETIME, response TEXT, admin TEXT
-    )""")
-    c.execute("""CREATE TABLE IF NOT EXISTS notifications (
-        id INTEGER PRIMARY KEY AUTOINCREMENT, created DATETIME, user_role TEXT, user_id INTEGER, message TEXT
-    )""")
-    conn.commit()
-    conn.close()
+    if prepare_database(db, SHARDED):
+        upgrade_passwords()
+
+# Hash any plaintext passwords left from before hashed credentials
+def upgrade_passwords():
+    conn = db.connect()
+    try:
+        migrate_plaintext_passwords(conn)
+        conn.commit()
+    finally:
+        conn.close()
 create_tables()
 
 try:
@@ -42,35 +58,95 @@ except Exception:
     st.info("Logo image not found.")
 
 def get_connection():
-    return sqlite3.connect(DB_FILE, check_same_thread=False)
+    return db.connect()
+
+# Analytical reads go to the periodic snapshot so they don't contend with hub writes
+# (PostgreSQL readers don't block writers, so there they stay on the primary)
+def get_analytics_connection():
+    if db.name != "sqlite":
+        return db.connect()
+    return get_snapshot_connection(db.path, SNAPSHOT_FILE)
+
+# Hub-scoped log reads go to the hub's own shard in sharded mode
+def get_log_connection(hub_id):
+    if SHARDED:
+        return get_shard_connection(hub_id)
+    return get_connection()
+
+def render_snapshot_freshness():
+    if db.name != "sqlite":
+        return
+    refreshed = snapshot_time(SNAPSHOT_FILE)
+    if refreshed:
+        st.caption(f"🕒 Data as of {refreshed:%Y-%m-%d %H:%M:%S} (refreshed every few minutes)")
+        if snapshot_age(SNAPSHOT_FILE) > 3 * MAX_AGE_SECONDS:
+            st.warning("Analytics snapshot is stale; is the snapshot worker (python snapshot.py --interval 300) running?")
 
 def login(username, password):
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, role, hub_id FROM users WHERE username=? AND password=? AND active=1", (username, password))
-    result = c.fetchone()
-    conn.close()
-    return result
+    try:
+        return authenticate(conn, username, password)
+    finally:
+        conn.close()
+
+def fetch_account(user_id):
+    # (role, hub_id, active), or None if the user no longer exists
+    conn = get_connection()
+    try:
+        c = conn.cursor()
+        c.execute("SELECT role, hub_id, active FROM users WHERE id=?", (user_id,))
+        return c.fetchone()
+    finally:
+        conn.close()
+
+def current_client():
+    return client_binding(st.context.headers.get("User-Agent"), st.context.ip_address)
+
+# --- Authorization: grants resolved once per session, checked in memory by every data function ---
+def current_permissions():
+    perms = st.session_state.get("permissions")
+    if perms is None or perms.user_id != st.session_state.user["id"]:
+        conn = get_connection()
+        try:
+            perms = resolve_permissions(conn, st.session_state.user)
+        finally:
+            conn.close()
+        st.session_state.permissions = perms
+    return perms
+
+def require(action, hub_id=ALL_HUBS):
+    current_permissions().require(action, hub_id)
+
+# Audit records go on the same connection as the change they describe, before its commit
+def audit(conn, entity, entity_id, action, details=None):
+    append_audit(conn, st.session_state.user["id"], entity, entity_id, action, details)
 
 def fetch_all_hubs():
+    # Every hub for admins; a manager's own hubs otherwise
+    hubs = current_permissions().hubs(VIEW_INVENTORY)
+    if hubs is not None and not hubs:
+        raise PermissionDenied("no hubs to view")
     conn = get_connection()
     df = pd.read_sql_query("SELECT id, name FROM hubs", conn)
     conn.close()
-    return df
+    return df if hubs is None else df[df["id"].isin(hubs)]
 
 def fetch_all_products():
+    require(REPLY_REQUESTS)
     conn = get_connection()
     df = pd.read_sql_query("SELECT sku, name FROM products", conn)
     conn.close()
     return df
 
 def fetch_my_supply_requests(hub_id):
+    require(SUPPLY_NOTES, hub_id)
     conn = get_connection()
     df = pd.read_sql_query("SELECT * FROM supply_requests WHERE hub_id=? ORDER BY timestamp DESC", conn, params=(hub_id,))
     conn.close()
     return df
 
 def insert_supply_request(hub_id, username, notes):
+    require(SUPPLY_NOTES, hub_id)
     conn = get_connection()
     try:
         c = conn.cursor()
@@ -83,6 +159,7 @@ def insert_supply_request(hub_id, username, notes):
         conn.close()
 
 def reply_to_supply_request(request_id, reply_text, admin_username):
+    require(REPLY_REQUESTS)
     conn = get_connection()
     try:
         c = conn.cursor()
@@ -95,11 +172,20 @@ def reply_to_supply_request(request_id, reply_text, admin_username):
         conn.close()
 
 def fetch_inventory_for_hub(hub_id):
+    require(VIEW_INVENTORY, hub_id)
+    if SHARDED:
+        balances = fetch_shard_balances(hub_id)
+        return [(name, sku, barcode, balances.get(sku, 0)) for name, sku, barcode in fetch_skus_for_hub(hub_id)]
     conn = get_connection()
+    data = query_inventory_for_hub(conn, hub_id)
+    conn.close()
+    return data
+
+def query_inventory_for_hub(conn, hub_id):
     c = conn.cursor()
     c.execute("""
         SELECT p.name, p.sku, p.barcode,
-        COALESCE(SUM(CASE WHEN il.action='IN' THEN il.quantity ELSE 0 END),0) -
+        COALESCE(SUM(CASE WHEN il.action IN ('IN', 'ADJUST') THEN il.quantity ELSE 0 END),0) -
         COALESCE(SUM(CASE WHEN il.action='OUT' THEN il.quantity ELSE 0 END),0) AS Inventory
         FROM hub_skus hs
         JOIN products p ON hs.sku = p.sku
@@ -107,23 +193,82 @@ def fetch_inventory_for_hub(hub_id):
         WHERE hs.hub_id = ?
         GROUP BY p.name, p.sku, p.barcode
         ORDER BY p.name""", (hub_id, hub_id))
-    data = c.fetchall()
+    return c.fetchall()
+
+def load_live_inventory(hub_id):
+    # Balances and the log high-water mark come from one read transaction so later deltas line up
+    catalog_version = get_sku_index(connect=db.connect).loaded_at
+    conn = get_log_connection(hub_id)
+    try:
+        if SHARDED:
+            conn.execute("BEGIN")
+            high_water = latest_log_id(conn)
+            balances = dict(conn.execute("SELECT sku, balance FROM hub_balances").fetchall())
+            rows = [(name, sku, barcode, balances.get(sku, 0)) for name, sku, barcode in fetch_skus_for_hub(hub_id)]
+        else:
+            db.begin_read(conn)
+            high_water = latest_log_id(conn)
+            rows = query_inventory_for_hub(conn, hub_id)
+    finally:
+        conn.close()
+    df = pd.DataFrame(rows, columns=["Product", "SKU", "Barcode", "Inventory"])
+    return LiveBalances(hub_id, df, high_water, catalog_version)
+
+def fetch_live_inventory(hub_id):
+    # Cached per session; each poll only asks for log rows past the high-water mark
+    require(VIEW_INVENTORY, hub_id)
+    live = st.session_state.get("live_inventory")
+    if db.name != "sqlite":
+        # The feed is exact only where ids commit in order (SQLite's single writer). A PostgreSQL
+        # SERIAL id can commit after a higher one was read, so the balances are reloaded instead.
+        fresh = load_live_inventory(hub_id)
+        st.session_state.live_inventory = fresh
+        return fresh, live is None or live.hub_id != hub_id or not fresh.df.equals(live.df)
+    if (live is None or live.hub_id != hub_id
+            or live.catalog_version != get_sku_index(connect=db.connect).loaded_at):
+        live = load_live_inventory(hub_id)
+        st.session_state.live_inventory = live
+        return live, True
+    conn = get_log_connection(hub_id)
+    try:
+        changed = live.poll(conn)
+    finally:
+        conn.close()
+    return live, changed
+
+def fetch_hub_kpis(hub_id):
+    # Precomputed counters bucketed by the hub's own timezone
+    require(VIEW_INVENTORY, hub_id)
+    timezone, woohoo_threshold = get_hub_settings(hub_id, connect=db.connect)
+    conn = get_log_connection(hub_id)
+    kpis = fetch_kpis(conn, hub_id, timezone)
     conn.close()
-    return data
+    kpis["woohoo_threshold"] = woohoo_threshold
+    return kpis
 
-def fetch_today_orders(hub_id):
+def update_hub_settings(hub_id, timezone, woohoo_threshold):
+    require(HUB_SETTINGS, hub_id)
     conn = get_connection()
-    c = conn.cursor()
-    c.execute("""
-        SELECT SUM(quantity)
-        FROM inventory_log
-        WHERE hub = ? AND action = 'OUT' AND date(timestamp) = date('now')
-    """, (hub_id,))
-    result = c.fetchone()[0]
-    conn.close()
-    return result or 0
+    try:
+        save_hub_settings(conn, hub_id, timezone, woohoo_threshold)
+        conn.commit()
+    except Exception as e:
+        st.error(f"Hub settings update failed: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+    # Day/week buckets depend on the timezone, so recount this hub
+    conn = get_log_connection(hub_id)
+    try:
+        rebuild_kpis(conn, hub_id, timezone)
+        conn.commit()
+    finally:
+        conn.close()
+    return True
 
 def fetch_skus_for_hub(hub_id):
+    require(VIEW_INVENTORY, hub_id)
     conn = get_connection()
     c = conn.cursor()
     c.execute("""
@@ -136,11 +281,15 @@ def fetch_skus_for_hub(hub_id):
     return rows
 
 def assign_sku_to_hub(sku, hub_id):
+    require(MANAGE_SKUS, hub_id)
     conn = get_connection()
     try:
         c = conn.cursor()
-        c.execute("INSERT OR IGNORE INTO hub_skus (sku, hub_id) VALUES (?, ?)", (sku, hub_id))
+        c.execute(db.insert_ignore("hub_skus", ["sku", "hub_id"]), (sku, hub_id))
+        if c.rowcount:
+            audit(conn, "hub_sku", f"{hub_id}:{sku}", "ASSIGN", {"sku": sku, "hub": hub_id})
         conn.commit()
+        refresh_sku_index(connect=db.connect)
     except Exception as e:
         st.error(f"Assign failed: {e}")
         conn.rollback()
@@ -148,11 +297,15 @@ def assign_sku_to_hub(sku, hub_id):
         conn.close()
 
 def remove_sku_from_hub(sku, hub_id):
+    require(MANAGE_SKUS, hub_id)
     conn = get_connection()
     try:
         c = conn.cursor()
         c.execute("DELETE FROM hub_skus WHERE sku=? AND hub_id=?", (sku, hub_id))
+        if c.rowcount:
+            audit(conn, "hub_sku", f"{hub_id}:{sku}", "REMOVE", {"sku": sku, "hub": hub_id})
         conn.commit()
+        refresh_sku_index(connect=db.connect)
     except Exception as e:
         st.error(f"Remove failed: {e}")
         conn.rollback()
@@ -160,54 +313,423 @@ def remove_sku_from_hub(sku, hub_id):
         conn.close()
 
 def log_inventory(user_id, sku, action, quantity, hub_id, comment):
+    # Returns the new log id, or None if the movement was refused or failed
+    require(LOG_INVENTORY, hub_id)
+    if get_sku_index(connect=db.connect).is_bundle(sku):
+        return log_bundle(user_id, sku, action, quantity, hub_id, comment)
+    timezone = get_hub_settings(hub_id, connect=db.connect)[0]
     conn = get_connection()
     try:
-        c = conn.cursor()
-        timestamp = datetime.now()
-        c.execute("""
-            INSERT INTO inventory_log (timestamp, sku, action, quantity, hub, user_id, comment)
-            VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            (timestamp, sku, action, quantity, hub_id, user_id, comment))
+        if not SHARDED:
+            db.begin_write(conn)  # sharded postings lock only the hub's shard
+        log_id = post_movement(db, conn, user_id, sku, action, quantity, hub_id, comment, datetime.now(), timezone,
+                               sharded=SHARDED)
         conn.commit()
+        return log_id
+    except InsufficientStock as e:
+        st.error(f"❌ {e}.")
+        conn.rollback()
     except Exception as e:
         st.error(f"Inventory log failed: {e}")
         conn.rollback()
     finally:
         conn.close()
+    return None
 
-def fetch_inventory_history(hub_id):
+def log_bundle(user_id, sku, action, packs, hub_id, comment):
+    # One pack-level record plus all of its component lines in a single batched write;
+    # returns the bundle movement id
+    require(LOG_INVENTORY, hub_id)
+    lines = get_sku_index(connect=db.connect).expand(sku, packs)
+    timezone = get_hub_settings(hub_id, connect=db.connect)[0]
     conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT sku, date(timestamp) as date, SUM(CASE WHEN action = 'OUT' THEN quantity ELSE 0 END) as total_out
-        FROM inventory_log WHERE hub = ?
-        GROUP BY sku, date ORDER BY date
-    """, conn, params=(hub_id,))
-    conn.close()
-    return df
+    try:
+        if not SHARDED:
+            db.begin_write(conn)
+        movement_id = post_bundle(db, conn, user_id, sku, action, packs, lines, hub_id, comment, datetime.now(),
+                                  timezone, sharded=SHARDED)
+        conn.commit()
+        return movement_id
+    except InsufficientStock as e:
+        st.error(f"❌ {e}.")
+        conn.rollback()
+    except Exception as e:
+        st.error(f"Inventory log failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+    return None
+
+def fetch_inventory_history(hub_id):
+    require(VIEW_INVENTORY, hub_id)
+    if SHARDED or db.name != "sqlite":
+        # Aggregated in the hub's shard, or by the PostgreSQL server (see fetch_log_cache)
+        conn = get_shard_connection(hub_id) if SHARDED else get_connection()
+        df = pd.read_sql_query(f"""
+            SELECT sku, {db.date('timestamp')} as date, SUM(CASE WHEN action = 'OUT' THEN quantity ELSE 0 END) as total_out
+            FROM inventory_log WHERE hub = ?
+            GROUP BY sku, date ORDER BY date
+        """, conn, params=(hub_id,))
+        conn.close()
+        return df
+    return fetch_log_cache().out_history(hub_id)
+
+# Columnar copy of inventory_log shared by the analytics views; only new rows are read per call.
+# SQLite only: reading by id > last id needs ids to commit in order, and PostgreSQL SERIAL ids don't.
+def fetch_log_cache():
+    conn = get_analytics_connection()
+    try:
+        return get_log_cache(conn)
+    finally:
+        conn.close()
 
 def fetch_all_supply_requests():
+    require(REPLY_REQUESTS)
     conn = get_connection()
     df = pd.read_sql_query("SELECT * FROM supply_requests ORDER BY timestamp DESC", conn)
     conn.close()
     return df
 
+def search_archived_requests(text, limit=200):
+    # Answered requests the retention job moved out of the database, matched on notes/response/user
+    require(REPLY_REQUESTS)
+    pattern = f"%{text.strip()}%"
+    return search_archive("supply_requests", "notes LIKE ? OR response LIKE ? OR username LIKE ?",
+                          (pattern, pattern, pattern), order="timestamp DESC", limit=limit)
+
 def fetch_all_inventory():
+    # Every hub for admins; a manager's own hubs otherwise
+    hubs = current_permissions().hubs(VIEW_INVENTORY)
+    if hubs is not None and not hubs:
+        raise PermissionDenied("no hubs to view")
+    if SHARDED:
+        # Balances fan out over the hub shards in parallel
+        balances = pd.DataFrame(fetch_all_shard_balances(hubs), columns=["hub_id", "sku", "Inventory"])
+    else:
+        if db.name == "sqlite":
+            balances = fetch_log_cache().balances()
+        else:
+            # stock_levels is kept in step with every posting, in the same transaction
+            conn = get_connection()
+            balances = pd.read_sql_query('SELECT hub_id, sku, on_hand AS "Inventory" FROM stock_levels', conn)
+            conn.close()
+        if hubs is not None:
+            balances = balances[balances["hub_id"].isin(hubs)]
+    return name_balances(balances)
+
+def name_balances(balances):
+    # Hub and product names come from the shared catalog
     conn = get_connection()
-    df = pd.read_sql_query("""
-        SELECT h.name AS Hub, p.name AS Product, p.sku, p.barcode,
-        COALESCE(SUM(CASE WHEN il.action = 'IN' THEN il.quantity ELSE 0 END), 0) -
-        COALESCE(SUM(CASE WHEN il.action = 'OUT' THEN il.quantity ELSE 0 END), 0) AS Inventory
-        FROM inventory_log il
-        JOIN products p ON il.sku = p.sku
-        JOIN hubs h ON il.hub = h.id
-        GROUP BY h.name, p.name, p.sku, p.barcode
-        ORDER BY h.name, p.name
-    """, conn)
+    hubs = pd.read_sql_query("SELECT id AS hub_id, name AS Hub FROM hubs", conn)
+    products = pd.read_sql_query("SELECT name AS Product, sku, barcode FROM products", conn)
+    conn.close()
+    df = balances.merge(hubs, on="hub_id").merge(products, on="sku")
+    return df[["Hub", "Product", "sku", "barcode", "Inventory"]].sort_values(["Hub", "Product"]).reset_index(drop=True)
+
+# ---- CYCLE COUNTS
+def fetch_cycle_count_variances(hub_id, counts, zero_missing=True):
+    require(CYCLE_COUNT, hub_id)
+    system_df = pd.DataFrame(fetch_inventory_for_hub(hub_id), columns=["Product", "SKU", "Barcode", "Inventory"])
+    return compute_variances(system_df, counts, zero_missing)
+
+def post_cycle_count(hub_id, user_id, counts, zero_missing=True):
+    require(CYCLE_COUNT, hub_id)
+    # The write lock (the hub's shard when sharded) is taken first and the variances recomputed
+    # inside the same transaction, so no movement can land between reading the balances and
+    # posting the adjustments
+    timestamp = datetime.now()
+    timezone = get_hub_settings(hub_id, connect=db.connect)[0]
+    conn = get_connection()
+    shard = None
+    variances = None
+    try:
+        if SHARDED:
+            shard = begin_shard_write(hub_id)
+            balances = dict(shard.execute("SELECT sku, balance FROM hub_balances"))
+            c = conn.cursor()
+            c.execute("""
+                SELECT p.name, p.sku, p.barcode FROM hub_skus hs
+                JOIN products p ON hs.sku = p.sku
+                WHERE hs.hub_id = ?""", (hub_id,))
+            rows = [(name, sku, barcode, balances.get(sku, 0)) for name, sku, barcode in c.fetchall()]
+        else:
+            db.begin_write(conn)
+            lock_hub_stock(db, conn, hub_id)
+            rows = query_inventory_for_hub(conn, hub_id)
+        system_df = pd.DataFrame(rows, columns=["Product", "SKU", "Barcode", "Inventory"])
+        variances, _ = compute_variances(system_df, counts, zero_missing)
+        count_id = record_cycle_count(db, conn, hub_id, user_id, variances, timestamp)
+        adjustments = adjustment_rows(variances)
+        if adjustments:
+            post_lines(db, conn, user_id, adjustments, ADJUST, hub_id, f"Cycle count #{count_id}", timestamp,
+                       timezone, enforce=False, sharded=SHARDED, shard=shard)
+        if shard is not None:
+            shard.commit()
+        conn.commit()
+        return count_id, variances
+    except Exception as e:
+        st.error(f"Cycle count failed: {e}")
+        if shard is not None:
+            shard.rollback()
+        conn.rollback()
+        return None, variances
+    finally:
+        if shard is not None:
+            shard.close()
+        conn.close()
+
+def fetch_shrinkage_report(since, hub_id=None):
+    require(VIEW_SHRINKAGE, ALL_HUBS if hub_id is None else hub_id)
+    conn = get_connection()
+    hub_filter = "hub_id = ? AND " if hub_id is not None else ""
+    params = ((hub_id,) if hub_id is not None else ()) + (since,)
+    df = pd.read_sql_query(f"""
+        SELECT hub_id, sku, COUNT(*) AS counts, SUM(variance) AS net_variance,
+        SUM(CASE WHEN variance < 0 THEN -variance ELSE 0 END) AS shrinkage
+        FROM cycle_count_lines WHERE {hub_filter}created >= ?
+        GROUP BY hub_id, sku
+        HAVING SUM(CASE WHEN variance < 0 THEN -variance ELSE 0 END) > 0
+        ORDER BY shrinkage DESC
+    """, conn, params=params)
+    conn.close()
+    return df
+
+# ---- SUPPLIERS
+# Supplier-side functions always act on the logged-in supplier's own rows
+def current_supplier():
+    require(SUPPLIER_PORTAL)
+    return st.session_state.user["username"]
+
+def fetch_supplier_shipments():
+    conn = get_connection()
+    df = pd.read_sql_query(
+        "SELECT date, tracking, hub_id, product, amount, request_id FROM shipments WHERE supplier=? ORDER BY date DESC",
+        conn, params=(current_supplier(),))
     conn.close()
     return df
 
+def fetch_supplier_requests():
+    conn = get_connection()
+    rows = fetch_open_requests(conn, current_supplier())
+    conn.close()
+    return pd.DataFrame(rows, columns=["Request", "Hub", "Requested At", "Notes", "SKU", "Requested Qty", "Confirmed Qty"])
+
+def confirm_supplier_quantities(confirmations):
+    conn = get_connection()
+    try:
+        confirm_quantities(conn, current_supplier(), confirmations, datetime.now())
+        conn.commit()
+        return True
+    except Exception as e:
+        st.error(f"Confirmation failed: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+def register_supplier_shipments(shipments):
+    conn = get_connection()
+    try:
+        registered, rejected = register_shipments(db, conn, current_supplier(), shipments, datetime.now())
+        conn.commit()
+        return registered, rejected
+    except Exception as e:
+        st.error(f"Shipment registration failed: {e}")
+        conn.rollback()
+        return 0, [request_id for request_id, _, _ in shipments]
+    finally:
+        conn.close()
+
+def fetch_supplier_lead_times():
+    # Suppliers see their own; HQ sees everyone's
+    if current_permissions().allows(SUPPLIER_PORTAL):
+        supplier = current_supplier()
+    else:
+        require(REPLY_REQUESTS)
+        supplier = None
+    conn = get_connection()
+    rows = fetch_lead_times(conn, supplier)
+    conn.close()
+    return pd.DataFrame(rows, columns=["Supplier", "Hub", "Fulfilled", "Avg Lead Time (h)", "Last Fulfilled"])
+
+def fetch_suppliers():
+    require(REPLY_REQUESTS)
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT username FROM users WHERE role='supplier' AND active=1 ORDER BY username")
+    suppliers = [row[0] for row in c.fetchall()]
+    conn.close()
+    return suppliers
+
+def route_supply_request(request_id, supplier, sku, quantity):
+    require(REPLY_REQUESTS)
+    conn = get_connection()
+    try:
+        assign_supplier(conn, request_id, supplier, sku, quantity)
+        conn.commit()
+    except Exception as e:
+        st.error(f"Routing failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def supply_request_status(row):
+    if pd.isna(row.get('supplier')):
+        return None
+    status = f"📦 {int(row['requested_qty'])} × {row['sku']} requested from {row['supplier']}"
+    if pd.notna(row.get('fulfilled_at')):
+        return status + f" — shipped {row['fulfilled_at']}"
+    if pd.notna(row.get('confirmed_qty')):
+        return status + f" — supplier confirmed {int(row['confirmed_qty'])}"
+    return status + " — awaiting supplier"
+
+# ---- AUDIT TRAIL
+def fetch_audit_log(entity=None, limit=200):
+    require(VIEW_AUDIT)
+    conn = get_connection()
+    where = "WHERE entity = ? " if entity else ""
+    df = pd.read_sql_query(f"""
+        SELECT a.id, a.created, u.username AS actor, a.entity, a.entity_id, a.action, a.details
+        FROM audit_log a LEFT JOIN users u ON a.actor_id = u.id
+        {where}ORDER BY a.id DESC LIMIT {int(limit)}""", conn, params=(entity,) if entity else ())
+    if SHARDED and entity in (None, "inventory"):
+        # Inventory movements are audited in each hub's shard
+        shard_rows = pd.DataFrame(fetch_shard_audit_log(entity=entity, limit=limit),
+                                  columns=["hub", "id", "created", "actor_id", "entity", "entity_id", "action", "details"])
+        users = pd.read_sql_query("SELECT id AS actor_id, username AS actor FROM users", conn)
+        shard_rows = shard_rows.merge(users, on="actor_id", how="left").drop(columns="actor_id")
+        df = pd.concat([df, shard_rows], ignore_index=True).sort_values("created", ascending=False).head(limit)
+    conn.close()
+    return df
+
+def verify_audit_trail(full=False):
+    # Only records since the last clean checkpoint are rehashed unless full=True
+    require(VIEW_AUDIT)
+    conn = get_connection()
+    try:
+        started = time.time()
+        checked, problems = verify_audit_chain(conn, full=full, check_inventory=not SHARDED)
+        conn.commit()
+        if SHARDED:
+            # Each hub shard keeps its own chain over its log rows
+            for hub_id, (hub_checked, hub_problems) in verify_shard_audits(full=full).items():
+                checked += hub_checked
+                problems += [(f"hub {hub_id} #{record_id}", problem) for record_id, problem in hub_problems]
+        return checked, problems, time.time() - started
+    finally:
+        conn.close()
+
+def fetch_audit_checkpoint():
+    require(VIEW_AUDIT)
+    conn = get_connection()
+    checkpoint = latest_checkpoint(conn)
+    conn.close()
+    return checkpoint
+
+# ---- PACKS & BUNDLES (bill of materials)
+def fetch_bundle_components(parent_sku=None):
+    require(MANAGE_SKUS)
+    conn = get_connection()
+    try:
+        rows = fetch_components(conn, parent_sku)
+    finally:
+        conn.close()
+    return pd.DataFrame(rows, columns=["Pack", "Component SKU", "Quantity"])
+
+def save_bundle_components(parent_sku, components):
+    require(MANAGE_SKUS)
+    conn = get_connection()
+    try:
+        set_components(conn, parent_sku, components)
+        audit(conn, "bundle", parent_sku, "COMPONENTS", components)
+        conn.commit()
+        refresh_sku_index(connect=db.connect)
+        return True
+    except Exception as e:
+        st.error(f"Saving components failed: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+# ---- STOCK RESERVATIONS (holds for pending orders; single-database mode)
+def fetch_hub_reservations(hub_id):
+    require(VIEW_INVENTORY, hub_id)
+    conn = get_connection()
+    try:
+        levels = fetch_stock_levels(conn, hub_id)
+        holds = fetch_reservations(conn, hub_id)
+    finally:
+        conn.close()
+    levels_df = pd.DataFrame([(sku, on_hand, reserved, on_hand - reserved) for sku, (on_hand, reserved) in levels.items()],
+                             columns=["SKU", "On Hand", "Reserved", "Available"])
+    holds_df = pd.DataFrame(holds, columns=["Reservation", "SKU", "Quantity", "Reference", "Created", "Expires"])
+    return levels_df, holds_df
+
+def hold_stock(hub_id, sku, quantity, reference, minutes):
+    require(LOG_INVENTORY, hub_id)
+    conn = get_connection()
+    try:
+        db.begin_write(conn)
+        reservation_id = reserve_stock(db, conn, hub_id, sku, quantity, st.session_state.user["id"],
+                                       reference or None, minutes)
+        audit(conn, "reservation", reservation_id, "HOLD",
+              {"sku": sku, "quantity": int(quantity), "hub": hub_id, "reference": reference, "minutes": int(minutes)})
+        conn.commit()
+        return reservation_id
+    except InsufficientStock as e:
+        st.error(f"❌ {e}.")
+        conn.rollback()
+    except Exception as e:
+        st.error(f"Reservation failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+    return None
+
+def close_reservation(hub_id, reservation_id, ship=False):
+    # Releases the hold, or ships it: the release and its OUT posting commit together
+    require(LOG_INVENTORY, hub_id)
+    timezone = get_hub_settings(hub_id, connect=db.connect)[0]
+    user_id = st.session_state.user["id"]
+    conn = get_connection()
+    try:
+        db.begin_write(conn)
+        held = release_reservation(conn, reservation_id, FULFILLED if ship else RELEASED, hub_id=hub_id)
+        if held is None:
+            st.error("Reservation is already closed or has expired.")
+            conn.rollback()
+            return False
+        _, sku, quantity = held
+        audit(conn, "reservation", reservation_id, "SHIP" if ship else "RELEASE",
+              {"sku": sku, "quantity": quantity, "hub": hub_id})
+        if ship:
+            post_movement(db, conn, user_id, sku, "OUT", quantity, hub_id, f"Reservation #{reservation_id}",
+                          datetime.now(), timezone)
+        conn.commit()
+        return True
+    except InsufficientStock as e:
+        st.error(f"❌ {e}.")
+        conn.rollback()
+    except Exception as e:
+        st.error(f"Reservation update failed: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+    return False
+
+# ---- WEEKLY REPORTS (built by reports.py running as a worker; served from its cache)
+def fetch_report(scope, period, generate=False):
+    # Stored artifacts for the period's current high-water mark, or None if not built yet
+    require(VIEW_REPORTS)
+    paths = find_artifacts(scope, period, high_water(db, scope, period))
+    if paths is None and generate:
+        paths, _ = generate_report(db, scope, period)
+    return paths
+
 # ---- NOTIFICATIONS
 def insert_notification(user_role, user_id, message):
+    require(SEND_MESSAGES)
     conn = get_connection()
     try:
         c = conn.cursor()
@@ -221,18 +743,47 @@ def insert_notification(user_role, user_id, message):
     finally:
         conn.close()
 
-def fetch_notifications_for_user(user_role, user_id):
-    if not user_id:
-        return pd.DataFrame(columns=["created", "message"])
+def fetch_notifications_for_user(include_archived=False):
+    # Always the signed-in user's own notifications
+    require(READ_NOTIFICATIONS)
+    user_id = st.session_state.user["id"]
     conn = get_connection()
     df = pd.read_sql_query("""
-        SELECT created, message FROM notifications WHERE user_role=? AND user_id=? ORDER BY created DESC
-    """, conn, params=(user_role, user_id))
+        SELECT created, message FROM notifications WHERE user_id=? ORDER BY created DESC
+    """, conn, params=(user_id,))
     conn.close()
+    if include_archived:
+        # Older notifications live in the yearly archive files (see retention.py)
+        archived = search_archive("notifications", "user_id = ?", (user_id,),
+                                  columns="created, message", order="created DESC")
+        if not archived.empty:
+            df = pd.concat([df, archived], ignore_index=True)
     return df
 
+def render_notifications():
+    st.subheader("🔔 Notifications")
+    include_archived = st.checkbox("Include archived", key="notifications_archived")
+    notif_df = fetch_notifications_for_user(include_archived)
+    if not notif_df.empty:
+        st.dataframe(notif_df)
+    else:
+        st.info("No notifications yet.")
+
 ### USER MANAGEMENT ###
+def fetch_managed_hubs():
+    # user_id -> extra hub ids for managers
+    require(MANAGE_USERS)
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT user_id, hub_id FROM user_hubs")
+    managed = {}
+    for user_id, hub_id in c.fetchall():
+        managed.setdefault(user_id, []).append(hub_id)
+    conn.close()
+    return managed
+
 def fetch_all_users():
+    require(MANAGE_USERS)
     conn = get_connection()
     users = pd.read_sql_query(
         "SELECT id, username, email, role, hub_id, active FROM users ORDER BY id", conn)
@@ -240,13 +791,16 @@ def fetch_all_users():
     return users
 
 def add_user(username, password, email, role, hub_id, active=1):
+    require(MANAGE_USERS)
     conn = get_connection()
     try:
         c = conn.cursor()
-        c.execute("""
+        user_id = db.insert_id(c, """
             INSERT INTO users (username, password, email, role, hub_id, active)
             VALUES (?, ?, ?, ?, ?, ?)
-        """, (username, password, email, role, hub_id, active))
+        """, (username, hash_password_async(password).result(), email, role, hub_id, active))
+        audit(conn, "user", user_id, "CREATE", {"username": username, "email": email, "role": role,
+                                                "hub_id": hub_id, "active": active})
         conn.commit()
     except Exception as e:
         st.error(f"User add failed: {e}")
@@ -254,7 +808,8 @@ def add_user(username, password, email, role, hub_id, active=1):
     finally:
         conn.close()
 
-def update_user(user_id, username, email, role, hub_id, active):
+def update_user(user_id, username, email, role, hub_id, active, managed_hubs=()):
+    require(MANAGE_USERS)
     conn = get_connection()
     try:
         c = conn.cursor()
@@ -262,7 +817,11 @@ def update_user(user_id, username, email, role, hub_id, active):
             UPDATE users SET username=?, email=?, role=?, hub_id=?, active=?
             WHERE id=?
         """, (username, email, role, hub_id, active, user_id))
+        set_managed_hubs(conn, user_id, managed_hubs if role == "manager" else ())
+        audit(conn, "user", user_id, "UPDATE", {"username": username, "email": email, "role": role, "hub_id": hub_id,
+                                                "active": active, "managed_hubs": [int(h) for h in managed_hubs]})
         conn.commit()
+        sessions.revoke_user(user_id)  # cached sessions carry the old role/hub
     except Exception as e:
         st.error(f"User update failed: {e}")
         conn.rollback()
@@ -270,11 +829,14 @@ def update_user(user_id, username, email, role, hub_id, active):
         conn.close()
 
 def deactivate_user(user_id):
+    require(MANAGE_USERS)
     conn = get_connection()
     try:
         c = conn.cursor()
         c.execute("UPDATE users SET active=0 WHERE id=?", (user_id,))
+        audit(conn, "user", user_id, "DEACTIVATE")
         conn.commit()
+        sessions.revoke_user(user_id)
     except Exception as e:
         st.error(f"Deactivate failed: {e}")
         conn.rollback()
@@ -282,10 +844,12 @@ def deactivate_user(user_id):
         conn.close()
 
 def activate_user(user_id):
+    require(MANAGE_USERS)
     conn = get_connection()
     try:
         c = conn.cursor()
         c.execute("UPDATE users SET active=1 WHERE id=?", (user_id,))
+        audit(conn, "user", user_id, "ACTIVATE")
         conn.commit()
     except Exception as e:
         st.error(f"Activate failed: {e}")
@@ -294,6 +858,35 @@ def activate_user(user_id):
         conn.close()
 
 # --- UI Panels ---
+# Charts get pre-shrunk data (chart_data.py); the caption reports what actually ships to the browser
+def render_chart(chart, stats):
+    st.altair_chart(chart, use_container_width=True)
+    bucket = f" · {BUCKET_LABELS[stats['bucket']]} buckets" if stats["bucket"] else ""
+    st.caption(f"📦 {stats['points']:,} of {stats['source_points']:,} points · {stats['series']} series{bucket}"
+               f" · {payload_bytes(chart) / 1024:,.1f} KB chart payload")
+
+def render_sku_search(key, hub_id=None):
+    index = get_sku_index(connect=db.connect)
+    facets = index.facet_counts(hub_id)
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        query = st.text_input("Search SKU or Product", key=f"{key}_query")
+    with col2:
+        family = st.selectbox("Family", ["All"] + sorted(facets["family"]), key=f"{key}_family",
+                              format_func=lambda f: f if f == "All" else f"{f} ({facets['family'][f]})")
+    with col3:
+        size = st.selectbox("Size", ["All"] + sorted(facets["size"]), key=f"{key}_size",
+                            format_func=lambda s: s if s == "All" else f"{s} ({facets['size'][s]})")
+    matches = index.search(query, hub_id=hub_id,
+                           family=None if family == "All" else family,
+                           size=None if size == "All" else size)
+    if not matches:
+        st.info("No matching SKUs.")
+        return None, None
+    options = {f"{index.name(sku)} ({sku})": sku for sku in matches}
+    selected_label = st.selectbox("Select SKU", list(options.keys()), key=f"{key}_select")
+    return selected_label, options[selected_label]
+
 def render_user_management_panel():
     st.subheader("👤 User Management")
     users = fetch_all_users()
@@ -320,6 +913,8 @@ def render_user_management_panel():
             st.rerun()
 
     st.markdown("#### All Users")
+    managed = fetch_managed_hubs()
+    hub_names = dict(zip(hubs['id'], hubs['name']))
     for idx, row in users.iterrows():
         with st.expander(f"{row['username']} (Role: {row['role']}, Active: {row['active']})"):
             col1, col2 = st.columns([3,1])
@@ -329,10 +924,16 @@ def render_user_management_panel():
                 new_role = st.selectbox(f"Role_{row['id']}", ["user", "manager", "admin", "supplier"], index=["user", "manager", "admin", "supplier"].index(row['role']), key=f"role_{row['id']}")
                 new_hub = st.selectbox(f"Hub_{row['id']}", ["None"] + list(hub_choices.keys()), index=(list(hub_choices.values()).index(row['hub_id'])+1 if row['hub_id'] in hub_choices.values() else 0), key=f"hub_{row['id']}")
                 new_active = st.checkbox(f"Active_{row['id']}", value=bool(row['active']), key=f"active_{row['id']}")
+                new_managed = []
+                if new_role == "manager":
+                    new_managed = st.multiselect(f"Also Manages_{row['id']}", list(hub_choices.keys()),
+                                                 default=[hub_names[h] for h in managed.get(row['id'], []) if h in hub_names],
+                                                 key=f"managed_{row['id']}")
             with col2:
                 if st.button("Update", key=f"update_{row['id']}"):
                     hub_id = hub_choices.get(new_hub) if new_hub != "None" else None
-                    update_user(row['id'], new_username, new_email, new_role, hub_id, int(new_active))
+                    update_user(row['id'], new_username, new_email, new_role, hub_id, int(new_active),
+                                [hub_choices[name] for name in new_managed])
                     st.success("User updated.")
                     st.rerun()
                 if row['active']:
@@ -351,21 +952,18 @@ def render_admin_sku_panel():
     st.subheader("🧩 Assign/Remove SKU from Hub")
     hubs = fetch_all_hubs()
     hub_map = dict(zip(hubs['name'], hubs['id']))
-    products = fetch_all_products()
-    product_map = dict(zip(products['name'], products['sku']))
 
     selected_hub = st.selectbox("Select Hub", list(hub_map.keys()), key="admin_sku_hub")
-    selected_product = st.selectbox("Select Product", list(product_map.keys()), key="admin_sku_product")
-    selected_sku = product_map[selected_product]
+    selected_product, selected_sku = render_sku_search("admin_sku_product")
 
     col1, col2 = st.columns(2)
     with col1:
-        if st.button("✅ Assign SKU", key="assign_sku"):
+        if st.button("✅ Assign SKU", key="assign_sku", disabled=not selected_sku):
             assign_sku_to_hub(selected_sku, hub_map[selected_hub])
             st.success(f"{selected_product} assigned to {selected_hub}")
             st.rerun()
     with col2:
-        if st.button("❌ Remove SKU", key="remove_sku"):
+        if st.button("❌ Remove SKU", key="remove_sku", disabled=not selected_sku):
             remove_sku_from_hub(selected_sku, hub_map[selected_hub])
             st.warning(f"{selected_product} removed from {selected_hub}")
             st.rerun()
@@ -373,6 +971,38 @@ def render_admin_sku_panel():
     st.markdown(f"### Current SKUs at {selected_hub}")
     current = fetch_skus_for_hub(hub_map[selected_hub])
     st.dataframe(pd.DataFrame(current, columns=["Product", "SKU", "Barcode"]))
+    render_bundle_panel()
+
+# --- Admin: Packs & Bundles ---
+def render_bundle_panel():
+    st.markdown("### 📦 Packs & Bundles")
+    st.caption("A pack's stock lives in its units: scanning the pack posts one line per component.")
+    index = get_sku_index(connect=db.connect)
+    pack_label, pack_sku = render_sku_search("bundle_parent")
+    if pack_sku:
+        direct = fetch_bundle_components(pack_sku)[["Component SKU", "Quantity"]]
+        edited = st.data_editor(direct, key=f"bundle_editor_{pack_sku}", num_rows="dynamic", hide_index=True)
+        if st.button("Save Components", key="save_bundle"):
+            components, unknown = {}, []
+            for code, quantity in zip(edited["Component SKU"], edited["Quantity"]):
+                if pd.isna(code) or not str(code).strip():
+                    continue
+                sku = index.resolve(str(code))
+                if not sku:
+                    unknown.append(str(code))
+                elif pd.notna(quantity):
+                    components[sku] = components.get(sku, 0) + int(quantity)
+            if unknown:
+                st.error(f"❌ Unknown component(s): {', '.join(unknown)}")
+            elif save_bundle_components(pack_sku, components):
+                st.success(f"{pack_label}: {len(components)} component(s) saved." if components
+                           else f"{pack_label} is a single unit again.")
+                st.rerun()
+    if index.expansions:
+        st.dataframe(pd.DataFrame(
+            [(parent, index.name(parent), ", ".join(f"{qty} x {sku}" for sku, qty in parts), sum(q for _, q in parts))
+             for parent, parts in sorted(index.expansions.items())],
+            columns=["Pack", "Product", "Units", "Units per Pack"]), hide_index=True)
 
 # --- Admin: Send Message ---
 def render_send_message_panel():
@@ -404,32 +1034,241 @@ def render_send_message_panel():
                     insert_notification(target_role, uid, message)
                 st.success(f"Message sent to {len(recipients)} user(s).")
 
+# --- Admin: Shrinkage Report ---
+def render_shrinkage_panel():
+    st.subheader("📉 Shrinkage from Cycle Counts")
+    hubs = fetch_all_hubs()
+    hub_choices = dict(zip(hubs['name'], hubs['id']))
+    col1, col2 = st.columns(2)
+    with col1:
+        hub_name = st.selectbox("Hub", ["All"] + list(hub_choices.keys()), key="shrinkage_hub")
+    with col2:
+        since = st.date_input("Since", value=datetime.now().date().replace(day=1), key="shrinkage_since")
+    report = fetch_shrinkage_report(str(since), hub_choices.get(hub_name))
+    if report.empty:
+        st.info("No shrinkage recorded for this period.")
+        return
+    hub_names = dict(zip(hubs['id'], hubs['name']))
+    report.insert(0, "Hub", report["hub_id"].map(hub_names))
+    st.dataframe(report.drop(columns=["hub_id"]))
+    st.metric("Total Units Lost", int(report["shrinkage"].sum()))
+
+# --- Admin: Audit Trail ---
+def render_audit_panel():
+    st.subheader("🔏 Audit Trail")
+    checkpoint = fetch_audit_checkpoint()
+    if checkpoint:
+        st.caption(f"Last verified through record #{checkpoint[0]} at {checkpoint[2]}")
+    col1, col2 = st.columns(2)
+    verify = col1.button("Verify New Records")
+    verify_full = col2.button("Full Re-verification")
+    if verify or verify_full:
+        checked, problems, elapsed = verify_audit_trail(full=verify_full)
+        if problems:
+            st.error(f"❌ Integrity check failed after {checked} records:")
+            st.dataframe(pd.DataFrame(problems, columns=["Record", "Problem"]))
+        else:
+            st.success(f"✅ {checked} records verified in {elapsed:.2f}s.")
+    entity = st.selectbox("Show", ["All", "inventory", "user", "hub_sku"], key="audit_entity")
+    st.dataframe(fetch_audit_log(None if entity == "All" else entity))
+
+# --- Admin: Weekly Reports ---
+def render_reports_panel():
+    st.subheader("🗂️ Weekly Reports")
+    hubs = fetch_all_hubs()
+    scopes = {"All Hubs": COMPANY, **dict(zip(hubs['name'], hubs['id'].astype(int)))}
+    col1, col2 = st.columns(2)
+    period = col1.selectbox("Week", recent_periods(8), key="report_period")
+    scope_name = col2.selectbox("Scope", list(scopes.keys()), key="report_scope")
+    paths = fetch_report(scopes[scope_name], period)
+    if paths is None:
+        st.info("This report has new data since it was last built; the report worker will refresh it shortly.")
+        if st.button("Generate Now"):
+            paths = fetch_report(scopes[scope_name], period, generate=True)
+    if paths is None:
+        return
+    name = f"ttt_{period}_{scope_name.replace(' ', '_').lower()}"
+    col1, col2, col3, col4 = st.columns(4)
+    with open(paths["pdf"], "rb") as f:
+        col1.download_button("Download PDF", f.read(), file_name=f"{name}.pdf", mime="application/pdf")
+    with open(paths["csv"], "rb") as f:
+        col2.download_button("Download CSV", f.read(), file_name=f"{name}.csv", mime="text/csv")
+    with open(paths["packs"], "rb") as f:
+        col3.download_button("Packs CSV", f.read(), file_name=f"{name}_packs.csv", mime="text/csv")
+    with open(paths["requests"], "rb") as f:
+        col4.download_button("Open Requests CSV", f.read(), file_name=f"{name}_requests.csv", mime="text/csv")
+    st.dataframe(pd.read_csv(paths["csv"]))
+    packs = pd.read_csv(paths["packs"])
+    if not packs.empty:
+        st.dataframe(packs, hide_index=True)
+
+# --- Admin: Hub Settings ---
+def render_hub_settings_panel():
+    st.subheader("⚙️ Hub Settings")
+    hubs = fetch_all_hubs()
+    hub_choices = dict(zip(hubs['name'], hubs['id']))
+    hub_name = st.selectbox("Hub", list(hub_choices.keys()), key="settings_hub")
+    if not hub_name:
+        return
+    hub_id = int(hub_choices[hub_name])
+    timezone, woohoo_threshold = get_hub_settings(hub_id, connect=db.connect)
+    with st.form("hub_settings_form"):
+        new_timezone = st.text_input("Timezone (e.g. America/New_York)", value=timezone)
+        new_threshold = st.number_input("WOOHOO Threshold (OUT units per day)", min_value=1, step=1, value=int(woohoo_threshold))
+        if st.form_submit_button("Save Settings"):
+            if update_hub_settings(hub_id, new_timezone.strip(), new_threshold):
+                st.success(f"Settings saved for {hub_name}.")
+
+# --- Hub: Inventory Transaction ---
+def render_inventory_transaction_form(hub_id):
+    st.subheader("➕ Add Inventory Transaction")
+    if not get_sku_index(connect=db.connect).skus_for_hub(hub_id):
+        st.info("No SKUs assigned yet.")
+        return
+    scanned = st.text_input("Scan Barcode or Enter SKU (optional)")
+    if scanned.strip():
+        index = get_sku_index(connect=db.connect)
+        selected_sku = index.resolve(scanned)
+        if not selected_sku:
+            st.error(f"❌ '{scanned.strip()}' does not match any product.")
+            return
+        if not index.is_allowed(hub_id, selected_sku):
+            st.error(f"❌ SKU '{selected_sku}' is not assigned to your hub.")
+            return
+        selected_label = f"{index.name(selected_sku)} ({selected_sku})"
+        st.info(f"Scanned: {selected_label}")
+    else:
+        selected_label, selected_sku = render_sku_search("hub_sku", hub_id=hub_id)
+        if not selected_sku:
+            return
+    index = get_sku_index(connect=db.connect)
+    if index.is_bundle(selected_sku):
+        st.caption("📦 Pack of " + ", ".join(f"{qty} x {sku}" for sku, qty in index.expand(selected_sku, 1))
+                   + ". Quantity is in packs; each unit is posted separately.")
+    action = st.radio("Action", ["IN", "OUT"], horizontal=True)
+    quantity = st.number_input("Quantity", min_value=1, step=1)
+    comment = st.text_input("Optional Comment")
+    if st.button("Submit Inventory Update"):
+        if log_inventory(st.session_state.user["id"], selected_sku, action, quantity, hub_id, comment):
+            st.success(f"{action} of {quantity} for {selected_label} recorded.")
+            st.rerun()
+
+# --- Hub: Stock Reservations ---
+def render_reservations_panel(hub_id):
+    st.subheader("📌 Stock Reservations")
+    if enforcement_enabled():
+        st.caption("Stock enforcement is on: OUT movements can't take a SKU below its reserved quantity.")
+    levels, holds = fetch_hub_reservations(hub_id)
+    selected_label, sku = render_sku_search("reserve_sku", hub_id=hub_id)
+    if sku:
+        col1, col2, col3 = st.columns(3)
+        quantity = col1.number_input("Quantity", min_value=1, step=1, key="reserve_qty")
+        minutes = col2.number_input("Hold for (minutes)", min_value=1, value=DEFAULT_HOLD_MINUTES, step=5, key="reserve_minutes")
+        reference = col3.text_input("Order Reference", key="reserve_reference")
+        if st.button("Reserve Stock"):
+            reservation_id = hold_stock(hub_id, sku, quantity, reference.strip(), minutes)
+            if reservation_id:
+                st.success(f"Reservation #{reservation_id}: {quantity} of {selected_label} held for {minutes} minutes.")
+                st.rerun()
+    if holds.empty:
+        st.info("No active reservations.")
+    else:
+        st.dataframe(holds, hide_index=True)
+        col1, col2, col3 = st.columns(3)
+        chosen = col1.selectbox("Reservation", holds["Reservation"].tolist(), key="reservation_pick")
+        if col2.button("Ship (post OUT)"):
+            if close_reservation(hub_id, chosen, ship=True):
+                st.success(f"Reservation #{chosen} shipped.")
+                st.rerun()
+        if col3.button("Release"):
+            if close_reservation(hub_id, chosen):
+                st.success(f"Reservation #{chosen} released.")
+                st.rerun()
+    reserved = levels[levels["Reserved"] > 0]
+    if not reserved.empty:
+        st.dataframe(reserved, hide_index=True)
+
+# --- Hub: Cycle Count ---
+def render_cycle_count_panel(hub_id):
+    st.subheader("🧮 Cycle Count")
+    st.markdown("Scan every item on the shelf (one scan per line, or `SKU quantity`), or upload a CSV with `sku` and `counted` columns.")
+    index = get_sku_index(connect=db.connect)
+    uploaded = st.file_uploader("Count CSV (optional)", type=["csv"], key="cycle_count_csv")
+    scanned = st.text_area("Scanned Items", key="cycle_count_scans", height=200)
+    zero_missing = st.checkbox("Treat assigned SKUs that were not counted as zero", value=True)
+    try:
+        if uploaded is not None:
+            counts, unknown = parse_count_csv(uploaded.getvalue(), index)
+        else:
+            counts, unknown = parse_scanned_counts(scanned, index)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    if unknown:
+        st.warning(f"⚠️ Unrecognized entries ignored: {', '.join(map(str, unknown[:20]))}")
+    if not counts:
+        st.info("No counts entered yet.")
+        return
+    variances, unassigned = fetch_cycle_count_variances(hub_id, counts, zero_missing)
+    if unassigned:
+        st.warning(f"⚠️ Not assigned to this hub, ignored: {', '.join(unassigned)}")
+    st.dataframe(variances[variances["Variance"] != 0])
+    st.caption(f"{len(variances)} SKUs counted, {int((variances['Variance'] != 0).sum())} with variance, net {int(variances['Variance'].sum())}")
+    if st.button("Post Cycle Count"):
+        count_id, posted = post_cycle_count(hub_id, st.session_state.user["id"], counts, zero_missing)
+        if count_id:
+            st.success(f"Cycle count #{count_id} posted with {int((posted['Variance'] != 0).sum())} adjustment(s).")
+
+# --- Hub: Live Inventory (polls the change feed; reruns only this fragment) ---
+@st.fragment(run_every=POLL_SECONDS)
+def render_hub_inventory(hub_id):
+    live, changed = fetch_live_inventory(hub_id)
+    inventory_df = live.df
+    st.subheader("📦 My Inventory")
+    st.dataframe(inventory_df)
+    low_stock = inventory_df[inventory_df["Inventory"] < 10]
+    if not low_stock.empty:
+        st.warning("⚠️ The following items are below 10 in stock. Contact HQ for restock:")
+        st.dataframe(low_stock)
+    kpis = st.session_state.get("hub_kpis")
+    if changed or kpis is None or time.time() - kpis["fetched_at"] > 60:
+        kpis = fetch_hub_kpis(hub_id)
+        kpis["fetched_at"] = time.time()
+        st.session_state.hub_kpis = kpis
+    today_orders = kpis["today_out"]
+    if today_orders >= kpis["woohoo_threshold"]:
+        st.success(f"✅ Orders Processed Today: {today_orders}")
+        st.markdown("🎉 <span style='color:gold;font-size:1.4em'><b>WOOHOO!</b></span>", unsafe_allow_html=True)
+    else:
+        st.success(f"✅ Orders Processed Today: {today_orders}")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("OUT This Week", kpis["week_out"])
+    col2.metric("Stockouts", int((inventory_df["Inventory"] <= 0).sum()))
+    col3.metric("Top Mover This Week", kpis["top_movers"][0][0] if kpis["top_movers"] else "—")
+    if kpis["top_movers"]:
+        st.dataframe(pd.DataFrame(kpis["top_movers"], columns=["SKU", "OUT This Week"]))
+
 # --- Hub Dashboard ---
 def render_hub_dashboard(hub_id, username):
+    multi_hub = len(current_permissions().hubs(VIEW_INVENTORY) or []) > 1
+    extra = (["Reservations"] if not SHARDED else []) + (["My Hubs"] if multi_hub else [])
     tabs = st.tabs([
-        "Inventory", "Inventory Out Trends", "Supply Notes", "Add Inventory Transaction", "Notifications"
-    ])
+        "Inventory", "Inventory Out Trends", "Supply Notes", "Add Inventory Transaction", "Cycle Count", "Notifications"
+    ] + extra)
+    extra_tabs = dict(zip(extra, tabs[6:]))
     with tabs[0]:
-        inventory_df = pd.DataFrame(fetch_inventory_for_hub(hub_id), columns=["Product", "SKU", "Barcode", "Inventory"])
-        st.subheader("📦 My Inventory")
-        st.dataframe(inventory_df)
-        low_stock = inventory_df[inventory_df["Inventory"] < 10]
-        if not low_stock.empty:
-            st.warning("⚠️ The following items are below 10 in stock. Contact HQ for restock:")
-            st.dataframe(low_stock)
-        today_orders = fetch_today_orders(hub_id)
-        if today_orders >= 10:
-            st.success(f"✅ Orders Processed Today: {today_orders}  \n🎉 <span style='color:gold;font-size:1.4em'><b>WOOHOO!</b></span>", unsafe_allow_html=True)
-        else:
-            st.success(f"✅ Orders Processed Today: {today_orders}")
+        render_hub_inventory(hub_id)
     with tabs[1]:
         st.subheader("📈 Inventory OUT Trends")
         history_df = fetch_inventory_history(hub_id)
+        render_snapshot_freshness()
         if not history_df.empty:
-            chart = alt.Chart(history_df).mark_line().encode(
-                x='date:T', y='total_out:Q', color='sku:N'
+            top = st.slider("SKUs shown (the rest are grouped as Other)", 3, 30, TOP_SERIES, key="trend_top")
+            points, stats = downsample_lines(history_df, "date", "total_out", "sku", top=top)
+            chart = alt.Chart(points).mark_line().encode(
+                x='date:T', y=alt.Y('total_out:Q', title=f"OUT per {stats['bucket']}"), color='sku:N'
             ).properties(title="Inventory OUT Trends")
-            st.altair_chart(chart, use_container_width=True)
+            render_chart(chart, stats)
         else:
             st.info("No OUT transactions yet.")
     with tabs[2]:
@@ -448,46 +1287,96 @@ def render_hub_dashboard(hub_id, username):
                 st.markdown(f":blue[Message]: {msg}")
                 if row['response']:
                     st.markdown(f":green[HQ Reply]: {row['response']} _(by {row['admin']})_")
+                status = supply_request_status(row)
+                if status:
+                    st.markdown(status)
         else:
             st.info("No messages to HQ yet.")
     with tabs[3]:
-        st.subheader("➕ Add Inventory Transaction")
-        sku_data = fetch_skus_for_hub(hub_id)
-        if not sku_data:
-            st.info("No SKUs assigned yet.")
-            return
-        sku_options = {f"{name} ({sku})": sku for name, sku, _ in sku_data}
-        selected_label = st.selectbox("Select SKU", list(sku_options.keys()))
-        selected_sku = sku_options[selected_label]
-        action = st.radio("Action", ["IN", "OUT"], horizontal=True)
-        quantity = st.number_input("Quantity", min_value=1, step=1)
-        comment = st.text_input("Optional Comment")
-        if st.button("Submit Inventory Update"):
-            log_inventory(st.session_state.user["id"], selected_sku, action, quantity, hub_id, comment)
-            st.success(f"{action} of {quantity} for {selected_label} recorded.")
-            st.rerun()
+        render_inventory_transaction_form(hub_id)
     with tabs[4]:
-        st.subheader("🔔 Notifications")
-        notif_df = fetch_notifications_for_user('hub', st.session_state.user["id"])
-        if not notif_df.empty:
-            st.dataframe(notif_df)
+        render_cycle_count_panel(hub_id)
+    with tabs[5]:
+        render_notifications()
+    if "Reservations" in extra_tabs:
+        with extra_tabs["Reservations"]:
+            render_reservations_panel(hub_id)
+    if "My Hubs" in extra_tabs:
+        with extra_tabs["My Hubs"]:
+            st.subheader("🏬 Inventory Across My Hubs")
+            st.dataframe(fetch_all_inventory())
+            render_snapshot_freshness()
+
+# --- Supplier Dashboard ---
+def render_supplier_dashboard(username):
+    tabs = st.tabs(["Open Requests", "Register Shipments", "My Shipments", "Lead Times", "Notifications"])
+    open_requests = fetch_supplier_requests()
+    with tabs[0]:
+        st.subheader("📋 Open Supply Requests")
+        if open_requests.empty:
+            st.info("No open requests addressed to you.")
         else:
-            st.info("No notifications yet.")
+            edited = st.data_editor(open_requests, key="confirm_editor", hide_index=True,
+                                    disabled=[c for c in open_requests.columns if c != "Confirmed Qty"])
+            if st.button("Confirm Quantities"):
+                confirmations = {int(r): int(q) for r, q in zip(edited["Request"], edited["Confirmed Qty"]) if pd.notna(q)}
+                if confirmations and confirm_supplier_quantities(confirmations):
+                    st.success(f"Confirmed {len(confirmations)} request(s).")
+                    st.rerun()
+    with tabs[1]:
+        st.subheader("🚚 Register Shipments")
+        if open_requests.empty:
+            st.info("Nothing to ship.")
+        else:
+            st.markdown("Fill in a tracking number for every request you are shipping (paste a column from a spreadsheet for many at once).")
+            sheet = open_requests[["Request", "Hub", "SKU"]].copy()
+            sheet["Amount"] = open_requests["Confirmed Qty"].fillna(open_requests["Requested Qty"])
+            sheet["Tracking"] = ""
+            edited = st.data_editor(sheet, key="shipment_editor", hide_index=True, disabled=["Request", "Hub", "SKU"])
+            if st.button("Register Shipments"):
+                shipping = edited[edited["Tracking"].fillna("").str.strip() != ""]
+                shipments = list(zip(shipping["Request"], shipping["Tracking"], shipping["Amount"].fillna(0)))
+                if not shipments:
+                    st.error("Enter at least one tracking number.")
+                else:
+                    registered, rejected = register_supplier_shipments(shipments)
+                    if registered:
+                        st.success(f"Registered {registered} shipment(s).")
+                    if rejected:
+                        st.warning(f"⚠️ Not registered (closed request or missing amount): {', '.join(map(str, rejected))}")
+    with tabs[2]:
+        st.subheader("📦 My Shipments")
+        shipments = fetch_supplier_shipments()
+        if not shipments.empty:
+            st.dataframe(shipments)
+        else:
+            st.info("No shipments registered yet.")
+    with tabs[3]:
+        st.subheader("⏱️ Fulfillment Lead Times")
+        lead_times = fetch_supplier_lead_times()
+        if not lead_times.empty:
+            st.dataframe(lead_times.drop(columns=["Supplier"]))
+        else:
+            st.info("No fulfilled requests yet.")
+    with tabs[4]:
+        render_notifications()
 
 # --- Admin Dashboard ---
 def render_admin_dashboard(username):
     admin_tabs = st.tabs([
-        "All Inventory", "Inventory Charts", "All Supply Requests", "Send Message", "Add/Remove SKU", "User Management", "Notifications"
+        "All Inventory", "Inventory Charts", "All Supply Requests", "Send Message", "Add/Remove SKU", "User Management", "Shrinkage", "Hub Settings", "Audit Trail", "Reports", "Notifications"
     ])
     with admin_tabs[0]:
         st.subheader("📊 All Inventory Across Hubs")
         inv = fetch_all_inventory()
+        render_snapshot_freshness()
         st.dataframe(inv)
         if st.button("Export All Inventory as CSV"):
             st.download_button("Download CSV", inv.to_csv(index=False), file_name="all_inventory.csv", mime="text/csv")
     with admin_tabs[1]:
         st.subheader("📈 Graphical Inventory Overview")
         df = fetch_all_inventory()
+        render_snapshot_freshness()
         if not df.empty:
             hub = st.selectbox("Select Hub", ["All"] + sorted(df["Hub"].unique()))
             prod = st.selectbox("Select Product", ["All"] + sorted(df["Product"].unique()))
@@ -499,19 +1388,22 @@ def render_admin_dashboard(username):
             if filtered.empty:
                 st.info("No data for this filter.")
             else:
-                chart = alt.Chart(filtered).mark_bar().encode(
+                bars, stats = downsample_bars(filtered, "Product", "Inventory", "Hub")
+                chart = alt.Chart(bars).mark_bar().encode(
                     x=alt.X('Product:N', sort='-y'),
                     y='Inventory:Q',
                     color='Hub:N',
                     tooltip=['Hub', 'Product', 'Inventory']
                 ).properties(width=700, height=400)
-                st.altair_chart(chart, use_container_width=True)
+                render_chart(chart, stats)
                 st.dataframe(filtered)
         else:
             st.info("No inventory data yet.")
     with admin_tabs[2]:
         st.subheader("📬 All Hub Messages/Supply Requests")
         reqs = fetch_all_supply_requests()
+        suppliers = fetch_suppliers()
+        skus = fetch_all_products()["sku"].tolist()
         if not reqs.empty:
             for idx, row in reqs.iterrows():
                 st.markdown(f"---\n:blue[From {row['username']} (hub_id: {row['hub_id']})] **{row['timestamp']}**\n> {row['notes']}")
@@ -524,8 +1416,34 @@ def render_admin_dashboard(username):
                             reply_to_supply_request(row['id'], reply_text, username)
                             st.success("Reply sent.")
                             st.rerun()
+                status = supply_request_status(row)
+                if status:
+                    st.markdown(status)
+                if suppliers and pd.isna(row.get('fulfilled_at')):
+                    with st.expander("Route to supplier"):
+                        with st.form(f"route_form_{row['id']}"):
+                            col1, col2, col3 = st.columns(3)
+                            supplier = col1.selectbox("Supplier", suppliers, key=f"route_supplier_{row['id']}")
+                            sku = col2.selectbox("SKU", skus, key=f"route_sku_{row['id']}")
+                            quantity = col3.number_input("Quantity", min_value=1, step=1, key=f"route_qty_{row['id']}")
+                            if st.form_submit_button("Send to Supplier"):
+                                route_supply_request(row['id'], supplier, sku, int(quantity))
+                                st.success(f"Routed to {supplier}.")
+                                st.rerun()
         else:
             st.info("No supply notes/requests found.")
+        with st.expander("🗄️ Search archived requests"):
+            query = st.text_input("Notes, reply or username", key="archived_requests_query")
+            if query:
+                archived = search_archived_requests(query)
+                if not archived.empty:
+                    st.dataframe(archived)
+                else:
+                    st.info("No archived requests match.")
+        lead_times = fetch_supplier_lead_times()
+        if not lead_times.empty:
+            st.markdown("#### ⏱️ Supplier Lead Times")
+            st.dataframe(lead_times)
     with admin_tabs[3]:
         render_send_message_panel()
     with admin_tabs[4]:
@@ -533,16 +1451,35 @@ def render_admin_dashboard(username):
     with admin_tabs[5]:
         render_user_management_panel()
     with admin_tabs[6]:
-        st.subheader("🔔 Notifications")
-        notif_df = fetch_notifications_for_user(st.session_state.user['role'], st.session_state.user['id'])
-        if not notif_df.empty:
-            st.dataframe(notif_df)
-        else:
-            st.info("No notifications yet.")
+        render_shrinkage_panel()
+    with admin_tabs[7]:
+        render_hub_settings_panel()
+    with admin_tabs[8]:
+        render_audit_panel()
+    with admin_tabs[9]:
+        render_reports_panel()
+    with admin_tabs[10]:
+        render_notifications()
 
 # --- LOGIN FLOW ---
 if 'user' not in st.session_state:
-    st.session_state.user = None
+    # A signed session token in the URL restores a returning session without re-authenticating.
+    # The URL ends up in browser history, so the token only resolves for the client it was issued to.
+    token = st.query_params.get("session")
+    st.session_state.user = sessions.resolve(token, current_client()) if token else None
+
+if st.session_state.user is not None:
+    # Checked on every rerun so deactivation or a role/hub change reaches sessions already open
+    account = fetch_account(st.session_state.user["id"])
+    if account is None or not account[2]:
+        sessions.revoke(st.query_params.get("session"))
+        st.query_params.clear()
+        st.session_state.clear()
+        st.session_state.user = None
+        st.warning("Your account is no longer active.")
+    elif tuple(account[:2]) != (st.session_state.user["role"], st.session_state.user["hub_id"]):
+        st.session_state.user.update(role=account[0], hub_id=account[1])
+        st.session_state.pop("permissions", None)
 
 if st.session_state.user is None:
     st.title("🧦 TTT Inventory Login")
@@ -559,16 +1496,33 @@ if st.session_state.user is None:
                     "hub_id": result[2],
                     "username": username
                 }
+                st.query_params["session"] = sessions.issue(st.session_state.user, current_client())
                 st.rerun()
             else:
                 st.error("❌ Invalid username or password")
 else:
     st.sidebar.success(f"Logged in as: {st.session_state.user['username']} ({st.session_state.user['role']})")
     if st.sidebar.button("Logout"):
+        sessions.revoke(st.query_params.get("session"))
+        st.query_params.clear()
         st.session_state.clear()
         st.rerun()
     user = st.session_state.user
-    if user["role"] == "admin":
-        render_admin_dashboard(user["username"])
-    else:
-        render_hub_dashboard(user["hub_id"], user["username"])
+    permissions = current_permissions()
+    my_hubs = permissions.hubs(VIEW_INVENTORY)
+    try:
+        if user["role"] == "admin":
+            render_admin_dashboard(user["username"])
+        elif permissions.allows(SUPPLIER_PORTAL):
+            render_supplier_dashboard(user["username"])
+        elif not my_hubs:
+            st.warning("Your account is not assigned to a hub yet. Contact HQ.")
+        else:
+            # Managers overseeing several hubs pick one; everyone else gets their own
+            hubs = fetch_all_hubs()
+            hub_names = dict(zip(hubs['id'], hubs['name']))
+            hub_id = my_hubs[0] if len(my_hubs) == 1 else st.sidebar.selectbox(
+                "Hub", my_hubs, format_func=lambda h: hub_names.get(h, f"Hub {h}"))
+            render_hub_dashboard(hub_id, user["username"])
+    except PermissionDenied as e:
+        st.error(f"⛔ {e}")
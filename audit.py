@@ -0,0 +1,166 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+from datetime import datetime
+
+DB_FILE = "barcodes.db"
+GENESIS_HASH = "0" * 64
+VERIFY_BATCH = 5000
+
+# Append-only change records; each row's hash covers its content and the previous row's hash.
+# audit_head is a single row that every append updates first, so concurrent writers
+# (app, CLI, offline sync) queue on its row lock and the chain never forks.
+AUDIT_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS audit_log (
+        id {pk}, created {ts}, actor_id INTEGER, entity TEXT, entity_id TEXT, action TEXT,
+        details TEXT, prev_hash TEXT, hash TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS audit_head (
+        id INTEGER PRIMARY KEY, last_id INTEGER, last_hash TEXT
+    )""",
+    f"INSERT INTO audit_head (id, last_id, last_hash) SELECT 1, 0, '{GENESIS_HASH}' WHERE NOT EXISTS (SELECT 1 FROM audit_head)",
+    """CREATE TABLE IF NOT EXISTS audit_checkpoints (
+        id {pk}, verified_at {ts}, last_id INTEGER, last_hash TEXT, records INTEGER
+    )""",
+]
+
+# Block in-place edits of the audit trail and the inventory log (run after the tables exist)
+SQLITE_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS {table}_no_{op.lower()} BEFORE {op} ON {table}
+        BEGIN SELECT RAISE(ABORT, '{table} is append-only'); END"""
+    for table in ("audit_log", "inventory_log") for op in ("UPDATE", "DELETE")
+]
+POSTGRES_TRIGGERS = [
+    """CREATE OR REPLACE FUNCTION reject_change() RETURNS trigger AS $$
+        BEGIN RAISE EXCEPTION '% is append-only', TG_TABLE_NAME; END; $$ LANGUAGE plpgsql""",
+] + [
+    stmt for table in ("audit_log", "inventory_log") for stmt in (
+        f"DROP TRIGGER IF EXISTS {table}_append_only ON {table}",
+        f"""CREATE TRIGGER {table}_append_only BEFORE UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION reject_change()""",
+    )
+]
+
+
+def record_hash(prev_hash, created, actor_id, entity, entity_id, action, details):
+    payload = json.dumps([prev_hash, str(created), actor_id, entity, str(entity_id), action, details],
+                         separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# --- Writing ---
+def append_audit(conn, actor_id, entity, entity_id, action, details=None, created=None):
+    # Call on the connection/transaction that made the change; caller commits
+    created = created or datetime.now()
+    actor_id = int(actor_id) if actor_id is not None else None
+    details = json.dumps(details or {}, sort_keys=True, default=str)
+    c = conn.cursor()
+    c.execute("UPDATE audit_head SET last_id = last_id WHERE id = 1")  # takes the chain lock
+    c.execute("SELECT last_hash FROM audit_head WHERE id = 1")
+    prev_hash = c.fetchone()[0]
+    digest = record_hash(prev_hash, created, actor_id, entity, entity_id, action, details)
+    c.execute("""
+        INSERT INTO audit_log (created, actor_id, entity, entity_id, action, details, prev_hash, hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (created, actor_id, entity, str(entity_id), action, details, prev_hash, digest))
+    c.execute("SELECT MAX(id) FROM audit_log")
+    c.execute("UPDATE audit_head SET last_id = ?, last_hash = ? WHERE id = 1", (c.fetchone()[0], digest))
+    return digest
+
+
+def audit_inventory(conn, actor_id, log_id, timestamp, sku, action, quantity, hub_id, comment=None):
+    return append_audit(conn, actor_id, "inventory", log_id, action, {
+        "sku": sku, "quantity": int(quantity), "hub": int(hub_id), "timestamp": timestamp, "comment": comment,
+    })
+
+
+# --- Verification ---
+def latest_checkpoint(conn):
+    c = conn.cursor()
+    c.execute("SELECT last_id, last_hash, verified_at FROM audit_checkpoints ORDER BY id DESC LIMIT 1")
+    return c.fetchone()
+
+
+def verify_audit_chain(conn, full=False, check_inventory=True, batch=VERIFY_BATCH):
+    # Checks records after the last checkpoint (or all with full=True) and, when clean,
+    # records a new checkpoint. Returns (records checked, list of problems); caller commits.
+    c = conn.cursor()
+    checkpoint = None if full else latest_checkpoint(conn)
+    last_id, prev_hash = (checkpoint[0], checkpoint[1]) if checkpoint else (0, GENESIS_HASH)
+    problems = []
+    if last_id:
+        # The checkpointed record must still be there, unchanged
+        c.execute("SELECT hash FROM audit_log WHERE id = ?", (last_id,))
+        row = c.fetchone()
+        if row is None or row[0] != prev_hash:
+            return 0, [(last_id, "checkpointed record missing or altered")]
+    checked = 0
+    while True:
+        c.execute(f"""
+            SELECT id, created, actor_id, entity, entity_id, action, details, prev_hash, hash
+            FROM audit_log WHERE id > ? ORDER BY id LIMIT {batch}""", (last_id,))
+        rows = c.fetchall()
+        if not rows:
+            break
+        for record_id, created, actor_id, entity, entity_id, action, details, stored_prev, stored_hash in rows:
+            if stored_prev != prev_hash:
+                problems.append((record_id, "chain broken (record removed or reordered before it)"))
+            elif record_hash(stored_prev, created, actor_id, entity, entity_id, action, details) != stored_hash:
+                problems.append((record_id, "record contents altered"))
+            prev_hash = stored_hash
+        if check_inventory:
+            problems += _check_inventory_rows(conn, rows)
+        checked += len(rows)
+        last_id = rows[-1][0]
+        if problems:
+            break
+    if checked and not problems:
+        c.execute("""
+            INSERT INTO audit_checkpoints (verified_at, last_id, last_hash, records) VALUES (?, ?, ?, ?)""",
+            (datetime.now(), last_id, prev_hash, checked))
+    return checked, problems
+
+
+def _check_inventory_rows(conn, records):
+    # The audited inventory_log rows must still say what they said when they were written
+    audited = {int(entity_id): (record_id, action, json.loads(details))
+               for record_id, _, _, entity, entity_id, action, details, _, _ in records if entity == "inventory"}
+    if not audited:
+        return []
+    c = conn.cursor()
+    marks = ", ".join("?" for _ in audited)
+    c.execute(f"SELECT id, sku, action, quantity, hub FROM inventory_log WHERE id IN ({marks})", list(audited))
+    current = {row[0]: row[1:] for row in c.fetchall()}
+    problems = []
+    for log_id, (record_id, action, details) in audited.items():
+        row = current.get(log_id)
+        if row is None:
+            problems.append((record_id, f"inventory_log #{log_id} deleted"))
+        elif (row[0], row[1], row[2], int(row[3])) != (details["sku"], action, details["quantity"], details["hub"]):
+            problems.append((record_id, f"inventory_log #{log_id} altered"))
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify the audit trail hash chain.")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--full", action="store_true", help="re-verify from the first record instead of the last checkpoint")
+    args = parser.parse_args()
+    from sharding import sharding_enabled, verify_shard_audits
+    conn = sqlite3.connect(args.db)
+    started = datetime.now()
+    # In sharded mode the log rows and their audit chains live in the hub shards
+    checked, problems = verify_audit_chain(conn, full=args.full, check_inventory=not sharding_enabled())
+    conn.commit()
+    conn.close()
+    if sharding_enabled():
+        for hub_id, (hub_checked, hub_problems) in verify_shard_audits(full=args.full).items():
+            checked += hub_checked
+            problems += [(f"hub {hub_id} {record_id}", problem) for record_id, problem in hub_problems]
+    elapsed = (datetime.now() - started).total_seconds()
+    if problems:
+        for record_id, problem in problems:
+            print(f"❌ #{record_id}: {problem}")
+    else:
+        print(f"✅ {checked} new audit records verified in {elapsed:.2f}s.")
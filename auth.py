@@ -0,0 +1,173 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DB_FILE = "barcodes.db"
+SECRET_KEY_FILE = ".session_key"
+SESSION_TTL_SECONDS = 12 * 3600
+HASH_WORKERS = 4
+
+# scrypt cost (~50 ms per hash); stored alongside each hash so it can be raised later
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+PBKDF2_ITERATIONS = 600000
+SALT_BYTES = 16
+
+
+# --- Password hashing ("scheme$params$salt$hash", base64 fields) ---
+def _b64(raw):
+    return base64.b64encode(raw).decode("ascii")
+
+
+def hash_password(password):
+    salt = os.urandom(SALT_BYTES)
+    if hasattr(hashlib, "scrypt"):
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+        return f"scrypt${SCRYPT_N}:{SCRYPT_R}:{SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+    # Python builds without OpenSSL scrypt
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, PBKDF2_ITERATIONS)
+    return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${_b64(salt)}${_b64(digest)}"
+
+
+def is_hashed(stored):
+    return bool(stored) and stored.startswith(("scrypt$", "pbkdf2_sha256$"))
+
+
+def verify_password(password, stored):
+    if not stored or password is None:
+        return False
+    if not is_hashed(stored):
+        # Legacy plaintext row, upgraded by the caller after a successful login
+        return hmac.compare_digest(password.encode(), stored.encode())
+    scheme, params, salt, expected = stored.split("$")
+    salt, expected = base64.b64decode(salt), base64.b64decode(expected)
+    if scheme == "scrypt":
+        n, r, p = (int(v) for v in params.split(":"))
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=len(expected))
+    else:
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, int(params), dklen=len(expected))
+    return hmac.compare_digest(digest, expected)
+
+
+# Hashes run here so a burst of logins queues on a few workers instead of
+# tying up a script thread each (hashlib releases the GIL while hashing)
+_hash_pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="pwhash")
+
+
+def hash_password_async(password):
+    return _hash_pool.submit(hash_password, password)
+
+
+def verify_password_async(password, stored):
+    return _hash_pool.submit(verify_password, password, stored)
+
+
+def authenticate(conn, username, password):
+    # Returns (id, role, hub_id) or None; plaintext rows are rehashed on success
+    c = conn.cursor()
+    c.execute("SELECT id, role, hub_id, password FROM users WHERE username=? AND active=1", (username,))
+    for user_id, role, hub_id, stored in c.fetchall():
+        if verify_password_async(password, stored).result():
+            if not is_hashed(stored):
+                c.execute("UPDATE users SET password=? WHERE id=?",
+                          (hash_password_async(password).result(), user_id))
+                conn.commit()
+            return user_id, role, hub_id
+    return None
+
+
+def migrate_plaintext_passwords(conn):
+    # One-off upgrade of every row still holding a plaintext password; caller commits
+    c = conn.cursor()
+    c.execute("SELECT id, password FROM users WHERE password IS NOT NULL")
+    legacy = [(user_id, stored) for user_id, stored in c.fetchall() if not is_hashed(stored)]
+    hashed = _hash_pool.map(hash_password, [stored for _, stored in legacy])
+    c.executemany("UPDATE users SET password=? WHERE id=?",
+                  [(new, user_id) for (user_id, _), new in zip(legacy, hashed)])
+    return len(legacy)
+
+
+# --- Signed session tokens, cached server-side ---
+def _secret_key():
+    key = os.environ.get("TTT_SECRET_KEY")
+    if key:
+        return key.encode()
+    try:
+        # Owner-only from the moment it exists
+        fd = os.open(SECRET_KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w", encoding="ascii") as f:
+            f.write(secrets.token_hex(32))
+    except FileExistsError:
+        if os.stat(SECRET_KEY_FILE).st_mode & 0o077:
+            os.chmod(SECRET_KEY_FILE, 0o600)  # written by an older version with the default umask
+    with open(SECRET_KEY_FILE, "r", encoding="ascii") as f:
+        return f.read().strip().encode()
+
+
+def _sign(payload, client=""):
+    return hmac.new(_secret_key(), f"{payload}|{client}".encode(), hashlib.sha256).hexdigest()
+
+
+def client_binding(user_agent, ip_address):
+    # Ties a token to the browser that logged in; it rides in the page URL (Streamlit can't
+    # set cookies), so a copied link or history entry must not work from another client
+    return hashlib.sha256(f"{user_agent or ''}|{ip_address or ''}".encode()).hexdigest()
+
+
+class SessionCache:
+    # token -> (user dict, expiry); tokens are "user_id.expiry.nonce.signature",
+    # the signature also covering the client binding
+
+    def __init__(self, ttl=SESSION_TTL_SECONDS):
+        self.ttl = ttl
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def issue(self, user, client=""):
+        expires = int(time.time()) + self.ttl
+        payload = f"{user['id']}.{expires}.{secrets.token_hex(8)}"
+        token = f"{payload}.{_sign(payload, client)}"
+        with self.lock:
+            self.sessions[token] = (dict(user), expires)
+        return token
+
+    def resolve(self, token, client=""):
+        # The signature, client and expiry are checked before touching the cache
+        try:
+            payload, signature = token.rsplit(".", 1)
+            expires = int(payload.split(".")[1])
+        except (AttributeError, ValueError, IndexError):
+            return None
+        if not hmac.compare_digest(signature, _sign(payload, client)):
+            return None  # forged, or replayed from another client (leave the owner's session alone)
+        if expires < time.time():
+            self.revoke(token)
+            return None
+        with self.lock:
+            entry = self.sessions.get(token)
+        return dict(entry[0]) if entry else None
+
+    def revoke(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
+
+    def revoke_user(self, user_id):
+        with self.lock:
+            for token in [t for t, (user, _) in self.sessions.items() if user["id"] == user_id]:
+                del self.sessions[token]
+
+
+sessions = SessionCache()
+
+
+if __name__ == "__main__":
+    conn = sqlite3.connect(DB_FILE)
+    count = migrate_plaintext_passwords(conn)
+    conn.commit()
+    conn.close()
+    print(f"✅ {count} plaintext passwords hashed.")
@@ -0,0 +1,105 @@
+import argparse
+
+DB_FILE = "barcodes.db"
+
+# Bill of materials: a pack or bundle is a products row whose stock lives in its components
+# (a 3-pair pack is 3 x the single pair; a gift bundle may mix SKUs or contain other packs).
+# bundle_movements keeps the pack-level record of each scan; its component lines go to
+# inventory_log with the comment "Bundle #<id>", so reports can count either way.
+BUNDLE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS product_components (
+        parent_sku TEXT, component_sku TEXT, quantity INTEGER, PRIMARY KEY (parent_sku, component_sku)
+    )""",
+    """CREATE TABLE IF NOT EXISTS bundle_movements (
+        id {pk}, key TEXT UNIQUE, timestamp {ts}, hub_id INTEGER, sku TEXT, action TEXT, packs INTEGER,
+        user_id INTEGER, comment TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_bundle_movements_hub_timestamp ON bundle_movements (hub_id, timestamp)",
+]
+
+
+def bundle_comment(movement_id, comment=None):
+    return f"Bundle #{movement_id}: {comment}" if comment else f"Bundle #{movement_id}"
+
+
+# --- Expansion (precomputed once per catalog load) ---
+def expand_components(rows):
+    # rows: (parent_sku, component_sku, quantity). Returns {parent: ((sku, units per pack), ...)}
+    # flattened down to single units; raises ValueError on a bundle that contains itself.
+    direct = {}
+    for parent, component, quantity in rows:
+        direct.setdefault(parent, []).append((component, int(quantity)))
+    flat = {}
+
+    def flatten(sku, path):
+        if sku in flat:
+            return flat[sku]
+        if sku in path:
+            raise ValueError(f"Bundle {sku} contains itself ({' > '.join(path + (sku,))})")
+        units = {}
+        for component, quantity in direct[sku]:
+            parts = flatten(component, path + (sku,)) if component in direct else ((component, 1),)
+            for part, per in parts:
+                units[part] = units.get(part, 0) + quantity * per
+        flat[sku] = tuple(sorted(units.items()))
+        return flat[sku]
+
+    for parent in direct:
+        flatten(parent, ())
+    return flat
+
+
+def component_lines(expansion, packs):
+    # Component movements for a number of packs
+    return [(sku, per * int(packs)) for sku, per in expansion]
+
+
+# --- Catalog edits (caller commits, then refreshes the SKU index) ---
+def fetch_components(conn, parent_sku=None):
+    c = conn.cursor()
+    where = "WHERE parent_sku = ? " if parent_sku is not None else ""
+    c.execute(f"SELECT parent_sku, component_sku, quantity FROM product_components {where}ORDER BY parent_sku, component_sku",
+              (parent_sku,) if parent_sku is not None else ())
+    return c.fetchall()
+
+
+def set_components(conn, parent_sku, components):
+    # components: {component_sku: quantity}; an empty mapping makes the product a single unit again
+    components = {sku: int(qty) for sku, qty in components.items() if sku and int(qty) > 0}
+    rows = [row for row in fetch_components(conn) if row[0] != parent_sku]
+    rows += [(parent_sku, sku, qty) for sku, qty in components.items()]
+    expand_components(rows)  # refuse cycles before writing
+    conn.execute("DELETE FROM product_components WHERE parent_sku = ?", (parent_sku,))
+    conn.executemany("INSERT INTO product_components (parent_sku, component_sku, quantity) VALUES (?, ?, ?)",
+                     [(parent_sku, sku, qty) for sku, qty in components.items()])
+
+
+# --- Pack-level movements ---
+def record_bundle_movement(db, conn, hub_id, sku, action, packs, user_id, comment, timestamp, key=None):
+    # Returns the movement id. With a key (offline sync; db may be None) a replay returns the existing id.
+    c = conn.cursor()
+    if key is not None:
+        c.execute("""
+            INSERT INTO bundle_movements (key, timestamp, hub_id, sku, action, packs, user_id, comment)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO NOTHING""",
+            (key, timestamp, int(hub_id), sku, action, int(packs), user_id, comment))
+        c.execute("SELECT id FROM bundle_movements WHERE key = ?", (key,))
+        return c.fetchone()[0]
+    return db.insert_id(c, """
+        INSERT INTO bundle_movements (timestamp, hub_id, sku, action, packs, user_id, comment)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""", (timestamp, int(hub_id), sku, action, int(packs), user_id, comment))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List packs and bundles with their unit breakdown.")
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+    from storage import SQLiteBackend
+    db = SQLiteBackend(args.db)
+    db.create_tables()
+    conn = db.connect()
+    expansions = expand_components(fetch_components(conn))
+    conn.close()
+    for parent, parts in sorted(expansions.items()):
+        print(f"📦 {parent}: " + ", ".join(f"{qty} x {sku}" for sku, qty in parts))
+    print(f"✅ {len(expansions)} packs/bundles.")
@@ -0,0 +1,64 @@
+POLL_SECONDS = 10
+
+
+# --- inventory_log change feed (high-water mark on the autoincrement id) ---
+# Exact only on SQLite, where the single writer commits ids in order; on PostgreSQL a row can
+# commit below the mark after it was read, so callers reload there instead of polling deltas.
+def latest_log_id(conn, hub_id=None):
+    c = conn.cursor()
+    if hub_id is None:
+        c.execute("SELECT MAX(id) FROM inventory_log")
+    else:
+        c.execute("SELECT MAX(id) FROM inventory_log WHERE hub = ?", (hub_id,))
+    return c.fetchone()[0] or 0
+
+
+def has_changes(conn, since_id, hub_id=None):
+    # The cheap "anything new since X?" probe: a primary-key range seek
+    c = conn.cursor()
+    if hub_id is None:
+        c.execute("SELECT 1 FROM inventory_log WHERE id > ? LIMIT 1", (since_id,))
+    else:
+        c.execute("SELECT 1 FROM inventory_log WHERE id > ? AND hub = ? LIMIT 1", (since_id, hub_id))
+    return c.fetchone() is not None
+
+
+def fetch_deltas(conn, since_id, hub_id=None):
+    c = conn.cursor()
+    if hub_id is None:
+        c.execute("SELECT id, sku, action, quantity, hub FROM inventory_log WHERE id > ? ORDER BY id", (since_id,))
+    else:
+        c.execute("""
+            SELECT id, sku, action, quantity, hub FROM inventory_log
+            WHERE id > ? AND hub = ? ORDER BY id""", (since_id, hub_id))
+    return c.fetchall()
+
+
+def signed_quantity(action, quantity):
+    # ADJUST quantities are already signed
+    return -(quantity or 0) if action == "OUT" else (quantity or 0)
+
+
+class LiveBalances:
+    # A hub's cached inventory DataFrame, patched in place from log deltas
+
+    def __init__(self, hub_id, df, high_water, catalog_version):
+        self.hub_id = hub_id
+        self.df = df
+        self.high_water = high_water
+        self.catalog_version = catalog_version
+
+    def poll(self, conn):
+        # Returns True if anything changed; False means the cached frame is current
+        if not has_changes(conn, self.high_water, self.hub_id):
+            return False
+        deltas = fetch_deltas(conn, self.high_water, self.hub_id)
+        changes = {}
+        for _, sku, action, quantity, _ in deltas:
+            changes[sku] = changes.get(sku, 0) + signed_quantity(action, quantity)
+        df = self.df.copy()
+        sku_rows = df["SKU"].isin(changes.keys())
+        df.loc[sku_rows, "Inventory"] += df.loc[sku_rows, "SKU"].map(changes)
+        self.df = df
+        self.high_water = deltas[-1][0]
+        return True
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+
+# Charts ship their data to the browser as Vega JSON, so everything here shrinks a frame
+# server-side before it is charted: coarser time buckets, top-N series plus "Other", and
+# LTTB point reduction, under a hard cap of MAX_POINTS rows per chart.
+MAX_POINTS = 1500
+TOP_SERIES = 10
+OTHER = "Other"
+DAILY_MAX_DAYS = 120
+WEEKLY_MAX_DAYS = 730
+BUCKET_LABELS = {"day": "daily", "week": "weekly", "month": "monthly"}
+
+
+def bucket_for_range(start, end):
+    days = (pd.Timestamp(end) - pd.Timestamp(start)).days
+    if days <= DAILY_MAX_DAYS:
+        return "day"
+    return "week" if days <= WEEKLY_MAX_DAYS else "month"
+
+
+def bucket_dates(dates, bucket):
+    dates = pd.to_datetime(dates)
+    if bucket == "week":
+        return dates.dt.to_period("W-SUN").dt.start_time
+    if bucket == "month":
+        return dates.dt.to_period("M").dt.start_time
+    return dates.dt.normalize()
+
+
+def top_n(df, key, value, n=TOP_SERIES, other=OTHER):
+    # Keeps the n keys with the largest total |value| and sums the rest into one "Other" key
+    totals = df.groupby(key)[value].apply(lambda s: s.abs().sum()).sort_values(ascending=False)
+    if len(totals) <= n:
+        return df
+    keep = set(totals.index[:n])
+    df = df.copy()
+    df[key] = df[key].where(df[key].isin(keep), other)
+    group = [c for c in df.columns if c != value]
+    return df.groupby(group, as_index=False, sort=False)[value].sum()
+
+
+def lttb(x, y, threshold):
+    # Largest-Triangle-Three-Buckets: indices of `threshold` points that keep the line's shape
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = [0]
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third triangle corner
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        ax, ay = x[keep[-1]], y[keep[-1]]
+        area = np.abs((ax - avg_x) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (avg_y - ay))
+        keep.append(lo + int(area.argmax()))
+    keep.append(n - 1)
+    return np.array(keep)
+
+
+def downsample_lines(df, x, y, series, top=TOP_SERIES, max_points=MAX_POINTS):
+    # Time series per `series` (x holds dates). Returns (frame, stats) with at most max_points rows.
+    stats = {"source_points": len(df), "bucket": "day", "series": 0, "points": 0}
+    if df.empty:
+        return df, stats
+    df = df.assign(**{x: pd.to_datetime(df[x])})
+    stats["bucket"] = bucket_for_range(df[x].min(), df[x].max())
+    df = df.assign(**{x: bucket_dates(df[x], stats["bucket"])})
+    df = df.groupby([series, x], as_index=False)[y].sum()
+    df = top_n(df, series, y, top)
+    names = df[series].unique()
+    stats["series"] = len(names)
+    budget = max(max_points // len(names), 3)
+    parts = []
+    for name in names:
+        line = df[df[series] == name].sort_values(x)
+        if len(line) > budget:
+            line = line.iloc[lttb(line[x].astype("int64"), line[y], budget)]
+        parts.append(line)
+    df = pd.concat(parts, ignore_index=True).head(max_points)
+    stats["points"] = len(df)
+    return df, stats
+
+
+def downsample_bars(df, category, value, color=None, top=TOP_SERIES * 3, max_points=MAX_POINTS):
+    # Bar charts: the `top` categories by total |value| plus "Other", split by color if given
+    stats = {"source_points": len(df), "bucket": None, "series": 0, "points": 0}
+    if df.empty:
+        return df, stats
+    group = [category] + ([color] if color else [])
+    df = df.groupby(group, as_index=False)[value].sum()
+    df = top_n(df, category, value, top)
+    stats["series"] = df[category].nunique()
+    df = df.head(max_points)
+    stats["points"] = len(df)
+    return df, stats
+
+
+def payload_bytes(chart):
+    # Size of the Vega-Lite spec (data included) the browser has to download
+    return len(chart.to_json(validate=False).encode())
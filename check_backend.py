@@ -0,0 +1,201 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from storage import SQLiteBackend, PostgresBackend, DATABASE_URL_ENV
+from audit import append_audit, verify_audit_chain
+from hub_kpis import apply_movement, fetch_kpis, save_hub_settings, DEFAULT_TIMEZONE
+from stock_control import apply_stock, InsufficientStock
+
+# Conformance checks for a storage backend. Uses a throwaway SQLite file by default;
+# set TTT_DATABASE_URL to a PostgreSQL database to run the same checks there in a
+# throwaway schema that is dropped afterwards (inventory_log is append-only, so test
+# rows can't be cleaned up in place).
+
+url = os.environ.get(DATABASE_URL_ENV, "")
+schema = None
+if url.startswith(("postgres://", "postgresql://")):
+    import psycopg2
+    schema = f"ttt_conformance_{os.getpid()}"
+    admin = psycopg2.connect(url)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE SCHEMA {schema}")
+    db = PostgresBackend(f"{url}{'&' if '?' in url else '?'}options=-csearch_path%3D{schema}")
+else:
+    db = SQLiteBackend(os.path.join(tempfile.mkdtemp(), "conformance.db"))
+
+failures = 0
+
+
+def check(label, actual, expected):
+    global failures
+    if actual == expected:
+        print(f"✅ {label}")
+    else:
+        failures += 1
+        print(f"❌ {label}: expected {expected!r}, got {actual!r}")
+
+
+print(f"\n🔌 Checking {db.name} backend\n")
+db.create_tables()
+conn = db.connect()
+c = conn.cursor()
+
+products = [("TEST-SOL-A-PLUS", "Test A", "100000000001"), ("TEST-SOL-B-PLUS", "Test B", None)]
+db.bulk_insert(conn, "products", ["sku", "name", "barcode"], products)
+db.bulk_insert(conn, "products", ["sku", "name", "barcode"], products, ignore_conflicts=True)
+conn.commit()
+c.execute("SELECT COUNT(*) FROM products WHERE sku LIKE 'TEST-%'")
+check("bulk insert ignores duplicates", c.fetchone()[0], 2)
+c.execute("SELECT barcode FROM products WHERE sku = ?", ("TEST-SOL-B-PLUS",))
+check("bulk insert keeps NULLs", c.fetchone()[0], None)
+
+c.execute(db.insert_ignore("hub_skus", ["sku", "hub_id"]), ("TEST-SOL-A-PLUS", 1))
+c.execute(db.insert_ignore("hub_skus", ["sku", "hub_id"]), ("TEST-SOL-A-PLUS", 1))
+conn.commit()
+c.execute("SELECT COUNT(*) FROM hub_skus WHERE sku LIKE 'TEST-%'")
+check("insert_ignore skips existing rows", c.fetchone()[0], 1)
+
+rows = [(datetime.now(), "TEST-SOL-A-PLUS", "IN", 10, 1, 1, None),
+        (datetime.now(), "TEST-SOL-A-PLUS", "OUT", 3, 1, 1, "test")]
+c.executemany("""
+    INSERT INTO inventory_log (timestamp, sku, action, quantity, hub, user_id, comment)
+    VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+conn.commit()
+c.execute("""
+    SELECT COALESCE(SUM(CASE WHEN action='IN' THEN quantity ELSE 0 END),0) -
+    COALESCE(SUM(CASE WHEN action='OUT' THEN quantity ELSE 0 END),0)
+    FROM inventory_log WHERE sku = ? AND hub = ?""", ("TEST-SOL-A-PLUS", 1))
+check("server-side balance aggregation", c.fetchone()[0], 7)
+c.execute(f"""
+    SELECT SUM(quantity) FROM inventory_log
+    WHERE sku = ? AND action = 'OUT' AND {db.date('timestamp')} = {db.today}""", ("TEST-SOL-A-PLUS",))
+check("today's OUT total", c.fetchone()[0], 3)
+c.execute(f"SELECT COUNT(DISTINCT {db.date('timestamp')}) FROM inventory_log WHERE sku = ?", ("TEST-SOL-A-PLUS",))
+check("date bucketing", c.fetchone()[0], 1)
+
+# --- insert_id ---
+first = db.insert_id(c, "INSERT INTO hubs (name) VALUES (?)", ("TEST Hub A",))
+second = db.insert_id(c, "INSERT INTO hubs (name) VALUES (?)", ("TEST Hub B",))
+conn.commit()
+c.execute("SELECT id FROM hubs WHERE name = ?", ("TEST Hub B",))
+check("insert_id returns the new row's id", (c.fetchone()[0], second > first), (second, True))
+
+# --- ON CONFLICT upserts ---
+now = datetime.now()
+apply_movement(conn, 1, "TEST-SOL-A-PLUS", "OUT", 2, now, DEFAULT_TIMEZONE)
+apply_movement(conn, 1, "TEST-SOL-A-PLUS", "OUT", 3, now, DEFAULT_TIMEZONE)
+conn.commit()
+kpis = fetch_kpis(conn, 1, DEFAULT_TIMEZONE)
+check("hub_kpis upserts add up", (kpis["today_out"], kpis["week_out"], [tuple(row) for row in kpis["top_movers"]]),
+      (5, 5, [("TEST-SOL-A-PLUS", 5)]))
+
+save_hub_settings(conn, 1, "UTC", 10)
+save_hub_settings(conn, 1, DEFAULT_TIMEZONE, 20)
+conn.commit()
+c.execute("SELECT COUNT(*), MAX(woohoo_threshold) FROM hub_settings WHERE hub_id = ?", (1,))
+check("hub_settings upsert replaces", tuple(c.fetchone()), (1, 20))
+
+apply_stock(conn, 1, "TEST-SOL-B-PLUS", "IN", 4, enforce=False)
+apply_stock(conn, 1, "TEST-SOL-B-PLUS", "IN", 4, enforce=False)
+conn.commit()
+c.execute("SELECT on_hand FROM stock_levels WHERE hub_id = ? AND sku = ?", (1, "TEST-SOL-B-PLUS"))
+check("stock_levels upsert adds up", c.fetchone()[0], 8)
+
+db.create_tables()  # re-runs the audit_head seed
+append_audit(conn, 1, "test", 1, "CREATE", {"n": 1})
+append_audit(conn, 1, "test", 1, "UPDATE", {"n": 2})
+conn.commit()
+c.execute("SELECT COUNT(*), MAX(last_id) FROM audit_head")
+head = tuple(c.fetchone())
+c.execute("SELECT MAX(id) FROM audit_log")
+check("audit_head stays one row tracking the chain", head, (1, c.fetchone()[0]))
+checked, problems = verify_audit_chain(conn, check_inventory=False)
+conn.commit()
+check("audit chain verifies", (checked, problems), (2, []))
+
+
+# --- Transactions ---
+def add_hub_sku():
+    other = db.connect()
+    try:
+        other.execute("INSERT INTO hub_skus (sku, hub_id) VALUES (?, ?)", ("TEST-SOL-B-PLUS", 2))
+        other.commit()
+    finally:
+        other.close()
+
+
+c.execute("SELECT COUNT(*) FROM hub_skus")
+before = c.fetchone()[0]
+conn.commit()
+reader = db.connect()
+db.begin_read(reader)
+first_read = reader.execute("SELECT COUNT(*) FROM hub_skus").fetchone()[0]
+writer = threading.Thread(target=add_hub_sku)
+writer.start()
+writer.join(0.5)  # on SQLite the writer waits for the reader; PostgreSQL commits meanwhile
+second_read = reader.execute("SELECT COUNT(*) FROM hub_skus").fetchone()[0]
+reader.rollback()
+reader.close()
+writer.join()
+c.execute("SELECT COUNT(*) FROM hub_skus")
+check("begin_read keeps one view across a concurrent commit", (first_read, second_read, c.fetchone()[0]),
+      (before, before, before + 1))
+conn.commit()
+
+results = []
+
+
+def take_stock():
+    w = db.connect()
+    try:
+        db.begin_write(w)
+        apply_stock(w, 1, "TEST-SOL-B-PLUS", "OUT", 5, enforce=True)
+        time.sleep(0.2)  # hold the transaction while the other writer tries
+        w.commit()
+        results.append("posted")
+    except InsufficientStock:
+        w.rollback()
+        results.append("refused")
+    finally:
+        w.close()
+
+
+writers = [threading.Thread(target=take_stock) for _ in range(2)]
+for writer in writers:
+    writer.start()
+for writer in writers:
+    writer.join()
+c.execute("SELECT on_hand FROM stock_levels WHERE hub_id = ? AND sku = ?", (1, "TEST-SOL-B-PLUS"))
+check("begin_write serializes stock checks", (sorted(results), c.fetchone()[0]), (["posted", "refused"], 3))
+conn.commit()
+
+
+# --- Append-only triggers ---
+def rejected(sql, params):
+    try:
+        c.execute(sql, params)
+        refused = False
+    except Exception:
+        refused = True
+    conn.rollback()
+    return refused
+
+
+check("inventory_log rejects deletes", rejected("DELETE FROM inventory_log WHERE sku = ?", ("TEST-SOL-A-PLUS",)), True)
+check("inventory_log rejects updates",
+      rejected("UPDATE inventory_log SET quantity = 99 WHERE sku = ?", ("TEST-SOL-A-PLUS",)), True)
+check("audit_log rejects deletes", rejected("DELETE FROM audit_log WHERE entity = ?", ("test",)), True)
+check("audit_log rejects updates", rejected("UPDATE audit_log SET details = '{}' WHERE entity = ?", ("test",)), True)
+conn.close()
+
+if schema:
+    db.pool.closeall()
+    admin.cursor().execute(f"DROP SCHEMA {schema} CASCADE")
+    admin.close()
+
+print(f"\n{'🚀 All checks passed.' if not failures else f'⚠️ {failures} check(s) failed.'}")
+sys.exit(1 if failures else 0)
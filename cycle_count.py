@@ -0,0 +1,88 @@
+import io
+
+import pandas as pd
+
+ADJUST = "ADJUST"
+
+
+# --- Parsing counts (scans or CSV upload) ---
+def parse_scanned_counts(text, index):
+    # One scan per line, optionally "code qty"; repeated scans of the same item add up
+    counts = {}
+    unknown = []
+    for line in (text or "").splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        sku = index.resolve(parts[0])
+        try:
+            qty = int(parts[1]) if len(parts) > 1 else 1
+        except ValueError:
+            unknown.append(line.strip())
+            continue
+        if not sku:
+            unknown.append(parts[0])
+            continue
+        # A sealed pack counts as its units
+        for unit, units in index.expand(sku, qty):
+            counts[unit] = counts.get(unit, 0) + units
+    return counts, unknown
+
+
+def parse_count_csv(data, index):
+    # CSV with a sku (or barcode) column and a counted/quantity column
+    df = pd.read_csv(io.BytesIO(data) if isinstance(data, bytes) else data, dtype=str)
+    df.columns = [c.strip().lower() for c in df.columns]
+    code_col = next((c for c in ("sku", "barcode") if c in df.columns), None)
+    qty_col = next((c for c in ("counted", "quantity", "qty", "count") if c in df.columns), None)
+    if code_col is None or qty_col is None:
+        raise ValueError("CSV needs a 'sku' or 'barcode' column and a 'counted' or 'quantity' column")
+    df["sku"] = df[code_col].map(index.resolve)
+    unknown = df.loc[df["sku"].isna(), code_col].tolist()
+    df = df.dropna(subset=["sku"])
+    df["counted"] = pd.to_numeric(df[qty_col], errors="coerce").fillna(0).astype(int)
+    counts = {}
+    for sku, counted in df.groupby("sku")["counted"].sum().items():
+        for unit, units in index.expand(sku, counted):
+            counts[unit] = counts.get(unit, 0) + units
+    return counts, unknown
+
+
+# --- Variance ---
+def compute_variances(system_df, counts, zero_missing=True):
+    # system_df: the hub's assigned SKUs with columns SKU and Inventory.
+    # One join/diff over every SKU at once; returns SKU, System, Counted, Variance.
+    system = system_df[["SKU", "Inventory"]].rename(columns={"Inventory": "System"})
+    counted = pd.DataFrame(list(counts.items()), columns=["SKU", "Counted"])
+    merged = system.merge(counted, on="SKU", how="left")
+    if zero_missing:
+        merged["Counted"] = merged["Counted"].fillna(0)
+    else:
+        merged = merged.dropna(subset=["Counted"])
+    merged["System"] = merged["System"].fillna(0).astype(int)
+    merged["Counted"] = merged["Counted"].astype(int)
+    merged["Variance"] = merged["Counted"] - merged["System"]
+    unassigned = sorted(set(counts) - set(system["SKU"]))
+    return merged, unassigned
+
+
+# --- Persistence ---
+def record_cycle_count(db, conn, hub_id, user_id, variances, timestamp):
+    # Writes the count and its lines on conn; the ADJUST rows go through postings.post_lines
+    # with the comment "Cycle count #<id>". Caller commits.
+    c = conn.cursor()
+    count_id = db.insert_id(c, """
+        INSERT INTO cycle_counts (hub_id, user_id, created, skus_counted, total_variance)
+        VALUES (?, ?, ?, ?, ?)""",
+        (hub_id, user_id, timestamp, len(variances), int(variances["Variance"].sum())))
+    lines = [(count_id, hub_id, timestamp, sku, int(system), int(counted), int(variance))
+             for sku, system, counted, variance in variances[["SKU", "System", "Counted", "Variance"]].itertuples(index=False)]
+    c.executemany("""
+        INSERT INTO cycle_count_lines (count_id, hub_id, created, sku, system_qty, counted_qty, variance)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""", lines)
+    return count_id
+
+
+def adjustment_rows(variances):
+    nonzero = variances[variances["Variance"] != 0]
+    return [(sku, int(v)) for sku, v in zip(nonzero["SKU"], nonzero["Variance"])]
@@ -0,0 +1,163 @@
+import argparse
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DB_FILE = "barcodes.db"
+DEFAULT_TIMEZONE = "UTC"
+DEFAULT_WOOHOO_THRESHOLD = 10
+SETTINGS_MAX_AGE_SECONDS = 60
+TOP_MOVERS = 5
+
+# Running counters per hub and per (hub, SKU), keyed by the hub's local day ("D:2025-07-27")
+# and week ("W:2025-07-21", the Monday), so the dashboard header is a primary-key lookup
+KPI_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS hub_kpis (
+        hub_id INTEGER, period TEXT, out_units INTEGER DEFAULT 0, in_units INTEGER DEFAULT 0,
+        PRIMARY KEY (hub_id, period)
+    )""",
+    """CREATE TABLE IF NOT EXISTS hub_sku_kpis (
+        hub_id INTEGER, period TEXT, sku TEXT, out_units INTEGER DEFAULT 0,
+        PRIMARY KEY (hub_id, period, sku)
+    )""",
+]
+
+SETTINGS_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS hub_settings (
+        hub_id INTEGER PRIMARY KEY, timezone TEXT, woohoo_threshold INTEGER
+    )""",
+]
+
+
+def create_kpi_tables(conn):
+    for ddl in KPI_SCHEMA:
+        conn.execute(ddl)
+
+
+# --- Hub settings (timezone, WOOHOO threshold), cached in-process ---
+_settings = {}
+_settings_loaded_at = 0.0
+
+
+def load_hub_settings(conn):
+    global _settings, _settings_loaded_at
+    try:
+        rows = conn.execute("SELECT hub_id, timezone, woohoo_threshold FROM hub_settings").fetchall()
+    except sqlite3.OperationalError:
+        rows = []  # database not upgraded by the app yet; use defaults
+    _settings = {int(hub_id): (tz or DEFAULT_TIMEZONE, threshold or DEFAULT_WOOHOO_THRESHOLD)
+                 for hub_id, tz, threshold in rows}
+    _settings_loaded_at = time.time()
+    return _settings
+
+
+def get_hub_settings(hub_id, connect=None, db_file=DB_FILE):
+    # Returns (timezone, woohoo_threshold) for the hub
+    if time.time() - _settings_loaded_at > SETTINGS_MAX_AGE_SECONDS:
+        conn = connect() if connect else sqlite3.connect(db_file)
+        try:
+            load_hub_settings(conn)
+        finally:
+            conn.close()
+    return _settings.get(int(hub_id), (DEFAULT_TIMEZONE, DEFAULT_WOOHOO_THRESHOLD))
+
+
+def save_hub_settings(conn, hub_id, timezone, woohoo_threshold):
+    hub_zone(timezone)  # raises ValueError on an unknown zone
+    conn.execute("""
+        INSERT INTO hub_settings (hub_id, timezone, woohoo_threshold) VALUES (?, ?, ?)
+        ON CONFLICT(hub_id) DO UPDATE SET timezone = excluded.timezone, woohoo_threshold = excluded.woohoo_threshold""",
+        (int(hub_id), timezone, int(woohoo_threshold)))
+    load_hub_settings(conn)
+
+
+def hub_zone(timezone):
+    try:
+        return ZoneInfo(timezone or DEFAULT_TIMEZONE)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {timezone}")
+
+
+# --- Period keys ---
+def local_periods(timestamp, timezone):
+    # inventory_log timestamps are naive server-local times
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.astimezone()
+    local_day = timestamp.astimezone(hub_zone(timezone)).date()
+    week_start = local_day - timedelta(days=local_day.weekday())
+    return f"D:{local_day.isoformat()}", f"W:{week_start.isoformat()}"
+
+
+def current_periods(timezone):
+    return local_periods(datetime.now().astimezone(), timezone)
+
+
+# --- Incremental maintenance ---
+def apply_movement(conn, hub_id, sku, action, quantity, timestamp, timezone):
+    # Call on the same connection/transaction as the inventory_log insert
+    if action not in ("IN", "OUT"):
+        return
+    out_units = quantity if action == "OUT" else 0
+    in_units = quantity if action == "IN" else 0
+    for period in local_periods(timestamp, timezone):
+        conn.execute("""
+            INSERT INTO hub_kpis (hub_id, period, out_units, in_units) VALUES (?, ?, ?, ?)
+            ON CONFLICT(hub_id, period) DO UPDATE SET
+            out_units = hub_kpis.out_units + excluded.out_units, in_units = hub_kpis.in_units + excluded.in_units""",
+            (int(hub_id), period, out_units, in_units))
+        if out_units:
+            conn.execute("""
+                INSERT INTO hub_sku_kpis (hub_id, period, sku, out_units) VALUES (?, ?, ?, ?)
+                ON CONFLICT(hub_id, period, sku) DO UPDATE SET out_units = hub_sku_kpis.out_units + excluded.out_units""",
+                (int(hub_id), period, sku, out_units))
+
+
+def rebuild_kpis(conn, hub_id, timezone):
+    # Recount a hub from its log, e.g. after changing its timezone
+    hub_id = int(hub_id)
+    conn.execute("DELETE FROM hub_kpis WHERE hub_id = ?", (hub_id,))
+    conn.execute("DELETE FROM hub_sku_kpis WHERE hub_id = ?", (hub_id,))
+    rows = conn.execute("""
+        SELECT timestamp, sku, action, quantity FROM inventory_log
+        WHERE hub = ? AND action IN ('IN', 'OUT') AND timestamp IS NOT NULL""", (hub_id,)).fetchall()
+    for timestamp, sku, action, quantity in rows:
+        apply_movement(conn, hub_id, sku, action, quantity or 0, timestamp, timezone)
+    return len(rows)
+
+
+# --- Reads ---
+def fetch_kpis(conn, hub_id, timezone):
+    day, week = current_periods(timezone)
+    rows = dict(conn.execute(
+        "SELECT period, out_units FROM hub_kpis WHERE hub_id = ? AND period IN (?, ?)",
+        (int(hub_id), day, week)).fetchall())
+    top = conn.execute(f"""
+        SELECT sku, out_units FROM hub_sku_kpis WHERE hub_id = ? AND period = ?
+        ORDER BY out_units DESC LIMIT {TOP_MOVERS}""", (int(hub_id), week)).fetchall()
+    return {"today_out": rows.get(day, 0), "week_out": rows.get(week, 0), "top_movers": top}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild hub KPI counters from inventory_log.")
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+    from sharding import sharding_enabled, get_shard_connection
+    conn = sqlite3.connect(args.db)
+    for ddl in KPI_SCHEMA + SETTINGS_SCHEMA:
+        conn.execute(ddl)
+    settings = load_hub_settings(conn)
+    for (hub_id,) in conn.execute("SELECT id FROM hubs").fetchall():
+        timezone = settings.get(hub_id, (DEFAULT_TIMEZONE,))[0]
+        # In sharded mode each hub's log and counters live in its shard
+        hub_conn = get_shard_connection(hub_id) if sharding_enabled() else conn
+        count = rebuild_kpis(hub_conn, hub_id, timezone)
+        if hub_conn is not conn:
+            hub_conn.commit()
+            hub_conn.close()
+        print(f"🏬 Hub {hub_id} ({timezone}): {count} movements counted")
+    conn.commit()
+    conn.close()
+    print("✅ KPI counters rebuilt.")
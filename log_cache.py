@@ -0,0 +1,133 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from sku_index import hub_key
+
+ACTION_CODES = {"IN": 0, "OUT": 1, "ADJUST": 2}
+FETCH_BATCH = 50000
+SECONDS_PER_DAY = 86400
+
+
+# --- Process-wide columnar copy of inventory_log for analytics ---
+class LogColumns:
+    # ~21 bytes per log row: int64 epoch seconds, int32 SKU code, int32 hub code,
+    # int32 quantity and int8 action, instead of object-dtype strings per row
+
+    def __init__(self):
+        self.n = 0
+        self.last_id = 0
+        self.ts = np.empty(0, dtype=np.int64)
+        self.sku = np.empty(0, dtype=np.int32)
+        self.hub = np.empty(0, dtype=np.int32)
+        self.qty = np.empty(0, dtype=np.int32)
+        self.action = np.empty(0, dtype=np.int8)
+        self.sku_codes = {}
+        self.sku_values = []
+        self.hub_codes = {}
+        self.hub_values = []
+        self.lock = threading.Lock()
+
+    def _code(self, codes, values, value):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def _reserve(self, extra):
+        needed = self.n + extra
+        if needed <= len(self.ts):
+            return
+        capacity = max(needed, 2 * len(self.ts), 1024)
+        for name in ("ts", "sku", "hub", "qty", "action"):
+            old = getattr(self, name)
+            grown = np.empty(capacity, dtype=old.dtype)
+            grown[:self.n] = old[:self.n]
+            setattr(self, name, grown)
+
+    def refresh(self, conn):
+        # Appends rows past the last seen id; returns how many were added. Exact only where ids
+        # commit in id order (SQLite's single writer); on PostgreSQL aggregate in SQL instead.
+        with self.lock:
+            added = 0
+            while True:
+                c = conn.cursor()
+                c.execute(f"""
+                    SELECT id, timestamp, sku, action, quantity, hub FROM inventory_log
+                    WHERE id > ? ORDER BY id LIMIT {FETCH_BATCH}""", (self.last_id,))
+                rows = c.fetchall()
+                if not rows:
+                    return added
+                self._append(rows)
+                added += len(rows)
+
+    def _append(self, rows):
+        ids, timestamps, skus, actions, quantities, hubs = zip(*rows)
+        count = len(rows)
+        self._reserve(count)
+        end = self.n + count
+        # Naive wall-clock seconds, so day buckets match date(timestamp) in SQL
+        epoch = pd.to_datetime(pd.Series(timestamps), format="mixed", errors="coerce")
+        seconds = (epoch - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+        self.ts[self.n:end] = seconds.fillna(0).astype("int64").to_numpy()
+        self.sku[self.n:end] = [self._code(self.sku_codes, self.sku_values, s) for s in skus]
+        self.hub[self.n:end] = [self._code(self.hub_codes, self.hub_values, hub_key(h)) for h in hubs]
+        self.qty[self.n:end] = [q or 0 for q in quantities]
+        self.action[self.n:end] = [ACTION_CODES.get(a, -1) for a in actions]
+        self.n = end
+        self.last_id = ids[-1]
+
+    def _view(self):
+        with self.lock:
+            n = self.n
+            return self.ts[:n], self.sku[:n], self.hub[:n], self.qty[:n], self.action[:n], len(self.sku_values)
+
+    # --- Analytics ---
+    def out_history(self, hub_id):
+        # Daily OUT units per SKU for one hub: columns sku, date, total_out
+        ts, sku, hub, qty, action, _ = self._view()
+        hub_code = self.hub_codes.get(hub_key(hub_id))
+        if hub_code is None:
+            return pd.DataFrame(columns=["sku", "date", "total_out"])
+        mask = hub == hub_code
+        days = ts[mask] // SECONDS_PER_DAY
+        skus = sku[mask].astype(np.int64)
+        out_qty = np.where(action[mask] == ACTION_CODES["OUT"], qty[mask], 0)
+        keys, inverse = np.unique(skus * 1_000_000 + days, return_inverse=True)
+        totals = np.bincount(inverse, weights=out_qty, minlength=len(keys)).astype(np.int64)
+        df = pd.DataFrame({
+            "sku": np.asarray(self.sku_values, dtype=object)[keys // 1_000_000],
+            "date": pd.to_datetime(keys % 1_000_000, unit="D").strftime("%Y-%m-%d"),
+            "total_out": totals,
+        })
+        return df.sort_values(["date", "sku"]).reset_index(drop=True)
+
+    def balances(self):
+        # Net balance per (hub, SKU) that has any log rows: columns hub_id, sku, Inventory
+        ts, sku, hub, qty, action, width = self._view()
+        valid = action >= 0
+        signed = np.where(action == ACTION_CODES["OUT"], -qty, qty)[valid].astype(np.int64)
+        keys, inverse = np.unique(hub[valid].astype(np.int64) * width + sku[valid], return_inverse=True)
+        totals = np.bincount(inverse, weights=signed, minlength=len(keys)).astype(np.int64)
+        width = max(width, 1)
+        return pd.DataFrame({
+            "hub_id": np.asarray(self.hub_values, dtype=object)[keys // width],
+            "sku": np.asarray(self.sku_values, dtype=object)[keys % width],
+            "Inventory": totals,
+        })
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_log_cache(conn):
+    # Loads once per process, then appends new rows on each call
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LogColumns()
+    _cache.refresh(conn)
+    return _cache
@@ -1,6 +1,34 @@
 import sqlite3
 import os
+import argparse
 from datetime import datetime
+from sku_index import get_sku_index
+from sharding import sharding_enabled
+from hub_kpis import get_hub_settings
+from offline_queue import enqueue_transaction, read_queue, sync_queue, QUEUE_FILE
+from permissions import LOG_INVENTORY, resolve_permissions
+from stock_control import InsufficientStock
+from storage import SQLiteBackend, prepare_database
+from postings import post_movement, post_bundle
+
+parser = argparse.ArgumentParser(description="Log inventory IN/OUT actions.")
+parser.add_argument("--offline", action="store_true", help="record scans to the local queue instead of the database")
+parser.add_argument("--sync", action="store_true", help="upload queued offline transactions and exit")
+parser.add_argument("--queue", default=QUEUE_FILE, help="offline queue file")
+args = parser.parse_args()
+
+# Upload offline queue
+if args.sync:
+    if not os.path.exists("barcodes.db"):
+        print("❌ Database not reachable. Try again when back online.")
+        exit()
+    pending = len(read_queue(args.queue))
+    posted, duplicates, rejected = sync_queue(queue_file=args.queue)
+    print(f"✅ Synced {posted} of {pending} queued transactions ({duplicates} already posted).")
+    if rejected:
+        reasons = sorted({entry["rejected"] for entry in rejected})
+        print(f"⚠️ {len(rejected)} transactions rejected ({'; '.join(reasons)}); left in {args.queue}.")
+    exit()
 
 # Load session
 session_file = "session.txt"
@@ -16,46 +44,116 @@ user_id = int(session.get("user_id"))
 username = session.get("username")
 role = session.get("role")
 hub_id = session.get("hub_id")
+hub_id = int(hub_id) if hub_id and hub_id.isdigit() else None
 
-conn = sqlite3.connect("barcodes.db")
-cursor = conn.cursor()
+# Hubs this user may log for (None = any hub); offline, managers keep their home hub only
+user = {"id": user_id, "role": role, "hub_id": hub_id}
+if os.path.exists("barcodes.db"):
+    perm_conn = sqlite3.connect("barcodes.db")
+    try:
+        permissions = resolve_permissions(perm_conn, user)
+    except sqlite3.OperationalError:
+        permissions = resolve_permissions(None, user)  # no user_hubs table yet
+    perm_conn.close()
+else:
+    permissions = resolve_permissions(None, user)
+allowed_hubs = permissions.hubs(LOG_INVENTORY)
+if allowed_hubs == []:
+    print(f"❌ {role} accounts cannot log inventory.")
+    exit()
 
-# Fetch hub name
-cursor.execute("SELECT name FROM hubs WHERE id = ?", (hub_id,))
-hub_name_result = cursor.fetchone()
-hub_name = hub_name_result[0] if hub_name_result else "Unknown Hub"
+def choose_hub():
+    if allowed_hubs is not None and len(allowed_hubs) == 1:
+        return allowed_hubs[0]
+    try:
+        chosen = int(input("\n🏷️ Enter Hub ID: ").strip())
+    except ValueError:
+        print("❌ Invalid hub ID.")
+        exit()
+    if not permissions.allows(LOG_INVENTORY, chosen):
+        print(f"❌ You are not allowed to log inventory for hub {chosen}.")
+        exit()
+    return chosen
+
+# Offline mode: record many scans to the local queue, sync later with --sync
+if args.offline:
+    hub_id = choose_hub()
+    # Validate against the catalog when a local copy is available; sync re-checks either way
+    index = get_sku_index() if os.path.exists("barcodes.db") else None
+    action = input("⬆️⬇️ Action for this batch (IN or OUT): ").strip().upper()
+    if action not in ["IN", "OUT"]:
+        print("❌ Invalid action. Must be 'IN' or 'OUT'.")
+        exit()
+    print("📴 Offline mode. Scan barcode or SKU, optionally followed by a quantity. Blank line to finish.")
+    queued = 0
+    while True:
+        line = input("🔢 ").strip()
+        if not line:
+            break
+        parts = line.split()
+        code = parts[0]
+        try:
+            qty = int(parts[1]) if len(parts) > 1 else 1
+            if qty <= 0:
+                raise ValueError
+        except ValueError:
+            print("❌ Quantity must be a positive whole number.")
+            continue
+        sku = code.upper()
+        if index:
+            sku = index.resolve(code)
+            if not sku:
+                print(f"❌ '{code}' does not match any product.")
+                continue
+            if not index.is_allowed(hub_id, sku):
+                print(f"❌ SKU '{sku}' is not assigned to hub {hub_id}.")
+                continue
+        enqueue_transaction(user_id, sku, action, qty, hub_id, queue_file=args.queue)
+        queued += 1
+    print(f"✅ {queued} transactions queued in {args.queue}. Run with --sync when back online.")
+    exit()
+
+db = SQLiteBackend("barcodes.db")
+conn = db.connect()
+cursor = conn.cursor()
 
 print(f"\n🏬 You are logged in as: {username} ({role})")
-if role == "user":
-    print(f"🔒 You are restricted to your hub: {hub_name} (ID: {hub_id})")
+if allowed_hubs is not None and len(allowed_hubs) == 1:
+    hub_id = allowed_hubs[0]
 else:
-    # Admin can choose hub
+    # Admins and multi-hub managers choose among the hubs they are granted
     cursor.execute("SELECT id, name FROM hubs")
-    hubs = cursor.fetchall()
+    hubs = [hub for hub in cursor.fetchall() if permissions.allows(LOG_INVENTORY, hub[0])]
     print("\n🏬 Available Hubs:")
     for hub in hubs:
         print(f"{hub[0]}: {hub[1]}")
-    try:
-        hub_id = int(input("\n🏷️ Enter Hub ID: ").strip())
-    except ValueError:
-        print("❌ Invalid hub ID.")
-        conn.close()
-        exit()
-    # Update hub name after input
-    cursor.execute("SELECT name FROM hubs WHERE id = ?", (hub_id,))
-    hub_name_result = cursor.fetchone()
-    hub_name = hub_name_result[0] if hub_name_result else "Unknown Hub"
+    hub_id = choose_hub()
 
-# SKU input
-sku = input("\n🔢 Enter SKU: ").strip().upper()
+# Fetch hub name
+cursor.execute("SELECT name FROM hubs WHERE id = ?", (hub_id,))
+hub_name_result = cursor.fetchone()
+hub_name = hub_name_result[0] if hub_name_result else "Unknown Hub"
+if allowed_hubs is not None and len(allowed_hubs) == 1:
+    print(f"🔒 You are restricted to your hub: {hub_name} (ID: {hub_id})")
+
+# SKU input (scanned barcode or typed SKU)
+index = get_sku_index()
+code = input("\n🔢 Scan barcode or enter SKU: ").strip()
+sku = index.resolve(code)
+if not sku:
+    print(f"❌ '{code}' does not match any product.")
+    conn.close()
+    exit()
 
 # Enforce SKU assignment
-cursor.execute("SELECT 1 FROM hub_skus WHERE hub_id = ? AND sku = ?", (hub_id, sku))
-if not cursor.fetchone():
+if not index.is_allowed(hub_id, sku):
     print(f"❌ SKU '{sku}' is not assigned to your hub ({hub_name}).")
     conn.close()
     exit()
 
+if index.is_bundle(sku):
+    print("📦 Pack of " + ", ".join(f"{n} x {unit}" for unit, n in index.expand(sku, 1)) + ". Quantity is in packs.")
+
 # IN/OUT Action
 action = input("⬆️⬇️ Action (IN or OUT): ").strip().upper()
 if action not in ["IN", "OUT"]:
@@ -66,18 +164,32 @@ if action not in ["IN", "OUT"]:
 # Quantity
 try:
     qty = int(input("🔁 Quantity: ").strip())
+    if qty <= 0:
+        raise ValueError
 except ValueError:
-    print("❌ Quantity must be a number.")
+    print("❌ Quantity must be a positive whole number.")
     conn.close()
     exit()
 
-# Log inventory
+# Log inventory (a pack posts one line per unit, all in one transaction)
 timestamp = datetime.now()
-cursor.execute(
-    "INSERT INTO inventory_log (timestamp, sku, action, quantity, hub, user_id) VALUES (?, ?, ?, ?, ?, ?)",
-    (timestamp, sku, action, qty, hub_id, user_id)
-)
-conn.commit()
+timezone = get_hub_settings(hub_id)[0]
+sharded = sharding_enabled()
+prepare_database(db, sharded)
+try:
+    if not sharded:
+        db.begin_write(conn)  # sharded postings lock only the hub's shard
+    if index.is_bundle(sku):
+        post_bundle(db, conn, user_id, sku, action, qty, index.expand(sku, qty), hub_id, None, timestamp, timezone,
+                    sharded=sharded)
+    else:
+        post_movement(db, conn, user_id, sku, action, qty, hub_id, None, timestamp, timezone, sharded=sharded)
+    conn.commit()
+except InsufficientStock as e:
+    print(f"❌ {e}.")
+    conn.rollback()
+    conn.close()
+    exit()
 print(f"✅ Inventory action logged for {sku} by {username} at {hub_name}.")
 
 conn.close()
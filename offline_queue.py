@@ -0,0 +1,152 @@
+import json
+import os
+import uuid
+from datetime import datetime
+
+from sku_index import SkuIndex
+from sharding import sharding_enabled
+from hub_kpis import get_hub_settings
+from bundles import bundle_comment, record_bundle_movement
+from postings import post_movement, post_synced_to_shard
+from storage import SQLiteBackend, prepare_database
+
+DB_FILE = "barcodes.db"
+QUEUE_FILE = "offline_queue.jsonl"
+SYNC_BATCH_SIZE = 200
+
+
+# --- Local append-only queue ---
+def valid_quantity(quantity):
+    return isinstance(quantity, int) and not isinstance(quantity, bool) and quantity > 0
+
+
+def enqueue_transaction(user_id, sku, action, quantity, hub_id, comment=None, queue_file=QUEUE_FILE):
+    if not valid_quantity(quantity):
+        raise ValueError("Quantity must be a positive whole number")
+    entry = {
+        "key": uuid.uuid4().hex,  # idempotency key, checked again on every sync
+        "timestamp": datetime.now().isoformat(sep=" "),
+        "sku": sku,
+        "action": action,
+        "quantity": quantity,
+        "hub": hub_id,
+        "user_id": user_id,
+        "comment": comment,
+    }
+    with open(queue_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return entry
+
+
+def read_queue(queue_file=QUEUE_FILE):
+    if not os.path.exists(queue_file):
+        return []
+    entries = []
+    with open(queue_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A torn last line from a crash mid-write; everything before it is intact
+                continue
+    return entries
+
+
+def _rewrite_queue(entries, queue_file):
+    tmp_file = queue_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, queue_file)
+
+
+def expand_bundle_entries(entries, index):
+    # A queued pack scan becomes one entry per unit with keys derived from its own,
+    # so a replay after a partial sync skips exactly the lines already posted
+    expanded = []
+    for entry in entries:
+        if "bundle" in entry or not index.is_bundle(entry.get("sku")) or not valid_quantity(entry.get("quantity")):
+            expanded.append(entry)
+            continue
+        pack = {"key": entry["key"], "sku": entry["sku"], "packs": entry["quantity"]}
+        for i, (unit, units) in enumerate(index.expand(entry["sku"], entry["quantity"])):
+            expanded.append(dict(entry, key=f"{entry['key']}:{i}", sku=unit, quantity=units, bundle=pack))
+    return expanded
+
+
+# --- Batch sync ---
+def rejection(entry, index):
+    # Why a queued entry can't be posted, or None
+    if entry.get("action") not in ("IN", "OUT"):
+        return "invalid action"
+    if not valid_quantity(entry.get("quantity")):
+        return "quantity must be a positive whole number"
+    if not index.is_allowed(entry.get("hub"), entry.get("sku")):
+        return "unknown SKU or not assigned to hub"
+    return None
+
+
+def sync_queue(db_file=DB_FILE, queue_file=QUEUE_FILE, batch_size=SYNC_BATCH_SIZE):
+    # Returns (posted, duplicates, rejected); rejected entries stay in the queue file with the
+    # reason in their "rejected" field and are checked again on the next sync
+    entries = read_queue(queue_file)
+    if not entries:
+        return 0, 0, []
+    db = SQLiteBackend(db_file)
+    sharded = sharding_enabled()
+    prepare_database(db, sharded)
+    conn = db.connect()
+    try:
+        index = SkuIndex().load(conn)
+        entries = expand_bundle_entries(entries, index)
+        posted = duplicates = 0
+        rejected = []
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start:start + batch_size]
+            by_hub = {}
+            with conn:
+                if not sharded:
+                    db.begin_write(conn)
+                for entry in batch:
+                    reason = rejection(entry, index)
+                    if reason:
+                        rejected.append(dict(entry, rejected=reason))
+                        continue
+                    comment = entry.get("comment")
+                    if "bundle" in entry:
+                        pack = entry["bundle"]
+                        movement_id = record_bundle_movement(db, conn, entry["hub"], pack["sku"], entry["action"],
+                                                             pack["packs"], entry["user_id"], comment,
+                                                             entry["timestamp"], key=pack["key"])
+                        comment = bundle_comment(movement_id, comment)
+                    if sharded:
+                        by_hub.setdefault(entry["hub"], []).append(dict(entry, comment=comment))
+                        continue
+                    # Offline scans already happened on the floor, so they are recorded even past zero.
+                    # The key check and the log write share one transaction.
+                    timezone = get_hub_settings(entry["hub"], db_file=db_file)[0]
+                    log_id = post_movement(db, conn, entry["user_id"], entry["sku"], entry["action"], entry["quantity"],
+                                           entry["hub"], comment, entry["timestamp"], timezone, enforce=False,
+                                           key=entry["key"])
+                    if log_id is None:
+                        duplicates += 1
+                    else:
+                        posted += 1
+            # Sharded: the pack records above are committed; each hub's entries then go to its shard
+            # as one batch. A failure here leaves them queued and the replay finds the packs by key.
+            for hub_id, hub_entries in by_hub.items():
+                log_ids = post_synced_to_shard(hub_id, hub_entries, get_hub_settings(hub_id, db_file=db_file)[0])
+                duplicates += log_ids.count(None)
+                posted += len(log_ids) - log_ids.count(None)
+            # Committed batches can be dropped; a crash before this point is safe to replay
+            _rewrite_queue(rejected + entries[start + batch_size:], queue_file)
+    finally:
+        conn.close()
+    return posted, duplicates, rejected
@@ -0,0 +1,97 @@
+ALL_HUBS = "*"
+
+# --- Actions ---
+VIEW_INVENTORY = "view_inventory"
+LOG_INVENTORY = "log_inventory"
+CYCLE_COUNT = "cycle_count"
+SUPPLY_NOTES = "supply_notes"
+VIEW_SHRINKAGE = "view_shrinkage"
+REPLY_REQUESTS = "reply_requests"
+SEND_MESSAGES = "send_messages"
+MANAGE_SKUS = "manage_skus"
+MANAGE_USERS = "manage_users"
+HUB_SETTINGS = "hub_settings"
+SUPPLIER_PORTAL = "supplier_portal"
+VIEW_AUDIT = "view_audit"
+VIEW_REPORTS = "view_reports"
+READ_NOTIFICATIONS = "read_notifications"  # own notifications; every signed-in user
+
+HUB_ACTIONS = (VIEW_INVENTORY, LOG_INVENTORY, CYCLE_COUNT, SUPPLY_NOTES)
+ADMIN_ACTIONS = HUB_ACTIONS + (VIEW_SHRINKAGE, REPLY_REQUESTS, SEND_MESSAGES, MANAGE_SKUS, MANAGE_USERS, HUB_SETTINGS, VIEW_AUDIT, VIEW_REPORTS)
+
+USER_HUBS_SCHEMA = [
+    # Extra hubs a manager oversees, on top of users.hub_id
+    """CREATE TABLE IF NOT EXISTS user_hubs (
+        user_id INTEGER, hub_id INTEGER, PRIMARY KEY (user_id, hub_id)
+    )""",
+]
+
+
+class PermissionDenied(Exception):
+    pass
+
+
+def _hub(hub_id):
+    return ALL_HUBS if hub_id == ALL_HUBS else int(hub_id)
+
+
+class Permissions:
+    # A session's (action, hub) grants; ALL_HUBS in the hub slot covers every hub
+
+    def __init__(self, user_id, role, grants):
+        self.user_id = user_id
+        self.role = role
+        self.grants = frozenset(grants)
+        self.by_action = {}
+        for action, hub in self.grants:
+            self.by_action.setdefault(action, set()).add(hub)
+
+    def allows(self, action, hub_id=ALL_HUBS):
+        if (action, ALL_HUBS) in self.grants:
+            return True
+        return hub_id != ALL_HUBS and hub_id is not None and (action, _hub(hub_id)) in self.grants
+
+    def require(self, action, hub_id=ALL_HUBS):
+        if not self.allows(action, hub_id):
+            where = "any hub" if hub_id == ALL_HUBS else f"hub {hub_id}"
+            raise PermissionDenied(f"{self.role} may not {action.replace('_', ' ')} for {where}")
+
+    def hubs(self, action):
+        # Hub ids the action is granted for; None means every hub
+        hubs = self.by_action.get(action, set())
+        return None if ALL_HUBS in hubs else sorted(hubs)
+
+
+def managed_hubs(conn, user_id, home_hub):
+    hubs = {int(home_hub)} if home_hub is not None else set()
+    if conn is not None:
+        c = conn.cursor()
+        c.execute("SELECT hub_id FROM user_hubs WHERE user_id=?", (user_id,))
+        hubs.update(int(hub_id) for (hub_id,) in c.fetchall())
+    return hubs
+
+
+def resolve_permissions(conn, user):
+    # One lookup at login; every later check is a set membership test.
+    # conn may be None (e.g. offline), in which case managers keep their home hub only.
+    role, home_hub = user["role"], user.get("hub_id")
+    if role == "admin":
+        grants = [(action, ALL_HUBS) for action in ADMIN_ACTIONS]
+    elif role == "supplier":
+        # Suppliers see only their own requests and shipments, matched on their username
+        grants = [(SUPPLIER_PORTAL, ALL_HUBS)]
+    elif role == "manager":
+        grants = [(action, hub) for hub in managed_hubs(conn, user["id"], home_hub) for action in HUB_ACTIONS]
+    elif home_hub is not None:
+        grants = [(action, int(home_hub)) for action in HUB_ACTIONS]
+    else:
+        grants = []
+    grants.append((READ_NOTIFICATIONS, ALL_HUBS))
+    return Permissions(user["id"], role, grants)
+
+
+def set_managed_hubs(conn, user_id, hub_ids):
+    # Caller commits
+    conn.execute("DELETE FROM user_hubs WHERE user_id=?", (user_id,))
+    conn.executemany("INSERT INTO user_hubs (user_id, hub_id) VALUES (?, ?)",
+                     [(user_id, int(hub_id)) for hub_id in hub_ids])
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+from audit import audit_inventory
+from bundles import bundle_comment, record_bundle_movement
+from hub_kpis import apply_movement
+from sharding import log_to_shard, log_batch_to_shard
+from stock_control import apply_stock, enforcement_enabled
+
+# The posting sequence every writer (app, CLI, offline sync) runs for inventory movements:
+# balance check/update, inventory_log insert, KPI counters, audit record. All of it goes on
+# the caller's write transaction (start it with db.begin_write; caller commits). In sharded
+# mode all of it commits in the hub's shard, audit chain included, and conn is not written,
+# so callers don't take the main database's write lock.
+# enforce=None follows TTT_ENFORCE_STOCK; a refused OUT raises InsufficientStock before any write.
+
+# Idempotency keys of posted offline transactions (also kept per shard in sharded mode)
+SYNC_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS synced_transactions (
+        key TEXT PRIMARY KEY, log_id INTEGER, synced {ts}
+    )""",
+]
+
+INSERT_LOG = """
+    INSERT INTO inventory_log (timestamp, sku, action, quantity, hub, user_id, comment)
+    VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+
+def post_movement(db, conn, user_id, sku, action, quantity, hub_id, comment, timestamp, timezone,
+                  enforce=None, key=None, sharded=False):
+    # One movement; returns its log id, or None if key was already posted
+    enforce = enforcement_enabled() if enforce is None else enforce
+    if sharded:
+        return log_to_shard(user_id, sku, action, quantity, hub_id, comment, timestamp, key, timezone, enforce)
+    if key is not None:
+        c = conn.cursor()
+        c.execute(db.insert_ignore("synced_transactions", ["key", "synced"]), (key, datetime.now()))
+        if c.rowcount == 0:
+            return None
+    apply_stock(conn, hub_id, sku, action, quantity, enforce)
+    log_id = db.insert_id(conn.cursor(), INSERT_LOG, (timestamp, sku, action, quantity, hub_id, user_id, comment))
+    apply_movement(conn, hub_id, sku, action, quantity, timestamp, timezone)
+    if key is not None:
+        conn.execute("UPDATE synced_transactions SET log_id=? WHERE key=?", (log_id, key))
+    audit_inventory(conn, user_id, log_id, timestamp, sku, action, quantity, hub_id, comment)
+    return log_id
+
+
+def post_lines(db, conn, user_id, lines, action, hub_id, comment, timestamp, timezone, enforce=None, sharded=False,
+               shard=None):
+    # Several (sku, quantity) movements sharing one unique comment, in one batched insert;
+    # returns their log ids in line order. shard: an open sharding.begin_shard_write connection
+    # to post on instead of a transaction of its own (the caller commits it).
+    enforce = enforcement_enabled() if enforce is None else enforce
+    if sharded:
+        return log_batch_to_shard(hub_id, [(user_id, sku, action, quantity, comment) for sku, quantity in lines],
+                                  timestamp, timezone=timezone, enforce=enforce, conn=shard)
+    for sku, quantity in lines:
+        apply_stock(conn, hub_id, sku, action, quantity, enforce)
+    c = conn.cursor()
+    c.execute("SELECT MAX(id) FROM inventory_log")
+    before = c.fetchone()[0] or 0
+    c.executemany(INSERT_LOG, [(timestamp, sku, action, quantity, hub_id, user_id, comment) for sku, quantity in lines])
+    c.execute("SELECT id FROM inventory_log WHERE id > ? AND comment = ? ORDER BY id", (before, comment))
+    log_ids = [log_id for (log_id,) in c.fetchall()]
+    for sku, quantity in lines:
+        apply_movement(conn, hub_id, sku, action, quantity, timestamp, timezone)
+    for log_id, (sku, quantity) in zip(log_ids, lines):
+        audit_inventory(conn, user_id, log_id, timestamp, sku, action, quantity, hub_id, comment)
+    return log_ids
+
+
+def post_synced_to_shard(hub_id, entries, timezone):
+    # Sharded offline sync: one hub's queued entries (dicts with key, timestamp, user_id, sku, action,
+    # quantity, comment) in one shard transaction, recorded even past zero. Returns their log ids,
+    # None for keys already posted.
+    return log_batch_to_shard(hub_id, [(e["user_id"], e["sku"], e["action"], e["quantity"], e["comment"]) for e in entries],
+                              timezone=timezone, keys=[e["key"] for e in entries],
+                              timestamps=[e["timestamp"] for e in entries])
+
+
+def post_bundle(db, conn, user_id, sku, action, packs, lines, hub_id, comment, timestamp, timezone,
+                enforce=None, sharded=False):
+    # A pack: its pack-level record plus its component lines (SkuIndex.expand); returns the movement id.
+    # The pack record is a main-database write even in sharded mode; it commits with conn after the lines.
+    movement_id = record_bundle_movement(db, conn, hub_id, sku, action, packs, user_id, comment or None, timestamp)
+    post_lines(db, conn, user_id, lines, action, hub_id, bundle_comment(movement_id, comment), timestamp, timezone,
+               enforce, sharded)
+    return movement_id
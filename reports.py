@@ -0,0 +1,275 @@
+import argparse
+import glob
+import hashlib
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from storage import get_backend
+from bundles import expand_components, fetch_components
+from sharding import sharding_enabled, get_shard_connection
+
+DB_FILE = "barcodes.db"
+REPORT_DIR = "reports"
+WORKER_INTERVAL_SECONDS = 900
+COMPANY = "all"
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+# --- Periods (ISO weeks, server-local like inventory_log timestamps) ---
+def period_key(day):
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def period_bounds(period):
+    monday = datetime.strptime(period + "-1", "%G-W%V-%u")
+    return monday, monday + timedelta(days=7)
+
+
+def recent_periods(count, today=None):
+    today = today or date.today()
+    return [period_key(today - timedelta(weeks=i)) for i in range(count)]
+
+
+# --- Data ---
+def _log_connection(db, hub_id):
+    if db.name == "sqlite" and sharding_enabled():
+        return get_shard_connection(hub_id)
+    return db.connect()
+
+
+def list_hubs(db):
+    conn = db.connect()
+    try:
+        c = conn.cursor()
+        c.execute("SELECT id, name FROM hubs ORDER BY id")
+        return c.fetchall()
+    finally:
+        conn.close()
+
+
+def hub_high_water(db, hub_id, end):
+    # Newest log id that counts toward the period; uses idx_inventory_log_hub_timestamp
+    conn = _log_connection(db, hub_id)
+    try:
+        c = conn.cursor()
+        c.execute("SELECT MAX(id) FROM inventory_log WHERE hub = ? AND timestamp < ?", (hub_id, end))
+        return c.fetchone()[0] or 0
+    finally:
+        conn.close()
+
+
+def high_water(db, scope, period):
+    # Artifact version: changes only when log rows up to the period's end are added
+    _, end = period_bounds(period)
+    if scope != COMPANY:
+        return str(hub_high_water(db, scope, end))
+    marks = ",".join(f"{hub_id}:{hub_high_water(db, hub_id, end)}" for hub_id, _ in list_hubs(db))
+    return hashlib.sha1(marks.encode()).hexdigest()[:12]
+
+
+def hub_activity(db, hub_id, hub_name, period):
+    # One row per SKU: stock at the period's end, OUT for the week and per weekday
+    start, end = period_bounds(period)
+    conn = _log_connection(db, hub_id)
+    try:
+        stock = pd.read_sql_query("""
+            SELECT sku AS SKU, SUM(CASE WHEN action = 'OUT' THEN -quantity ELSE quantity END) AS Stock
+            FROM inventory_log WHERE hub = ? AND timestamp < ? GROUP BY sku""", conn, params=(hub_id, end))
+        out = pd.read_sql_query("""
+            SELECT sku AS SKU, timestamp, quantity FROM inventory_log
+            WHERE hub = ? AND action = 'OUT' AND timestamp >= ? AND timestamp < ?""", conn, params=(hub_id, start, end))
+    finally:
+        conn.close()
+    out["day"] = pd.to_datetime(out["timestamp"], format="mixed").dt.weekday.map(dict(enumerate(WEEKDAYS)))
+    daily = out.pivot_table(index="SKU", columns="day", values="quantity", aggfunc="sum", fill_value=0)
+    daily = daily.reindex(columns=WEEKDAYS, fill_value=0)
+    daily.columns = list(WEEKDAYS)
+    daily.insert(0, "Week OUT", daily.sum(axis=1))
+    df = stock.merge(daily.reset_index(), on="SKU", how="outer").fillna(0)
+    df.insert(0, "Hub", hub_name)
+    return df
+
+
+def open_requests(db, hub_id=None):
+    conn = db.connect()
+    where = "AND hub_id = ? " if hub_id is not None else ""
+    try:
+        return pd.read_sql_query(f"""
+            SELECT id, hub_id, username, timestamp, notes, supplier, sku, requested_qty, confirmed_qty
+            FROM supply_requests WHERE fulfilled_at IS NULL AND (response IS NULL OR supplier IS NOT NULL)
+            {where}ORDER BY timestamp""", conn, params=(hub_id,) if hub_id is not None else ())
+    finally:
+        conn.close()
+
+
+def pack_activity(db, hub_ids, names, period):
+    # Pack-level roll-up of the same movements: packs scanned per hub, pack and action,
+    # with the units they stood for
+    start, end = period_bounds(period)
+    marks = ", ".join("?" for _ in hub_ids)
+    conn = db.connect()
+    try:
+        packs = pd.read_sql_query(f"""
+            SELECT hub_id, sku AS Pack, action AS Action, SUM(packs) AS Packs FROM bundle_movements
+            WHERE hub_id IN ({marks}) AND timestamp >= ? AND timestamp < ?
+            GROUP BY hub_id, sku, action""", conn, params=[*hub_ids, start, end])
+        expansions = expand_components(fetch_components(conn))
+    finally:
+        conn.close()
+    packs.insert(0, "Hub", packs.pop("hub_id").map(names))
+    per_pack = {parent: sum(qty for _, qty in parts) for parent, parts in expansions.items()}
+    packs["Units"] = packs["Pack"].map(per_pack).fillna(0).astype(int) * packs["Packs"]
+    return packs.sort_values(["Hub", "Pack", "Action"])
+
+
+def build_report(db, scope, period):
+    hubs = list_hubs(db)
+    names = dict(hubs)
+    chosen = hubs if scope == COMPANY else [(int(scope), names.get(int(scope), f"Hub {scope}"))]
+    frames = [hub_activity(db, hub_id, name, period) for hub_id, name in chosen]
+    activity = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    conn = db.connect()
+    try:
+        products = pd.read_sql_query("SELECT sku AS SKU, name AS Product FROM products", conn)
+    finally:
+        conn.close()
+    if not activity.empty:
+        activity = activity.merge(products, on="SKU", how="left")
+        columns = ["Hub", "SKU", "Product", "Stock", "Week OUT"] + WEEKDAYS
+        activity = activity[columns].sort_values(["Hub", "Week OUT"], ascending=[True, False])
+        activity[columns[3:]] = activity[columns[3:]].astype(int)
+    packs = pack_activity(db, [hub_id for hub_id, _ in chosen], names, period)
+    return activity, packs, open_requests(db, None if scope == COMPANY else int(scope))
+
+
+# --- Artifacts: reports/<period>/<scope>_<high water>.{csv,packs.csv,requests.csv,pdf} ---
+def artifact_paths(scope, period, mark, report_dir=REPORT_DIR):
+    base = os.path.join(report_dir, period, f"{scope}_{mark}")
+    return {"csv": base + ".csv", "packs": base + ".packs.csv", "requests": base + ".requests.csv", "pdf": base + ".pdf"}
+
+
+def find_artifacts(scope, period, mark, report_dir=REPORT_DIR):
+    paths = artifact_paths(scope, period, mark, report_dir)
+    # The PDF is written last; checking every file also retires sets from before a format change
+    return paths if all(os.path.exists(path) for path in paths.values()) else None
+
+
+def _write_atomic(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def generate_report(db, scope, period, report_dir=REPORT_DIR, force=False):
+    # Returns (paths, built); reuses the stored artifacts while the high-water mark is unchanged
+    mark = high_water(db, scope, period)
+    existing = find_artifacts(scope, period, mark, report_dir)
+    if existing and not force:
+        return existing, False
+    activity, packs, requests = build_report(db, scope, period)
+    paths = artifact_paths(scope, period, mark, report_dir)
+    os.makedirs(os.path.dirname(paths["csv"]), exist_ok=True)
+    _write_atomic(paths["csv"], activity.to_csv(index=False).encode())
+    _write_atomic(paths["packs"], packs.to_csv(index=False).encode())
+    _write_atomic(paths["requests"], requests.to_csv(index=False).encode())
+    label = "All Hubs" if scope == COMPANY else dict(list_hubs(db)).get(int(scope), f"Hub {scope}")
+    _write_atomic(paths["pdf"], render_pdf(f"TTT Weekly Report {period} - {label}",
+                                           report_lines(period, activity, packs, requests)))
+    # Older versions of the same report are superseded
+    for stale in glob.glob(os.path.join(report_dir, period, f"{scope}_*")):
+        if not stale.startswith(os.path.join(report_dir, period, f"{scope}_{mark}.")):
+            os.remove(stale)
+    return paths, True
+
+
+def report_lines(period, activity, packs, requests):
+    start, end = period_bounds(period)
+    lines = [f"Week {start:%Y-%m-%d} to {end - timedelta(days=1):%Y-%m-%d}",
+             f"Generated {datetime.now():%Y-%m-%d %H:%M}", ""]
+    if activity.empty:
+        lines.append("No inventory activity.")
+    else:
+        lines += [f"Units OUT this week: {int(activity['Week OUT'].sum())}",
+                  f"SKUs at or below zero: {int((activity['Stock'] <= 0).sum())}", "",
+                  "STOCK LEVELS AND OUT BY DAY", ""]
+        lines += activity.to_string(index=False).splitlines()
+    if not packs.empty:
+        lines += ["", "PACKS AND BUNDLES (units above include these)", ""]
+        lines += packs.to_string(index=False).splitlines()
+    lines += ["", f"OPEN SUPPLY REQUESTS ({len(requests)})", ""]
+    if not requests.empty:
+        lines += requests[["id", "hub_id", "timestamp", "supplier", "sku", "requested_qty", "notes"]].to_string(index=False).splitlines()
+    return lines
+
+
+# --- Minimal text PDF (Courier, landscape letter), so reports need no extra packages ---
+PDF_LINES_PER_PAGE = 54
+
+
+def _pdf_escape(text):
+    text = text.encode("latin-1", "replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def render_pdf(title, lines):
+    pages = [lines[i:i + PDF_LINES_PER_PAGE] for i in range(0, len(lines), PDF_LINES_PER_PAGE)] or [[]]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>"]
+    page_ids = []
+    for number, page in enumerate(pages, 1):
+        text = [f"BT /F1 12 Tf 36 580 Td ({_pdf_escape(title)}) Tj ET"]
+        text.append("BT /F1 7 Tf 36 560 Td 10 TL")
+        text += [f"({_pdf_escape(line)}) '" for line in page]
+        text.append("ET")
+        text.append(f"BT /F1 7 Tf 700 20 Td (Page {number} of {len(pages)}) Tj ET")
+        stream = "\n".join(text).encode("latin-1")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n".encode("latin-1") + stream + b"\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 792 612] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_ids.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>"
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        body = body if isinstance(body, bytes) else body.encode("latin-1")
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+# --- Worker ---
+def run_once(db, periods=2, report_dir=REPORT_DIR):
+    # The current and previous week, company-wide and per hub; returns how many were rebuilt
+    built = 0
+    scopes = [COMPANY] + [hub_id for hub_id, _ in list_hubs(db)]
+    for period in recent_periods(periods):
+        for scope in scopes:
+            _, rebuilt = generate_report(db, scope, period, report_dir)
+            built += rebuilt
+    return built
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build weekly hub and company reports into the report cache.")
+    parser.add_argument("--interval", type=int, default=WORKER_INTERVAL_SECONDS, help="seconds between runs")
+    parser.add_argument("--periods", type=int, default=2, help="how many recent weeks to keep current")
+    parser.add_argument("--once", action="store_true", help="run one pass and exit")
+    args = parser.parse_args()
+    db = get_backend(DB_FILE)
+    db.create_tables()
+    while True:
+        started = time.time()
+        built = run_once(db, args.periods)
+        print(f"📄 {datetime.now():%Y-%m-%d %H:%M:%S} {built} report(s) rebuilt in {time.time() - started:.1f}s")
+        if args.once:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,207 @@
+import argparse
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+DB_FILE = "barcodes.db"
+ARCHIVE_DIR = "archive"
+CACHE_DIR = os.path.join(ARCHIVE_DIR, ".cache")
+BATCH_SIZE = 1000
+BATCH_PAUSE_SECONDS = 0.05  # let app writers in between batches
+VACUUM_PAGES = 2000  # free pages returned to the OS per run
+
+# table -> (age in days, timestamp column, which rows are finished and may be archived)
+POLICIES = {
+    "notifications": (90, "created", "1 = 1"),
+    "supply_requests": (180, "timestamp", "response IS NOT NULL AND (supplier IS NULL OR fulfilled_at IS NOT NULL)"),
+}
+
+
+# --- Archive files: archive/<table>_<year>.db, gzipped once the year can't receive more rows ---
+def archive_path(table, year, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f"{table}_{year}.db")
+
+
+def _unseal(path):
+    # A sealed year that gets rows again (e.g. a shorter retention age) is reopened
+    if os.path.exists(path + ".gz") and not os.path.exists(path):
+        with gzip.open(path + ".gz", "rb") as src, open(path + ".tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(path + ".tmp", path)
+        os.remove(path + ".gz")
+
+
+def seal(path):
+    # gzip an archive file; SQLite pages of repetitive text compress several-fold
+    with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb", compresslevel=9) as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(path + ".gz.tmp", path + ".gz")
+    os.remove(path)
+
+
+def _archive_table_ddl(conn, table):
+    # Same columns as the hot table, with id kept as the primary key
+    columns = [(name, col_type) for _, name, col_type, _, _, _ in conn.execute(f"PRAGMA main.table_info({table})")]
+    cols = ", ".join(f"{name} {col_type}{' PRIMARY KEY' if name == 'id' else ''}" for name, col_type in columns)
+    return f"CREATE TABLE IF NOT EXISTS arch.{table} ({cols})", [name for name, _ in columns]
+
+
+# --- Moving rows ---
+def archive_table(conn, table, days, batch_size=BATCH_SIZE, archive_dir=ARCHIVE_DIR, now=None):
+    # Moves finished rows older than `days` into the yearly archives, one short transaction per
+    # batch (copy and delete commit together across the attached files). Returns rows moved.
+    _, column, finished = POLICIES[table]
+    cutoff = (now or datetime.now()) - timedelta(days=days)
+    os.makedirs(archive_dir, exist_ok=True)
+    moved = 0
+    while True:
+        row = conn.execute(f"SELECT MIN({column}) FROM {table} WHERE {column} < ? AND {finished}", (cutoff,)).fetchone()
+        if row[0] is None:
+            break
+        year = int(str(row[0])[:4])
+        year_end = min(cutoff, datetime(year + 1, 1, 1))
+        path = archive_path(table, year, archive_dir)
+        _unseal(path)
+        conn.execute("ATTACH DATABASE ? AS arch", (path,))
+        try:
+            ddl, columns = _archive_table_ddl(conn, table)
+            conn.execute(ddl)
+            conn.commit()
+            cols = ", ".join(columns)
+            while True:
+                ids = [row_id for (row_id,) in conn.execute(
+                    f"SELECT id FROM {table} WHERE {column} < ? AND {finished} ORDER BY id LIMIT {int(batch_size)}",
+                    (year_end,))]
+                if not ids:
+                    break
+                marks = ", ".join("?" for _ in ids)
+                conn.execute(f"INSERT OR IGNORE INTO arch.{table} ({cols}) SELECT {cols} FROM main.{table} WHERE id IN ({marks})", ids)
+                conn.execute(f"DELETE FROM main.{table} WHERE id IN ({marks})", ids)
+                conn.commit()
+                moved += len(ids)
+                time.sleep(BATCH_PAUSE_SECONDS)
+        finally:
+            conn.execute("DETACH DATABASE arch")
+    return moved
+
+
+def seal_finished_years(table, days, archive_dir=ARCHIVE_DIR, now=None):
+    # A year is complete once the retention cutoff has passed its end
+    cutoff_year = ((now or datetime.now()) - timedelta(days=days)).year
+    sealed = []
+    for path in glob.glob(os.path.join(archive_dir, f"{table}_*.db")):
+        if int(os.path.basename(path)[len(table) + 1:-3]) < cutoff_year:
+            seal(path)
+            sealed.append(path + ".gz")
+    return sealed
+
+
+# --- Space reuse ---
+def enable_incremental_vacuum(conn):
+    # auto_vacuum can only be switched on by a full VACUUM; done once, later runs are incremental
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    conn.commit()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def incremental_vacuum(conn, pages=VACUUM_PAGES):
+    # Returns the free pages released
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+    conn.commit()
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def run_retention(db_file=DB_FILE, days=None, batch_size=BATCH_SIZE, archive_dir=ARCHIVE_DIR, vacuum=True):
+    # days: {table: age} overrides; returns {table: rows moved}
+    days = {table: (days or {}).get(table, policy[0]) for table, policy in POLICIES.items()}
+    conn = sqlite3.connect(db_file, timeout=30)
+    try:
+        moved = {table: archive_table(conn, table, days[table], batch_size, archive_dir) for table in POLICIES}
+        for table in POLICIES:
+            seal_finished_years(table, days[table], archive_dir)
+        if vacuum:
+            enable_incremental_vacuum(conn)
+            incremental_vacuum(conn)
+    finally:
+        conn.close()
+    return moved
+
+
+# --- Searching archives (attached read-only on demand) ---
+def _readable_copy(path, cache_dir=CACHE_DIR):
+    # Sealed archives are unpacked once into the cache and reused until the archive changes
+    if not path.endswith(".gz"):
+        return path
+    cached = os.path.join(cache_dir, os.path.basename(path)[:-3])
+    if not os.path.exists(cached) or os.path.getmtime(cached) < os.path.getmtime(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        with gzip.open(path, "rb") as src, open(cached + ".tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(cached + ".tmp", cached)
+    return cached
+
+
+def archive_files(table, archive_dir=ARCHIVE_DIR):
+    # {year: path}, plain or sealed
+    files = {}
+    for path in glob.glob(os.path.join(archive_dir, f"{table}_*.db*")):
+        name = os.path.basename(path)
+        if name.endswith((".db", ".db.gz")):
+            files[int(name[len(table) + 1:].split(".")[0])] = path
+    return dict(sorted(files.items(), reverse=True))
+
+
+def search_archive(table, where="1 = 1", params=(), columns="*", order=None, limit=500, archive_dir=ARCHIVE_DIR):
+    # Runs one SELECT against each yearly archive, newest first, until `limit` rows are found
+    frames, remaining = [], limit
+    conn = sqlite3.connect(":memory:")
+    try:
+        for year, path in archive_files(table, archive_dir).items():
+            uri = "file:" + os.path.abspath(_readable_copy(path)) + "?mode=ro"
+            conn.execute("ATTACH DATABASE ? AS arch", (uri,))
+            try:
+                frames.append(pd.read_sql_query(
+                    f"SELECT {columns} FROM arch.{table} WHERE {where}"
+                    f"{' ORDER BY ' + order if order else ''} LIMIT {int(remaining)}", conn, params=params))
+            finally:
+                conn.execute("DETACH DATABASE arch")
+            remaining -= len(frames[-1])
+            if remaining <= 0:
+                break
+    finally:
+        conn.close()
+    frames = [frame for frame in frames if not frame.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old notifications and answered supply requests to archive files.")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--days", action="append", default=[], metavar="TABLE=DAYS",
+                        help="retention age override, e.g. --days notifications=30")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    parser.add_argument("--no-vacuum", action="store_true")
+    args = parser.parse_args()
+    overrides = {table: int(age) for table, age in (item.split("=", 1) for item in args.days)}
+    unknown = set(overrides) - set(POLICIES)
+    if unknown:
+        print(f"❌ No retention policy for: {', '.join(sorted(unknown))}")
+        exit(1)
+    started = time.time()
+    size_before = os.path.getsize(args.db)
+    moved = run_retention(args.db, overrides, args.batch, args.archive_dir, vacuum=not args.no_vacuum)
+    for table, count in moved.items():
+        print(f"🗄️ {table}: {count} rows archived")
+    print(f"✅ {args.db}: {size_before / 1024:,.0f} KB -> {os.path.getsize(args.db) / 1024:,.0f} KB "
+          f"in {time.time() - started:.1f}s.")
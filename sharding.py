@@ -0,0 +1,295 @@
+import argparse
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from audit import AUDIT_SCHEMA, SQLITE_TRIGGERS, audit_inventory, verify_audit_chain
+from hub_kpis import create_kpi_tables, apply_movement, rebuild_kpis, DEFAULT_TIMEZONE
+from stock_control import InsufficientStock, check_quantity
+
+DB_FILE = "barcodes.db"
+SHARD_DIR = "shards"
+SHARDED_ENV = "TTT_SHARDED"  # set to 1 to keep each hub's log and balances in its own file
+MAX_WORKERS = 8
+
+_ready = set()
+
+
+def sharding_enabled():
+    return os.environ.get(SHARDED_ENV, "") in ("1", "true", "yes")
+
+
+def shard_path(hub_id, shard_dir=SHARD_DIR):
+    return os.path.join(shard_dir, f"hub_{int(hub_id)}.db")
+
+
+def _create_shard_tables(conn):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS inventory_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME, sku TEXT, action TEXT, quantity INTEGER, hub INTEGER, user_id INTEGER, comment TEXT
+    )""")
+    # Same index as the main log; reports filter shard logs by hub and timestamp
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_inventory_log_hub_timestamp ON inventory_log (hub, timestamp)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS hub_balances (
+        sku TEXT PRIMARY KEY, balance INTEGER NOT NULL DEFAULT 0, updated DATETIME
+    )""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS synced_transactions (
+        key TEXT PRIMARY KEY, log_id INTEGER, synced DATETIME
+    )""")
+    # Each shard keeps its own audit chain over its log, so hubs never queue on one chain lock
+    for stmt in AUDIT_SCHEMA + SQLITE_TRIGGERS:
+        conn.execute(stmt.format(pk="INTEGER PRIMARY KEY AUTOINCREMENT", ts="DATETIME"))
+    create_kpi_tables(conn)
+    conn.commit()
+
+
+def get_shard_connection(hub_id, shard_dir=SHARD_DIR):
+    path = shard_path(hub_id, shard_dir)
+    if path not in _ready:
+        os.makedirs(shard_dir, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    if path not in _ready:
+        _create_shard_tables(conn)
+        _ready.add(path)
+    return conn
+
+
+def list_shard_hubs(shard_dir=SHARD_DIR):
+    if not os.path.isdir(shard_dir):
+        return []
+    hubs = []
+    for name in os.listdir(shard_dir):
+        if name.startswith("hub_") and name.endswith(".db"):
+            hubs.append(int(name[4:-3]))
+    return sorted(hubs)
+
+
+# --- Writes (one hub, one file) ---
+def _signed(action, quantity):
+    # ADJUST quantities are already signed
+    return -quantity if action == "OUT" else quantity
+
+
+def log_to_shard(user_id, sku, action, quantity, hub_id, comment, timestamp=None, key=None, timezone=None,
+                 enforce=False, shard_dir=SHARD_DIR):
+    # key: optional idempotency key (offline sync); returns None if it was already posted
+    # timezone: the hub's timezone, to keep its KPI counters current
+    # enforce: refuse an OUT larger than the SKU's balance (raises InsufficientStock)
+    check_quantity(action, quantity)
+    conn = get_shard_connection(hub_id, shard_dir)
+    try:
+        with conn:
+            timestamp = timestamp or datetime.now()
+            if key is not None:
+                c = conn.execute("INSERT OR IGNORE INTO synced_transactions (key, synced) VALUES (?, ?)",
+                                 (key, datetime.now()))
+                if c.rowcount == 0:
+                    return None
+            if enforce and action == "OUT":
+                # Check and decrement in one statement, under the shard's write lock
+                c = conn.execute("UPDATE hub_balances SET balance = balance - ?, updated = ? WHERE sku = ? AND balance >= ?",
+                                 (quantity, timestamp, sku, quantity))
+                if c.rowcount == 0:
+                    raise InsufficientStock(f"Not enough {sku} in stock at hub {hub_id}")
+            c = conn.execute("""
+                INSERT INTO inventory_log (timestamp, sku, action, quantity, hub, user_id, comment)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (timestamp, sku, action, quantity, int(hub_id), user_id, comment))
+            if not (enforce and action == "OUT"):
+                conn.execute("""
+                    INSERT INTO hub_balances (sku, balance, updated) VALUES (?, ?, ?)
+                    ON CONFLICT(sku) DO UPDATE SET balance = balance + excluded.balance, updated = excluded.updated""",
+                    (sku, _signed(action, quantity), timestamp))
+            log_id = c.lastrowid
+            if timezone is not None:
+                apply_movement(conn, hub_id, sku, action, quantity, timestamp, timezone)
+            if key is not None:
+                conn.execute("UPDATE synced_transactions SET log_id=? WHERE key=?", (log_id, key))
+            audit_inventory(conn, user_id, log_id, timestamp, sku, action, quantity, hub_id, comment)
+            return log_id
+    finally:
+        conn.close()
+
+
+def begin_shard_write(hub_id, shard_dir=SHARD_DIR):
+    # A shard connection holding its write lock, for reads that must not race the hub's
+    # postings (cycle counts); post on it with log_batch_to_shard(conn=...), then commit and close
+    conn = get_shard_connection(hub_id, shard_dir)
+    conn.execute("BEGIN IMMEDIATE")
+    return conn
+
+
+def log_batch_to_shard(hub_id, entries, timestamp=None, timezone=None, enforce=False, shard_dir=SHARD_DIR, conn=None,
+                       keys=None, timestamps=None):
+    # entries: (user_id, sku, action, quantity, comment) rows posted in one transaction;
+    # returns their log ids in entry order. enforce refuses the whole batch if any OUT would oversell.
+    # conn: a connection from begin_shard_write; the rows then join its transaction and the caller commits.
+    # keys: optional idempotency keys, one per entry (offline sync); an entry whose key was already
+    # posted is skipped and gets None. timestamps: per-entry times instead of one.
+    timestamp = timestamp or datetime.now()
+    timestamps = timestamps or [timestamp] * len(entries)
+    if conn is not None:
+        return _post_batch(conn, hub_id, entries, timestamps, timezone, enforce, keys)
+    conn = get_shard_connection(hub_id, shard_dir)
+    try:
+        with conn:
+            if enforce or keys is not None:
+                conn.execute("BEGIN IMMEDIATE")  # hold the write lock from the checks through the inserts
+            return _post_batch(conn, hub_id, entries, timestamps, timezone, enforce, keys)
+    finally:
+        conn.close()
+
+
+def _post_batch(conn, hub_id, entries, timestamps, timezone, enforce, keys):
+    for _, _, action, quantity, _ in entries:
+        check_quantity(action, quantity)
+    known = set()
+    if keys is not None:
+        for key in keys:
+            c = conn.execute("INSERT OR IGNORE INTO synced_transactions (key, synced) VALUES (?, ?)", (key, datetime.now()))
+            if c.rowcount == 0:
+                known.add(key)
+    posting = [(i, *entry) for i, entry in enumerate(entries) if keys is None or keys[i] not in known]
+    if enforce:
+        for _, _, sku, action, quantity, _ in posting:
+            if action == "OUT" and conn.execute(
+                    "SELECT 1 FROM hub_balances WHERE sku = ? AND balance >= ?", (sku, quantity)).fetchone() is None:
+                raise InsufficientStock(f"Not enough {sku} in stock at hub {hub_id}")
+    conn.executemany("""
+        INSERT INTO inventory_log (timestamp, sku, action, quantity, hub, user_id, comment)
+        VALUES (?, ?, ?, ?, ?, ?, ?)""",
+        [(timestamps[i], sku, action, quantity, int(hub_id), user_id, comment)
+         for i, user_id, sku, action, quantity, comment in posting])
+    conn.executemany("""
+        INSERT INTO hub_balances (sku, balance, updated) VALUES (?, ?, ?)
+        ON CONFLICT(sku) DO UPDATE SET balance = balance + excluded.balance, updated = excluded.updated""",
+        [(sku, _signed(action, quantity), timestamps[i]) for i, _, sku, action, quantity, _ in posting])
+    if timezone is not None:
+        for i, _, sku, action, quantity, _ in posting:
+            apply_movement(conn, hub_id, sku, action, quantity, timestamps[i], timezone)
+    # The shard's write lock is held, so the batch got consecutive ids
+    ids = conn.execute("SELECT id FROM inventory_log ORDER BY id DESC LIMIT ?", (len(posting),)).fetchall()
+    log_ids = dict(zip((i for i, *_ in posting), (log_id for (log_id,) in reversed(ids))))
+    for i, user_id, sku, action, quantity, comment in posting:
+        audit_inventory(conn, user_id, log_ids[i], timestamps[i], sku, action, quantity, hub_id, comment)
+    if keys is not None:
+        conn.executemany("UPDATE synced_transactions SET log_id=? WHERE key=?", [(log_ids[i], keys[i]) for i in log_ids])
+    return [log_ids.get(i) for i in range(len(entries))]
+
+
+# --- Reads ---
+def fetch_shard_balances(hub_id, shard_dir=SHARD_DIR):
+    conn = get_shard_connection(hub_id, shard_dir)
+    try:
+        return dict(conn.execute("SELECT sku, balance FROM hub_balances"))
+    finally:
+        conn.close()
+
+
+def fan_out(fn, hub_ids, max_workers=MAX_WORKERS):
+    # Runs fn(hub_id) for every shard in parallel; returns {hub_id: result}
+    hub_ids = list(hub_ids)
+    if not hub_ids:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(hub_ids))) as pool:
+        return dict(zip(hub_ids, pool.map(fn, hub_ids)))
+
+
+def fetch_all_shard_balances(hub_ids=None, shard_dir=SHARD_DIR):
+    # Returns merged (hub_id, sku, balance) rows across all shards
+    hub_ids = list_shard_hubs(shard_dir) if hub_ids is None else hub_ids
+    results = fan_out(lambda hub_id: fetch_shard_balances(hub_id, shard_dir), hub_ids)
+    return [(hub_id, sku, balance) for hub_id, balances in results.items() for sku, balance in balances.items()]
+
+
+# --- Audit (one chain per shard) ---
+def fetch_shard_audit_log(hub_ids=None, entity=None, limit=200, shard_dir=SHARD_DIR):
+    # The newest audit records of each shard: (hub_id, id, created, actor_id, entity, entity_id, action, details)
+    hub_ids = list_shard_hubs(shard_dir) if hub_ids is None else hub_ids
+    where = "WHERE entity = ? " if entity else ""
+
+    def newest(hub_id):
+        conn = get_shard_connection(hub_id, shard_dir)
+        try:
+            return conn.execute(f"""
+                SELECT id, created, actor_id, entity, entity_id, action, details FROM audit_log
+                {where}ORDER BY id DESC LIMIT {int(limit)}""", (entity,) if entity else ()).fetchall()
+        finally:
+            conn.close()
+    results = fan_out(newest, hub_ids)
+    return [(hub_id, *row) for hub_id, rows in results.items() for row in rows]
+
+
+def verify_shard_audits(hub_ids=None, full=False, shard_dir=SHARD_DIR):
+    # Runs audit.verify_audit_chain in every shard (checkpoints are kept per shard);
+    # returns {hub_id: (records checked, problems)}
+    hub_ids = list_shard_hubs(shard_dir) if hub_ids is None else hub_ids
+
+    def verify(hub_id):
+        conn = get_shard_connection(hub_id, shard_dir)
+        try:
+            result = verify_audit_chain(conn, full=full)
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+    return fan_out(verify, hub_ids)
+
+
+# --- Migration from the single-file log ---
+def migrate_to_shards(db_file=DB_FILE, shard_dir=SHARD_DIR, timezones=None):
+    # timezones: {hub_id: timezone} for rebuilding each shard's KPI counters
+    src = sqlite3.connect(db_file)
+    try:
+        rows = src.execute("""
+            SELECT timestamp, sku, action, quantity, hub, user_id, comment
+            FROM inventory_log WHERE hub IS NOT NULL ORDER BY id""").fetchall()
+    finally:
+        src.close()
+    by_hub = {}
+    for row in rows:
+        by_hub.setdefault(int(row[4]), []).append(row)
+    for hub_id, hub_rows in by_hub.items():
+        # The shard log is append-only, so a re-run starts the shard file over from the main log
+        path = shard_path(hub_id, shard_dir)
+        if os.path.exists(path):
+            os.remove(path)
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            _ready.discard(path)
+        conn = get_shard_connection(hub_id, shard_dir)
+        try:
+            with conn:
+                conn.executemany("""
+                    INSERT INTO inventory_log (timestamp, sku, action, quantity, hub, user_id, comment)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)""", hub_rows)
+                conn.execute("""
+                    INSERT INTO hub_balances (sku, balance, updated)
+                    SELECT sku,
+                    SUM(CASE WHEN action IN ('IN', 'ADJUST') THEN quantity ELSE 0 END) -
+                    SUM(CASE WHEN action='OUT' THEN quantity ELSE 0 END), MAX(timestamp)
+                    FROM inventory_log GROUP BY sku""")
+                rebuild_kpis(conn, hub_id, (timezones or {}).get(hub_id, DEFAULT_TIMEZONE))
+        finally:
+            conn.close()
+    return {hub_id: len(hub_rows) for hub_id, hub_rows in by_hub.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split inventory_log into one database file per hub.")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--shard-dir", default=SHARD_DIR)
+    args = parser.parse_args()
+    settings_conn = sqlite3.connect(args.db)
+    try:
+        timezones = dict(settings_conn.execute("SELECT hub_id, timezone FROM hub_settings WHERE timezone IS NOT NULL"))
+    except sqlite3.OperationalError:
+        timezones = {}
+    finally:
+        settings_conn.close()
+    counts = migrate_to_shards(args.db, args.shard_dir, timezones)
+    for hub_id, count in sorted(counts.items()):
+        print(f"🏬 Hub {hub_id}: {count} log rows -> {shard_path(hub_id, args.shard_dir)}")
+    print(f"✅ Sharded {sum(counts.values())} rows. Start the app with {SHARDED_ENV}=1 to use them.")
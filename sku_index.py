@@ -0,0 +1,187 @@
+import sqlite3
+import time
+from bisect import bisect_left
+
+from bundles import expand_components, component_lines
+
+DB_FILE = "barcodes.db"
+MAX_AGE_SECONDS = 300  # pick up catalog edits made by the standalone scripts
+SEARCH_LIMIT = 25
+
+
+def hub_key(hub_id):
+    # inventory_log.hub is TEXT in older databases and session.txt gives strings
+    try:
+        return int(hub_id)
+    except (TypeError, ValueError):
+        return hub_id
+
+
+def sku_facets(sku):
+    # TTT-SOL-BLASOL-PLUS -> family "SOL", size "PLUS"
+    parts = sku.split("-")
+    family = parts[1] if len(parts) > 2 else None
+    size = parts[-1] if len(parts) > 2 else None
+    return family, size
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# --- In-memory barcode/SKU index ---
+class SkuIndex:
+    def __init__(self):
+        self.barcode_to_sku = {}
+        self.sku_to_name = {}
+        self.hub_skus = {}
+        self.sorted_skus = []
+        self.search_text = {}
+        self.trigrams = {}
+        self.facets = {}
+        self.expansions = {}
+        self.loaded_at = 0.0
+
+    def load(self, conn):
+        barcode_to_sku = {}
+        sku_to_name = {}
+        for sku, name, barcode in conn.execute("SELECT sku, name, barcode FROM products"):
+            sku_to_name[sku] = name
+            if barcode:
+                barcode_to_sku[str(barcode).strip()] = sku
+        hub_skus = {}
+        for hub_id, sku in conn.execute("SELECT hub_id, sku FROM hub_skus"):
+            hub_skus.setdefault(hub_key(hub_id), set()).add(sku)
+        try:
+            components = conn.execute("SELECT parent_sku, component_sku, quantity FROM product_components").fetchall()
+        except sqlite3.OperationalError:
+            components = []  # database not upgraded by the app yet
+        expansions = expand_components(components)
+        # A pack can be scanned wherever all of its units are stocked
+        for skus in hub_skus.values():
+            skus.update(parent for parent, parts in expansions.items() if all(sku in skus for sku, _ in parts))
+        search_text = {}
+        trigrams = {}
+        facets = {}
+        for sku, name in sku_to_name.items():
+            text = f"{sku} {name or ''}".lower()
+            search_text[sku] = text
+            for gram in _trigrams(text):
+                trigrams.setdefault(gram, set()).add(sku)
+            facets[sku] = sku_facets(sku)
+        # Swap in whole structures so readers never see a half-built index
+        self.barcode_to_sku = barcode_to_sku
+        self.sku_to_name = sku_to_name
+        self.hub_skus = {hub: frozenset(skus) for hub, skus in hub_skus.items()}
+        self.sorted_skus = sorted(sku_to_name)
+        self.search_text = search_text
+        self.trigrams = trigrams
+        self.facets = facets
+        self.expansions = expansions
+        self.loaded_at = time.time()
+        return self
+
+    def resolve(self, code):
+        # Accepts a scanned barcode or a typed SKU; returns the SKU or None
+        code = (code or "").strip()
+        if code in self.barcode_to_sku:
+            return self.barcode_to_sku[code]
+        code = code.upper()
+        return code if code in self.sku_to_name else None
+
+    def name(self, sku):
+        return self.sku_to_name.get(sku)
+
+    def is_bundle(self, sku):
+        return sku in self.expansions
+
+    def expand(self, sku, quantity):
+        # [(sku, quantity)] for a single unit, or the component lines of a pack/bundle
+        if sku in self.expansions:
+            return component_lines(self.expansions[sku], quantity)
+        return [(sku, int(quantity))]
+
+    def is_allowed(self, hub_id, sku):
+        return sku in self.hub_skus.get(hub_key(hub_id), ())
+
+    def skus_for_hub(self, hub_id):
+        return self.hub_skus.get(hub_key(hub_id), frozenset())
+
+    def prefix_search(self, prefix, limit=20, hub_id=None):
+        # SKU codes starting with a scanned or typed partial code, in code order
+        prefix = (prefix or "").strip().upper()
+        allowed = self.skus_for_hub(hub_id) if hub_id is not None else None
+        results = []
+        i = bisect_left(self.sorted_skus, prefix)
+        while i < len(self.sorted_skus) and len(results) < limit:
+            sku = self.sorted_skus[i]
+            if not sku.startswith(prefix):
+                break
+            if allowed is None or sku in allowed:
+                results.append(sku)
+            i += 1
+        return results
+
+    def search(self, query, limit=SEARCH_LIMIT, hub_id=None, family=None, size=None):
+        # Type-ahead over SKU codes and product names, best matches first
+        query = " ".join((query or "").lower().split())
+        candidates = self.skus_for_hub(hub_id) if hub_id is not None else self.sku_to_name.keys()
+        if len(query) >= 3:
+            grams = sorted((self.trigrams.get(g, set()) for g in _trigrams(query)), key=len)
+            if grams:
+                candidates = set(candidates).intersection(*grams)
+        scored = []
+        for sku in candidates:
+            sku_family, sku_size = self.facets.get(sku, (None, None))
+            if (family and sku_family != family) or (size and sku_size != size):
+                continue
+            text = self.search_text.get(sku, "")
+            pos = text.find(query)
+            if pos < 0:
+                continue
+            name = (self.sku_to_name.get(sku) or "").lower()
+            if f"-{query}" in f"-{sku.lower()}":
+                rank = 0
+            elif name.startswith(query):
+                rank = 1
+            elif f" {query}" in f" {name}":
+                rank = 2
+            else:
+                rank = 3
+            scored.append((rank, pos, sku))
+        scored.sort()
+        return [sku for _, _, sku in scored[:limit]]
+
+    def facet_counts(self, hub_id=None):
+        skus = self.skus_for_hub(hub_id) if hub_id is not None else self.sku_to_name.keys()
+        families = {}
+        sizes = {}
+        for sku in skus:
+            family, size = self.facets.get(sku, (None, None))
+            if family:
+                families[family] = families.get(family, 0) + 1
+            if size:
+                sizes[size] = sizes.get(size, 0) + 1
+        return {"family": families, "size": sizes}
+
+
+_index = None
+
+
+def refresh_sku_index(db_file=DB_FILE, connect=None):
+    # connect: optional connection factory, e.g. a storage backend's connect
+    global _index
+    conn = connect() if connect else sqlite3.connect(db_file, check_same_thread=False)
+    try:
+        index = SkuIndex().load(conn)
+    finally:
+        conn.close()
+    _index = index
+    return index
+
+
+def get_sku_index(db_file=DB_FILE, max_age=MAX_AGE_SECONDS, connect=None):
+    index = _index
+    if index is None or time.time() - index.loaded_at > max_age:
+        index = refresh_sku_index(db_file, connect)
+    return index
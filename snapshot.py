@@ -0,0 +1,60 @@
+import argparse
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+DB_FILE = "barcodes.db"
+SNAPSHOT_FILE = "barcodes_snapshot.db"
+MAX_AGE_SECONDS = 300
+BACKUP_PAGES = 256  # pages copied per step; the primary's read lock is dropped between steps
+BACKUP_SLEEP = 0.05
+
+
+# --- Read snapshot for analytics (refreshed by the worker: python snapshot.py --interval 300) ---
+def refresh_snapshot(db_file=DB_FILE, snapshot_file=SNAPSHOT_FILE, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP):
+    # Incremental online backup into a temp file, then swap it in so readers never see a
+    # partial copy. Writers get the primary back between steps instead of waiting out the copy.
+    tmp_file = snapshot_file + ".tmp"
+    src = sqlite3.connect(db_file)
+    dst = sqlite3.connect(tmp_file)
+    try:
+        src.backup(dst, pages=pages, sleep=sleep)
+    finally:
+        dst.close()
+        src.close()
+    os.replace(tmp_file, snapshot_file)
+    return snapshot_time(snapshot_file)
+
+
+def snapshot_time(snapshot_file=SNAPSHOT_FILE):
+    if not os.path.exists(snapshot_file):
+        return None
+    return datetime.fromtimestamp(os.path.getmtime(snapshot_file))
+
+
+def snapshot_age(snapshot_file=SNAPSHOT_FILE):
+    if not os.path.exists(snapshot_file):
+        return None
+    return time.time() - os.path.getmtime(snapshot_file)
+
+
+def get_snapshot_connection(db_file=DB_FILE, snapshot_file=SNAPSHOT_FILE):
+    # Never refreshes on the request path; until the worker has written a snapshot,
+    # reads go to the primary (read-only)
+    path = snapshot_file if os.path.exists(snapshot_file) else db_file
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the analytics snapshot of barcodes.db.")
+    parser.add_argument("--db", default=DB_FILE)
+    parser.add_argument("--interval", type=int, default=0, help="seconds between refreshes; 0 refreshes once")
+    args = parser.parse_args()
+    while True:
+        started = time.time()
+        refreshed = refresh_snapshot(args.db)
+        print(f"✅ Snapshot refreshed at {refreshed:%Y-%m-%d %H:%M:%S} ({time.time() - started:.1f}s)")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,188 @@
+import argparse
+import os
+from datetime import datetime, timedelta
+
+DB_FILE = "barcodes.db"
+ENFORCE_ENV = "TTT_ENFORCE_STOCK"  # set to 1 to refuse OUT movements that exceed available stock
+DEFAULT_HOLD_MINUTES = 30
+
+ACTIVE = "ACTIVE"
+RELEASED = "RELEASED"
+EXPIRED = "EXPIRED"
+FULFILLED = "FULFILLED"
+
+# Running balance per (hub, SKU), kept in the same transaction as every inventory_log insert,
+# so the availability check and the decrement are one conditional UPDATE.
+# reserved is the sum of the ACTIVE holds in stock_reservations.
+STOCK_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS stock_levels (
+        hub_id INTEGER, sku TEXT, on_hand INTEGER NOT NULL DEFAULT 0, reserved INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hub_id, sku)
+    )""",
+    """CREATE TABLE IF NOT EXISTS stock_reservations (
+        id {pk}, hub_id INTEGER, sku TEXT, quantity INTEGER, reference TEXT, user_id INTEGER,
+        created {ts}, expires {ts}, status TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_stock_reservations_status ON stock_reservations (status, hub_id, sku, expires)",
+]
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def enforcement_enabled():
+    return os.environ.get(ENFORCE_ENV, "") in ("1", "true", "yes")
+
+
+def _available(conn, hub_id, sku):
+    row = conn.execute("SELECT on_hand - reserved FROM stock_levels WHERE hub_id = ? AND sku = ?",
+                       (hub_id, sku)).fetchone()
+    return row[0] if row else 0
+
+
+# --- Movements ---
+def check_quantity(action, quantity):
+    # IN and OUT carry unsigned counts (ADJUST is signed); an OUT of -7 would add 7 units
+    if action in ("IN", "OUT") and int(quantity) <= 0:
+        raise ValueError(f"{action} quantity must be positive")
+
+
+def apply_stock(conn, hub_id, sku, action, quantity, enforce=None):
+    # Call on the inventory_log insert's transaction, before the insert. With enforcement on,
+    # an OUT only succeeds if it leaves the unreserved balance at or above zero.
+    enforce = enforcement_enabled() if enforce is None else enforce
+    check_quantity(action, quantity)
+    hub_id, quantity = int(hub_id), int(quantity)
+    if action == "OUT" and enforce:
+        c = conn.execute("""
+            UPDATE stock_levels SET on_hand = on_hand - ?
+            WHERE hub_id = ? AND sku = ? AND on_hand - reserved >= ?""", (quantity, hub_id, sku, quantity))
+        if c.rowcount == 0:
+            raise InsufficientStock(f"Only {_available(conn, hub_id, sku)} of {sku} available at hub {hub_id}")
+        return
+    # ADJUST quantities are already signed
+    delta = -quantity if action == "OUT" else quantity
+    conn.execute("""
+        INSERT INTO stock_levels (hub_id, sku, on_hand) VALUES (?, ?, ?)
+        ON CONFLICT(hub_id, sku) DO UPDATE SET on_hand = stock_levels.on_hand + excluded.on_hand""",
+        (hub_id, sku, delta))
+
+
+def lock_hub_stock(db, conn, hub_id):
+    # For reads that must not race the hub's postings (cycle counts). On SQLite db.begin_write
+    # already holds the database write lock; PostgreSQL locks the hub's balance rows, which
+    # every posting updates, until commit.
+    if db.name != "sqlite":
+        conn.execute("SELECT sku FROM stock_levels WHERE hub_id = ? FOR UPDATE", (int(hub_id),))
+
+
+# --- Reservations (start the transaction with db.begin_write; caller commits) ---
+def reserve_stock(db, conn, hub_id, sku, quantity, user_id, reference=None, minutes=DEFAULT_HOLD_MINUTES, now=None):
+    # Holds stock for a pending order; returns the reservation id
+    now = now or datetime.now()
+    hub_id, quantity = int(hub_id), int(quantity)
+    if quantity <= 0:
+        raise ValueError("Reservation quantity must be positive")
+    expire_reservations(conn, now, hub_id, sku)
+    c = conn.execute("""
+        UPDATE stock_levels SET reserved = reserved + ?
+        WHERE hub_id = ? AND sku = ? AND on_hand - reserved >= ?""", (quantity, hub_id, sku, quantity))
+    if c.rowcount == 0:
+        raise InsufficientStock(f"Only {_available(conn, hub_id, sku)} of {sku} available at hub {hub_id}")
+    return db.insert_id(conn.cursor(), """
+        INSERT INTO stock_reservations (hub_id, sku, quantity, reference, user_id, created, expires, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (hub_id, sku, quantity, reference, user_id, now, now + timedelta(minutes=minutes), ACTIVE))
+
+
+def release_reservation(conn, reservation_id, status=RELEASED, now=None, hub_id=None):
+    # Closes an active hold (optionally only if it belongs to hub_id) and returns its
+    # (hub_id, sku, quantity), or None if it was already closed. FULFILLED also requires
+    # the hold not to have expired; the caller then logs the OUT.
+    where, params = "", [status, int(reservation_id), ACTIVE]
+    if status == FULFILLED:
+        where += " AND expires > ?"
+        params.append(now or datetime.now())
+    if hub_id is not None:
+        where += " AND hub_id = ?"
+        params.append(int(hub_id))
+    c = conn.cursor()
+    c.execute(f"UPDATE stock_reservations SET status = ? WHERE id = ? AND status = ?{where}", params)
+    if c.rowcount == 0:
+        return None
+    c.execute("SELECT hub_id, sku, quantity FROM stock_reservations WHERE id = ?", (int(reservation_id),))
+    hub_id, sku, quantity = c.fetchone()
+    conn.execute("UPDATE stock_levels SET reserved = reserved - ? WHERE hub_id = ? AND sku = ?",
+                 (quantity, hub_id, sku))
+    return hub_id, sku, quantity
+
+
+def expire_reservations(conn, now=None, hub_id=None, sku=None):
+    # Releases holds past their expiry (all, or one hub/SKU); returns how many
+    now = now or datetime.now()
+    where, params = "", [ACTIVE, now]
+    if hub_id is not None:
+        where += " AND hub_id = ?"
+        params.append(int(hub_id))
+    if sku is not None:
+        where += " AND sku = ?"
+        params.append(sku)
+    c = conn.cursor()
+    c.execute(f"SELECT id FROM stock_reservations WHERE status = ? AND expires <= ?{where}", params)
+    expired = 0
+    for (reservation_id,) in c.fetchall():
+        expired += release_reservation(conn, reservation_id, EXPIRED) is not None
+    return expired
+
+
+def fetch_reservations(conn, hub_id):
+    c = conn.cursor()
+    c.execute("""
+        SELECT id, sku, quantity, reference, created, expires FROM stock_reservations
+        WHERE hub_id = ? AND status = ? ORDER BY expires""", (int(hub_id), ACTIVE))
+    return c.fetchall()
+
+
+def fetch_stock_levels(conn, hub_id):
+    # {sku: (on_hand, reserved)}
+    c = conn.cursor()
+    c.execute("SELECT sku, on_hand, reserved FROM stock_levels WHERE hub_id = ?", (int(hub_id),))
+    return {sku: (on_hand, reserved) for sku, on_hand, reserved in c.fetchall()}
+
+
+# --- Rebuild ---
+def rebuild_stock_levels(conn):
+    # Recount balances from inventory_log and holds from active reservations; caller commits
+    conn.execute("DELETE FROM stock_levels")
+    conn.execute("""
+        INSERT INTO stock_levels (hub_id, sku, on_hand)
+        SELECT CAST(hub AS INTEGER), sku,
+        SUM(CASE WHEN action IN ('IN', 'ADJUST') THEN quantity ELSE 0 END) -
+        SUM(CASE WHEN action = 'OUT' THEN quantity ELSE 0 END)
+        FROM inventory_log WHERE hub IS NOT NULL AND sku IS NOT NULL GROUP BY CAST(hub AS INTEGER), sku""")
+    c = conn.cursor()
+    c.execute("SELECT hub_id, sku, SUM(quantity) FROM stock_reservations WHERE status = ? GROUP BY hub_id, sku",
+              (ACTIVE,))
+    for hub_id, sku, quantity in c.fetchall():
+        conn.execute("""
+            INSERT INTO stock_levels (hub_id, sku, reserved) VALUES (?, ?, ?)
+            ON CONFLICT(hub_id, sku) DO UPDATE SET reserved = excluded.reserved""", (hub_id, sku, quantity))
+    c.execute("SELECT COUNT(*) FROM stock_levels")
+    return c.fetchone()[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild stock levels from inventory_log and expire old holds.")
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+    from storage import SQLiteBackend
+    db = SQLiteBackend(args.db)
+    db.create_tables()
+    conn = db.connect()
+    db.begin_write(conn)
+    expired = expire_reservations(conn)
+    count = rebuild_stock_levels(conn)
+    conn.commit()
+    conn.close()
+    print(f"✅ Stock levels rebuilt for {count} hub/SKU pairs ({expired} expired reservations released).")
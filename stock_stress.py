@@ -0,0 +1,123 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from storage import SQLiteBackend
+from hub_kpis import DEFAULT_TIMEZONE
+from postings import post_movement
+from stock_control import FULFILLED, RELEASED, InsufficientStock, reserve_stock, release_reservation, fetch_stock_levels
+
+HUB_ID = 1
+SKU = "STRESS-BLACK-SOLID"
+
+
+# Many packers racing for the same SKU with enforcement on: every OUT and reservation goes
+# through the same posting path the app uses (postings.py), and the totals are checked afterwards.
+def seed(db, stock):
+    db.create_tables()
+    conn = db.connect()
+    try:
+        db.begin_write(conn)
+        post_movement(db, conn, 0, SKU, "IN", stock, HUB_ID, "stress seed", datetime.now(), DEFAULT_TIMEZONE)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def post_out(db, conn, quantity, comment=None):
+    post_movement(db, conn, 0, SKU, "OUT", quantity, HUB_ID, comment, datetime.now(), DEFAULT_TIMEZONE, enforce=True)
+
+
+def worker(db, attempts, reserve_share, stats, lock):
+    mine = {"out": 0, "shipped": 0, "refused": 0, "errors": 0, "transactions": 0}
+    rng = random.Random()
+    for _ in range(attempts):
+        quantity = rng.randint(1, 3)
+        conn = db.connect()
+        try:
+            db.begin_write(conn)
+            if rng.random() < reserve_share:
+                # Hold, then ship or release it in a second transaction
+                reservation_id = reserve_stock(db, conn, HUB_ID, SKU, quantity, 0, "stress")
+                conn.commit()
+                db.begin_write(conn)
+                ship = rng.random() < 0.5
+                held = release_reservation(conn, reservation_id, FULFILLED if ship else RELEASED)
+                if ship and held:
+                    post_out(db, conn, quantity, f"Reservation #{reservation_id}")
+                    mine["shipped"] += quantity
+            else:
+                post_out(db, conn, quantity)
+                mine["out"] += quantity
+            conn.commit()
+            mine["transactions"] += 1
+        except InsufficientStock:
+            conn.rollback()
+            mine["refused"] += 1
+        except sqlite3.OperationalError:
+            conn.rollback()
+            mine["errors"] += 1
+        finally:
+            conn.close()
+    with lock:
+        for key, value in mine.items():
+            stats[key] += value
+
+
+def run(db, stock, threads, attempts, reserve_share):
+    seed(db, stock)
+    stats = {"out": 0, "shipped": 0, "refused": 0, "errors": 0, "transactions": 0}
+    lock = threading.Lock()
+    workers = [threading.Thread(target=worker, args=(db, attempts, reserve_share, stats, lock)) for _ in range(threads)]
+    started = time.time()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.time() - started
+    conn = db.connect()
+    try:
+        on_hand, reserved = fetch_stock_levels(conn, HUB_ID)[SKU]
+        logged = conn.execute("""
+            SELECT SUM(CASE WHEN action = 'OUT' THEN -quantity ELSE quantity END) FROM inventory_log
+            WHERE hub = ? AND sku = ?""", (HUB_ID, SKU)).fetchone()[0]
+    finally:
+        conn.close()
+    return stats, on_hand, reserved, logged, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent OUT/reservation stress run against a scratch database.")
+    parser.add_argument("--stock", type=int, default=500, help="starting units of the contested SKU")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--attempts", type=int, default=100, help="movements per thread")
+    parser.add_argument("--reserve-share", type=float, default=0.3, help="fraction of attempts that reserve first")
+    args = parser.parse_args()
+    path = os.path.join(tempfile.mkdtemp(prefix="ttt_stress_"), "stress.db")
+    stats, on_hand, reserved, logged, elapsed = run(SQLiteBackend(path), args.stock, args.threads, args.attempts,
+                                                    args.reserve_share)
+    shipped = stats["out"] + stats["shipped"]
+    total = args.threads * args.attempts
+    print(f"🧪 {args.threads} threads x {args.attempts} attempts on {args.stock} units ({path})")
+    print(f"   {shipped} units shipped, {stats['refused']} attempts refused, {stats['errors']} lock errors")
+    print(f"   {total / elapsed:.0f} attempts/s, {stats['transactions'] / elapsed:.0f} committed/s over {elapsed:.2f}s")
+    problems = []
+    if shipped > args.stock:
+        problems.append(f"oversold by {shipped - args.stock}")
+    if on_hand < 0 or on_hand - reserved < 0:
+        problems.append(f"negative balance (on hand {on_hand}, reserved {reserved})")
+    if on_hand != args.stock - shipped or logged != on_hand:
+        problems.append(f"balance {on_hand} disagrees with log {logged} / expected {args.stock - shipped}")
+    if reserved:
+        problems.append(f"{reserved} units still reserved")
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        sys.exit(1)
+    print(f"✅ No oversells: on hand {on_hand} matches the log.")
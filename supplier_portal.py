@@ -0,0 +1,133 @@
+import argparse
+import sqlite3
+from datetime import datetime
+
+DB_FILE = "barcodes.db"
+
+# Running fulfillment totals per (supplier, hub), bumped whenever shipments are registered,
+# so lead times are a primary-key read instead of a scan of request history
+SUPPLIER_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS supplier_lead_times (
+        supplier TEXT, hub_id INTEGER, fulfilled INTEGER DEFAULT 0, total_hours REAL DEFAULT 0,
+        last_fulfilled {ts}, PRIMARY KEY (supplier, hub_id)
+    )""",
+]
+
+# Request routing/fulfillment columns for databases created before the portal
+SUPPLIER_COLUMNS = [
+    ("supply_requests", "supplier", "TEXT"),
+    ("supply_requests", "sku", "TEXT"),
+    ("supply_requests", "requested_qty", "INTEGER"),
+    ("supply_requests", "confirmed_qty", "INTEGER"),
+    ("supply_requests", "confirmed_at", "{ts}"),
+    ("supply_requests", "fulfilled_at", "{ts}"),
+    ("shipments", "request_id", "INTEGER"),
+]
+SUPPLIER_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_supply_requests_supplier ON supply_requests (supplier, fulfilled_at)",
+]
+
+
+def _as_datetime(value):
+    # SQLite hands back the stored text, PostgreSQL a datetime
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+# --- Routing (HQ) ---
+def assign_supplier(conn, request_id, supplier, sku, requested_qty):
+    # Caller commits
+    conn.execute("""
+        UPDATE supply_requests SET supplier=?, sku=?, requested_qty=?, confirmed_qty=NULL, confirmed_at=NULL
+        WHERE id=? AND fulfilled_at IS NULL""", (supplier, sku, requested_qty, request_id))
+
+
+# --- Supplier side; every statement is scoped to the supplier's own requests ---
+def fetch_open_requests(conn, supplier):
+    c = conn.cursor()
+    c.execute("""
+        SELECT id, hub_id, timestamp, notes, sku, requested_qty, confirmed_qty FROM supply_requests
+        WHERE supplier=? AND fulfilled_at IS NULL ORDER BY timestamp""", (supplier,))
+    return c.fetchall()
+
+
+def confirm_quantities(conn, supplier, confirmations, timestamp):
+    # confirmations: {request_id: quantity}; caller commits
+    conn.executemany("""
+        UPDATE supply_requests SET confirmed_qty=?, confirmed_at=?
+        WHERE id=? AND supplier=? AND fulfilled_at IS NULL""",
+        [(int(qty), timestamp, int(request_id), supplier) for request_id, qty in confirmations.items()])
+
+
+def register_shipments(db, conn, supplier, shipments, timestamp):
+    # shipments: [(request_id, tracking, amount)]; one bulk insert, one batched update and
+    # one summary upsert per hub. Returns (registered, rejected request ids); caller commits.
+    open_requests = {row[0]: row for row in fetch_open_requests(conn, supplier)}
+    rows, fulfilled, rejected = [], [], []
+    lead_hours = {}
+    for request_id, tracking, amount in shipments:
+        request = open_requests.pop(int(request_id), None)
+        if request is None or not str(tracking or "").strip() or int(amount or 0) <= 0:
+            rejected.append(request_id)
+            continue
+        _, hub_id, requested_at, _, sku, _, _ = request
+        rows.append((timestamp, supplier, str(tracking).strip(), hub_id, sku, int(amount), request[0]))
+        fulfilled.append((timestamp, request[0]))
+        hours = (_as_datetime(timestamp) - _as_datetime(requested_at)).total_seconds() / 3600
+        count, total = lead_hours.get(hub_id, (0, 0.0))
+        lead_hours[hub_id] = (count + 1, total + hours)
+    if rows:
+        db.bulk_insert(conn, "shipments",
+                       ["date", "supplier", "tracking", "hub_id", "product", "amount", "request_id"], rows)
+        conn.executemany("UPDATE supply_requests SET fulfilled_at=? WHERE id=?", fulfilled)
+        for hub_id, (count, total) in lead_hours.items():
+            record_lead_times(conn, supplier, hub_id, count, total, timestamp)
+    return len(rows), rejected
+
+
+# --- Lead-time summary ---
+def record_lead_times(conn, supplier, hub_id, count, total_hours, timestamp):
+    conn.execute("""
+        INSERT INTO supplier_lead_times (supplier, hub_id, fulfilled, total_hours, last_fulfilled)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(supplier, hub_id) DO UPDATE SET
+        fulfilled = supplier_lead_times.fulfilled + excluded.fulfilled,
+        total_hours = supplier_lead_times.total_hours + excluded.total_hours,
+        last_fulfilled = excluded.last_fulfilled""", (supplier, hub_id, count, total_hours, timestamp))
+
+
+def fetch_lead_times(conn, supplier=None):
+    # (supplier, hub_id, fulfilled, avg_hours, last_fulfilled) rows
+    c = conn.cursor()
+    where = "WHERE supplier=? " if supplier is not None else ""
+    c.execute(f"""
+        SELECT supplier, hub_id, fulfilled, total_hours / fulfilled, last_fulfilled
+        FROM supplier_lead_times {where}ORDER BY supplier, hub_id""", (supplier,) if supplier is not None else ())
+    return c.fetchall()
+
+
+def rebuild_lead_times(conn):
+    # Recount from fulfilled requests, e.g. after editing history by hand; caller commits
+    conn.execute("DELETE FROM supplier_lead_times")
+    c = conn.cursor()
+    c.execute("""
+        SELECT supplier, hub_id, timestamp, fulfilled_at FROM supply_requests
+        WHERE supplier IS NOT NULL AND fulfilled_at IS NOT NULL ORDER BY fulfilled_at""")
+    totals = {}
+    for supplier, hub_id, requested_at, fulfilled_at in c.fetchall():
+        count, total, _ = totals.get((supplier, hub_id), (0, 0.0, None))
+        hours = (_as_datetime(fulfilled_at) - _as_datetime(requested_at)).total_seconds() / 3600
+        totals[(supplier, hub_id)] = (count + 1, total + hours, fulfilled_at)
+    for (supplier, hub_id), (count, total, last) in totals.items():
+        record_lead_times(conn, supplier, hub_id, count, total, last)
+    return len(totals)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild supplier lead-time summaries.")
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+    conn = sqlite3.connect(args.db)
+    count = rebuild_lead_times(conn)
+    conn.commit()
+    conn.close()
+    print(f"✅ Lead times rebuilt for {count} supplier/hub pairs.")